@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright © 2014 stephen.margheim@gmail.com
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Benchmarks for ZotQuery's data pipeline.
+
+Run from the repository root against a configured workflow:
+
+    python dev/_benchmarks.py [<benchmark> ...]
+
+With no arguments every benchmark is run.
+"""
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import json
+import sqlite3
+import subprocess
+from time import time
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', 'source')
+sys.path.insert(0, os.path.normpath(SOURCE))
+
+from zotquery import zq, config
+from zotquery.backend import fold
+
+
+def best_of(func, runs=3):
+    """Return the result of ``func`` and its fastest time over ``runs``."""
+    timings = []
+    for _ in range(runs):
+        start = time()
+        result = func()
+        timings.append(time() - start)
+    return result, min(timings)
+
+
+def report(name, old, new):
+    print('{:<28} {:>9.4f}s {:>9.4f}s {:>8.1f}x'.format(name, old, new,
+                                                        old / (new or 1e-9)))
+
+
+# -----------------------------------------------------------------------------
+# Benchmarks
+# -----------------------------------------------------------------------------
+
+def bench_to_json(runs=3):
+    """Per-item `_select` extraction vs. bulk extraction."""
+    backend = zq.backend
+    backend.con = sqlite3.connect(backend.cloned_sqlite)
+    try:
+        serial, serial_time = best_of(backend._extract_items_serial, runs)
+        bulk, bulk_time = best_of(backend._extract_items, runs)
+    finally:
+        backend.con.close()
+    # both paths must serialize to exactly the same JSON
+    assert json.dumps(serial) == json.dumps(bulk), 'Extraction output differs'
+    print('{} items'.format(len(bulk)))
+    report('to_json extraction', serial_time, bulk_time)
+
+
+def _build_index(path, rows, module, tokenizer=None):
+    """Build an FTS index at ``path`` from value tuples ``rows``."""
+    if os.path.exists(path):
+        os.unlink(path)
+    columns = ', '.join(config.FILTERS['general'])
+    if tokenizer:
+        columns = ', '.join([columns, tokenizer])
+    con = sqlite3.connect(path)
+    with con:
+        con.execute('CREATE VIRTUAL TABLE zotquery USING {}({})'.format(
+            module, columns))
+        # only the FTS table; rows start with the item key
+        con.executemany('INSERT INTO zotquery VALUES ({})'.format(
+            ', '.join('?' * len(config.FILTERS['general']))),
+            (row[1:] for row in rows))
+    con.close()
+
+
+def _query_time(path, queries, runs):
+    con = sqlite3.connect(path)
+    try:
+        def run():
+            for query in queries:
+                con.execute('SELECT key FROM zotquery WHERE zotquery '
+                            'MATCH ?', (query,)).fetchall()
+        return best_of(run, runs)[1]
+    finally:
+        con.close()
+
+
+def bench_indexes(runs=3):
+    """Two-database (unicode + folded) layout vs. one folding index."""
+    backend = zq.backend
+    old_db = backend.wf.cachefile('bench_unicode.db')
+    old_folded = backend.wf.cachefile('bench_folded.db')
+    new_db = backend.wf.cachefile('bench_single.db')
+    module = backend.fts_module()
+    tokenizer = backend.fts_tokenizer(module)
+
+    def rows(shadow=False):
+        return backend._index_rows(backend.generate_data(), shadow)
+
+    def build_old():
+        _build_index(old_db, rows(), module)
+        folded = (tuple(fold(value) for value in row) for row in rows())
+        _build_index(old_folded, folded, module)
+
+    def build_new():
+        _build_index(new_db, rows(shadow=not tokenizer), module, tokenizer)
+
+    _, old_time = best_of(build_old, runs)
+    _, new_time = best_of(build_new, runs)
+    old_size = os.path.getsize(old_db) + os.path.getsize(old_folded)
+    new_size = os.path.getsize(new_db)
+    print('{} index, {} folding'.format(
+        module, 'tokenizer' if tokenizer else 'shadow'))
+    report('index build', old_time, new_time)
+    print('{:<28} {:>9}K {:>9}K'.format('index size', old_size // 1024,
+                                         new_size // 1024))
+    # ASCII queries went to folded.db, unicode ones to the unicode db
+    ascii_queries = ['noel', 'muller', 'zizek', 'the']
+    unicode_queries = ['noël', 'müller', 'žižek']
+    old_query = (_query_time(old_folded, ascii_queries, runs) +
+                 _query_time(old_db, unicode_queries, runs))
+    new_query = _query_time(new_db, ascii_queries + unicode_queries, runs)
+    report('index queries', old_query, new_query)
+    for path in (old_db, old_folded, new_db):
+        os.unlink(path)
+
+
+# Imports `zotquery` and the search codepath, timing every import
+# like `python -X importtime` does (not available in Python 2).
+STARTUP_SCRIPT = """
+import sys, time, json, __builtin__
+real_import = __builtin__.__import__
+timings = {}
+def timed_import(name, *args, **kwargs):
+    start = time.time()
+    try:
+        return real_import(name, *args, **kwargs)
+    finally:
+        timings[name] = timings.get(name, 0) + time.time() - start
+__builtin__.__import__ = timed_import
+start = time.time()
+import zotquery
+from zotquery import search
+total = time.time() - start
+__builtin__.__import__ = real_import
+print(json.dumps({'total': total, 'timings': timings,
+                  'web': zotquery.zq._web is not None}))
+"""
+
+
+def bench_startup(runs=3):
+    """Import time of the search codepath, by module (its budget is
+    tested by `test_zotquery.StartupTests`)."""
+    def measure():
+        output = subprocess.check_output([sys.executable, '-c',
+                                          STARTUP_SCRIPT], cwd=SOURCE)
+        return json.loads(output.splitlines()[-1])
+    results = [measure() for _ in range(runs)]
+    best = min(results, key=lambda result: result['total'])
+    print('{:<28} {:>9.4f}s'.format('search startup', best['total']))
+    slowest = sorted(best['timings'].items(), key=lambda x: -x[1])[:5]
+    for (name, seconds) in slowest:
+        print('    {:<24} {:>9.4f}s (cumulative)'.format(name, seconds))
+    assert not best['web'], 'Searching constructed the web API client'
+
+
+BENCHMARKS = [
+    ('to_json', bench_to_json),
+    ('indexes', bench_indexes),
+    ('startup', bench_startup),
+]
+
+
+def main(names):
+    print('{:<28} {:>10} {:>10} {:>9}'.format('benchmark', 'old', 'new',
+                                                'speedup'))
+    for (name, bench) in BENCHMARKS:
+        if not names or name in names:
+            bench()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright © 2014 stephen.margheim@gmail.com
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Thin client for ZotQuery's resident server (see :mod:`zotquery.server`).
+
+Only the standard library is imported here, so a request answered by
+the server costs little more than starting the interpreter. Run as a
+script, this module starts the server itself.
+"""
+from __future__ import unicode_literals
+
+# Standard Library
+import os
+import sys
+import json
+import socket
+import tempfile
+
+# Actions the resident server answers (not `export`, which waits on
+# Zotero's web API for longer than the server's answer is waited for)
+SERVED = ('search', 'open')
+
+# Path of the server's Unix socket (kept short, as paths are limited)
+SOCKET = os.path.join(tempfile.gettempdir(),
+                      'zotquery-{}.sock'.format(os.getuid()))
+
+# Seconds to wait for the server's answer
+TIMEOUT = 10
+
+
+class ServerError(Exception):
+    """The resident server was sent a command, but didn't answer with
+    its output. The command may have run, in part or in full.
+    """
+
+
+def request(args):
+    """Have the resident server run ``args``.
+
+    :param args: command line arguments for `zotquery.py`
+    :type args: :class:`list`
+    :returns: output of the command, or ``None`` if the server is not
+        running, or did not run the command, and it must be run
+        in-process
+    :rtype: :class:`str`
+    :raises: :class:`ServerError` if the command was sent, but its
+        output never came back
+
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(TIMEOUT)
+    try:
+        try:
+            client.connect(SOCKET)
+        except socket.error:
+            return None
+        try:
+            client.sendall(json.dumps({'argv': args}).encode('utf-8') +
+                           b'\n')
+            reply = b''.join(iter(lambda: client.recv(65536), b''))
+        except socket.error as err:
+            raise ServerError('No reply to {}: {}'.format(args, err))
+    finally:
+        client.close()
+    try:
+        reply = json.loads(reply.decode('utf-8'))
+    except ValueError:
+        raise ServerError('No reply to {}'.format(args))
+    if reply.get('status') == 'ok':
+        return reply['output'].encode('utf-8')
+    # the server stops, rather than running requests, once outdated
+    if reply.get('status') == 'stopped':
+        return None
+    raise ServerError('{} failed: {}'.format(args, reply.get('error')))
+
+
+def start():
+    """Start the resident server in the background, unless it's running."""
+    from workflow.background import run_in_background
+    run_in_background('zotquery_server',
+                      ['/usr/bin/python', os.path.abspath(__file__)])
+
+
+def stop():
+    """Ask the resident server, if running, to exit."""
+    try:
+        request(['quit'])
+    except ServerError:
+        pass
+
+
+if __name__ == '__main__':
+    from zotquery import server
+    sys.exit(server.serve(SOCKET))
@@ -0,0 +1,785 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright © 2014 stephen.margheim@gmail.com
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+"""Tests of ZotQuery against a small, made-up Zotero library.
+
+Run from the `source` directory with the workflow's Python:
+
+    /usr/bin/python -m unittest test_zotquery
+"""
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+# ZotQuery's `Workflow()` reads its directories from Alfred's variables
+TEST_DIR = tempfile.mkdtemp(prefix='zotquery-test-')
+os.environ['alfred_workflow_bundleid'] = 'com.hackademic.zotquery.test'
+os.environ['alfred_workflow_data'] = os.path.join(TEST_DIR, 'data')
+os.environ['alfred_workflow_cache'] = os.path.join(TEST_DIR, 'cache')
+
+from zotquery import zq, config
+from zotquery import backend
+
+ZOTERO_DIR = os.path.join(TEST_DIR, 'zotero')
+ZOTERO_SQLITE = os.path.join(ZOTERO_DIR, 'zotero.sqlite')
+
+# The parts of Zotero's schema ZotQuery reads
+ZOTERO_SCHEMA = """
+CREATE TABLE items (itemID INTEGER PRIMARY KEY, itemTypeID INT NOT NULL,
+    dateAdded TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    dateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    clientDateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    libraryID INT, key TEXT NOT NULL, version INT NOT NULL DEFAULT 0,
+    synced INT NOT NULL DEFAULT 0, UNIQUE (libraryID, key));
+CREATE TABLE itemTypes (itemTypeID INTEGER PRIMARY KEY, typeName TEXT,
+    templateItemTypeID INT, display INT DEFAULT 1);
+CREATE TABLE creators (creatorID INTEGER PRIMARY KEY,
+    creatorDataID INT NOT NULL, dateAdded TIMESTAMP,
+    dateModified TIMESTAMP, clientDateModified TIMESTAMP, libraryID INT,
+    key TEXT NOT NULL);
+CREATE TABLE creatorData (creatorDataID INTEGER PRIMARY KEY,
+    firstName TEXT, lastName TEXT, shortName TEXT, fieldMode INT,
+    birthYear INT);
+CREATE TABLE creatorTypes (creatorTypeID INTEGER PRIMARY KEY,
+    creatorType TEXT);
+CREATE TABLE itemCreators (itemID INT NOT NULL, creatorID INT NOT NULL,
+    creatorTypeID INT NOT NULL DEFAULT 1, orderIndex INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (itemID, creatorID, creatorTypeID, orderIndex));
+CREATE TABLE fields (fieldID INTEGER PRIMARY KEY, fieldName TEXT,
+    fieldFormatID INT);
+CREATE TABLE itemData (itemID INT, fieldID INT, valueID,
+    PRIMARY KEY (itemID, fieldID));
+CREATE TABLE itemDataValues (valueID INTEGER PRIMARY KEY, value UNIQUE);
+CREATE TABLE groups (groupID INTEGER PRIMARY KEY,
+    libraryID INT NOT NULL UNIQUE, name TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '', editable INT NOT NULL DEFAULT 0,
+    filesEditable INT NOT NULL DEFAULT 0, etag TEXT NOT NULL DEFAULT '');
+CREATE TABLE collections (collectionID INTEGER PRIMARY KEY,
+    collectionName TEXT NOT NULL, parentCollectionID INT DEFAULT NULL,
+    dateAdded TIMESTAMP, dateModified TIMESTAMP,
+    clientDateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    libraryID INT, key TEXT NOT NULL, version INT NOT NULL DEFAULT 0,
+    synced INT NOT NULL DEFAULT 0);
+CREATE TABLE collectionItems (collectionID INT NOT NULL, itemID INT NOT NULL,
+    orderIndex INT NOT NULL DEFAULT 0, PRIMARY KEY (collectionID, itemID));
+CREATE TABLE tags (tagID INTEGER PRIMARY KEY, name TEXT NOT NULL,
+    type INT NOT NULL, dateAdded TIMESTAMP, dateModified TIMESTAMP,
+    clientDateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    libraryID INT, key TEXT NOT NULL, version INT NOT NULL DEFAULT 0,
+    synced INT NOT NULL DEFAULT 0);
+CREATE TABLE itemTags (itemID INT NOT NULL, tagID INT NOT NULL,
+    PRIMARY KEY (itemID, tagID));
+CREATE TABLE itemAttachments (itemID INTEGER PRIMARY KEY, sourceItemID INT,
+    linkMode INT, mimeType TEXT, charsetID INT, path TEXT,
+    originalPath TEXT, syncState INT DEFAULT 0, storageModTime INT,
+    storageHash TEXT);
+CREATE TABLE itemNotes (itemID INTEGER PRIMARY KEY, sourceItemID INT,
+    note TEXT, title TEXT);
+CREATE TABLE deletedItems (itemID INTEGER PRIMARY KEY,
+    dateDeleted DEFAULT CURRENT_TIMESTAMP NOT NULL);
+CREATE TABLE fulltextWords (wordID INTEGER PRIMARY KEY, word TEXT UNIQUE);
+CREATE TABLE fulltextItemWords (wordID INT, itemID INT,
+    PRIMARY KEY (wordID, itemID));
+CREATE TABLE fulltextItems (itemID INTEGER PRIMARY KEY, version INT,
+    indexedPages INT, totalPages INT, indexedChars INT, totalChars INT,
+    synced INT DEFAULT 0);
+INSERT INTO itemTypes (itemTypeID, typeName) VALUES
+    (1, 'note'), (2, 'book'), (4, 'journalArticle'), (14, 'attachment');
+INSERT INTO creatorTypes VALUES (1, 'author'), (2, 'editor');
+INSERT INTO fields VALUES (1, 'title', 0), (2, 'date', 0),
+    (3, 'publicationTitle', 0);
+"""
+
+# (key, type, title, creator's last name, collection IDs, tag IDs)
+ZOTERO_ITEMS = [
+    ('ITEM0001', 2, 'Epicurus on friendship', 'Margheim', [1], [1]),
+    ('ITEM0002', 4, 'Herodotus and the evidence of signs', 'Noël', [1, 2],
+     [1, 2]),
+    ('ITEM0003', 2, 'Ancient medicine', 'Vlastos', [2], [])
+]
+
+
+def make_zotero(path):
+    """Write a small Zotero library to ``path``.
+
+    Each of :data:`ZOTERO_ITEMS` is in the personal library, with an
+    attachment and a note as children of the first one.
+
+    """
+    con = sqlite3.connect(path)
+    con.executescript(ZOTERO_SCHEMA)
+    con.executemany("""INSERT INTO collections (collectionID, collectionName,
+                                                key) VALUES (?, ?, ?)""",
+                    [(1, 'Greek Philosophy', 'COLL0001'),
+                     (2, 'Sources', 'COLL0002')])
+    con.executemany("""INSERT INTO tags (tagID, name, type, key)
+                       VALUES (?, ?, 0, ?)""",
+                    [(1, 'to read', 'TAG00001'), (2, 'evidence', 'TAG00002')])
+    for (item_id, item) in enumerate(ZOTERO_ITEMS, 1):
+        (key, type_id, title, creator, collections, tags) = item
+        con.execute("""INSERT INTO items (itemID, itemTypeID, dateAdded,
+                                          dateModified, clientDateModified,
+                                          key, version)
+                       VALUES (?, ?, '2014-01-01 10:00:00',
+                               '2014-01-01 10:00:00',
+                               '2014-01-01 10:00:00', ?, 1)""",
+                    (item_id, type_id, key))
+        con.execute('INSERT INTO itemDataValues VALUES (?, ?)',
+                    (item_id, title))
+        con.execute('INSERT INTO itemData VALUES (?, 1, ?)',
+                    (item_id, item_id))
+        con.execute("""INSERT INTO creatorData (creatorDataID, firstName,
+                                                lastName, fieldMode)
+                       VALUES (?, 'Ann', ?, 0)""", (item_id, creator))
+        con.execute("""INSERT INTO creators (creatorID, creatorDataID, key)
+                       VALUES (?, ?, ?)""",
+                    (item_id, item_id, 'CREA%04d' % item_id))
+        con.execute('INSERT INTO itemCreators VALUES (?, ?, 1, 0)',
+                    (item_id, item_id))
+        con.executemany('INSERT INTO collectionItems VALUES (?, ?, 0)',
+                        [(collection, item_id) for collection in collections])
+        con.executemany('INSERT INTO itemTags VALUES (?, ?)',
+                        [(item_id, tag) for tag in tags])
+    con.execute("""INSERT INTO items (itemID, itemTypeID, dateAdded,
+                                      dateModified, clientDateModified, key)
+                   VALUES (10, 14, '2014-01-01 10:00:00',
+                           '2014-01-01 10:00:00', '2014-01-01 10:00:00',
+                           'ATTACH01')""")
+    con.execute("""INSERT INTO itemAttachments (itemID, sourceItemID,
+                                                linkMode, mimeType, path)
+                   VALUES (10, 1, 1, 'application/pdf',
+                           'storage:friendship.pdf')""")
+    con.execute("""INSERT INTO items (itemID, itemTypeID, dateAdded,
+                                      dateModified, clientDateModified, key)
+                   VALUES (11, 1, '2014-01-01 10:00:00',
+                           '2014-01-01 10:00:00', '2014-01-01 10:00:00',
+                           'NOTE0001')""")
+    con.execute("""INSERT INTO itemNotes VALUES (11, 1,
+                   '<div class="zotero-note znv1"><p>On Horace</p></div>',
+                   'On Horace')""")
+    con.commit()
+    con.close()
+
+
+def count_items(path):
+    con = sqlite3.connect(path)
+    try:
+        return con.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+    finally:
+        con.close()
+
+
+class FakeWorkflow(object):
+    """Collects the Alfred results a search sends."""
+    def __init__(self):
+        self.items = []
+        self.sent = False
+
+    def add_item(self, **item):
+        self.items.append(item)
+
+    def send_feedback(self):
+        self.sent = True
+
+
+class ZoteroTestCase(unittest.TestCase):
+    """Starts each test with a fresh Zotero library, and no ZotQuery data.
+
+    """
+    def setUp(self):
+        for path in (ZOTERO_DIR, config.WF.datadir, config.WF.cachedir):
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+        os.makedirs(os.path.join(ZOTERO_DIR, 'storage'))
+        make_zotero(ZOTERO_SQLITE)
+        config.WF.store_data('local_zotero', {
+            'original_sqlite': ZOTERO_SQLITE,
+            'internal_storage': os.path.join(ZOTERO_DIR, 'storage'),
+            'external_storage': '',
+            'prefs_js': '',
+            'prefs_signature': []
+        }, serializer='json')
+        config.WF.cache_data('output_settings', {
+            'app': 'Standalone',
+            'csl': 'chicago-author-date',
+            'fmt': 'Markdown'
+        })
+        zq._backend = None
+        # refreshes would start the background task indexing attachments
+        self.scheduled = 0
+        zq.backend.schedule_fulltext = self.schedule_fulltext
+
+    def schedule_fulltext(self):
+        self.scheduled += 1
+        return True
+
+    def zotero(self):
+        """Open a read-write connection to the test library."""
+        return sqlite3.connect(ZOTERO_SQLITE)
+
+    def refresh(self, full=False):
+        from zotquery import configure
+        configure.config_freshen('True' if full else 'False')
+
+
+#------------------------------------------------------------------------------
+# Cloning Zotero's database
+#------------------------------------------------------------------------------
+
+class CloneTests(ZoteroTestCase):
+
+    def clone(self):
+        self.assertTrue(zq.backend.update_clone())
+        clone_path = config.WF.datafile('zotquery.sqlite')
+        for suffix in ('-journal', '-wal'):
+            self.assertFalse(os.path.exists(clone_path + suffix))
+        return clone_path
+
+    def test_clone_leaves_out_uncommitted_writes(self):
+        writer = self.zotero()
+        writer.execute('BEGIN IMMEDIATE')
+        writer.execute("INSERT INTO items (itemTypeID, key) "
+                       "VALUES (2, 'PENDING1')")
+        try:
+            self.assertEqual(count_items(self.clone()), 5)
+        finally:
+            writer.rollback()
+            writer.close()
+
+    def test_clone_while_zotero_holds_its_lock(self):
+        writer = self.zotero()
+        writer.execute('PRAGMA locking_mode = EXCLUSIVE')
+        # small cache, so the uncommitted rows spill into the file
+        writer.execute('PRAGMA cache_size = 1')
+        writer.execute("INSERT INTO items (itemTypeID, key) "
+                       "VALUES (2, 'COMMITED')")
+        writer.commit()
+        writer.execute('BEGIN')
+        writer.executemany("INSERT INTO items (itemTypeID, key) "
+                           "VALUES (2, ?)",
+                           [('PENDING{}'.format(i),) for i in range(2000)])
+        try:
+            self.assertTrue(os.path.exists(ZOTERO_SQLITE + '-journal'))
+            self.assertEqual(count_items(self.clone()), 6)
+        finally:
+            writer.rollback()
+            writer.close()
+
+    def test_live_database_is_only_read_readonly(self):
+        from zotquery.lib import utils
+        with open(ZOTERO_SQLITE, 'rb') as f:
+            before = f.read()
+        path = zq.backend.zotero_sqlite()
+        con = zq.backend.connect_zotero()
+        try:
+            if utils.can_open_readonly():
+                self.assertEqual(path, ZOTERO_SQLITE)
+                with self.assertRaises(sqlite3.OperationalError):
+                    con.execute('DELETE FROM items')
+            else:
+                # SQLite without URIs reads the clone
+                self.assertEqual(path, config.WF.datafile('zotquery.sqlite'))
+        finally:
+            con.close()
+        from zotquery import configure
+        configure.config_freshen('True')
+        with open(ZOTERO_SQLITE, 'rb') as f:
+            self.assertEqual(f.read(), before)
+
+    def test_clone_in_wal_mode(self):
+        writer = self.zotero()
+        writer.execute('PRAGMA journal_mode = WAL')
+        writer.execute('PRAGMA wal_autocheckpoint = 0')
+        writer.execute("INSERT INTO items (itemTypeID, key) "
+                       "VALUES (2, 'INWALLOG')")
+        writer.commit()
+        try:
+            self.assertEqual(count_items(self.clone()), 6)
+        finally:
+            writer.close()
+
+
+#------------------------------------------------------------------------------
+# Syncing changes to Zotero's library
+#------------------------------------------------------------------------------
+
+class SyncTests(ZoteroTestCase):
+
+    def setUp(self):
+        super(SyncTests, self).setUp()
+        self.refresh(full=True)
+
+    def change(self, sql, params=()):
+        con = self.zotero()
+        con.execute(sql, params)
+        con.commit()
+        con.close()
+
+    def search(self, scope, query):
+        from zotquery import search
+        # results' `arg` is `<library ID>_<item key>`
+        return sorted(result['arg'].split('_')[-1] for result
+                      in search.search_for_items(scope, query)[0])
+
+    def test_renamed_collection_is_synced(self):
+        self.change("""UPDATE collections SET collectionName = 'Hellenistic'
+                       WHERE collectionID = 1""")
+        self.assertTrue(zq.backend.is_fresh()[0])
+        self.refresh()
+        item = zq.backend.get_items(['ITEM0002'])['ITEM0002']
+        self.assertEqual(sorted(collection['name'] for collection
+                                in item['zot-collections']),
+                         ['Hellenistic', 'Sources'])
+
+    def test_change_in_write_ahead_log_is_synced(self):
+        writer = self.zotero()
+        writer.execute('PRAGMA journal_mode = WAL')
+        writer.execute('PRAGMA wal_autocheckpoint = 0')
+        try:
+            self.refresh()
+            self.assertFalse(zq.backend.is_fresh()[0])
+            writer.execute("""UPDATE collections
+                              SET collectionName = 'Hellenistic'
+                              WHERE collectionID = 1""")
+            writer.commit()
+            self.assertTrue(zq.backend.is_fresh()[0])
+        finally:
+            writer.close()
+
+    def test_rebuild_waits_for_refresh(self):
+        import fcntl
+        import threading
+        self.change("""UPDATE collections SET collectionName = 'Hellenistic'
+                       WHERE collectionID = 1""")
+        lock = open(config.WF.cachefile('refresh.lock'), 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # another process's refresh, ending a little later
+        threading.Timer(0.2, lock.close).start()
+        self.refresh(full=True)
+        self.assertEqual(self.search('general', 'hellenistic'),
+                         ['ITEM0001', 'ITEM0002'])
+
+    def test_serial_extraction_matches_bulk(self):
+        import json
+        con = self.zotero()
+        con.executemany("""INSERT INTO groups (groupID, libraryID, name)
+                           VALUES (?, ?, ?)""",
+                        [(1, 2, 'Stoics'), (2, 3, 'Sceptics')])
+        con.execute("""INSERT INTO collections (collectionID, collectionName,
+                                                libraryID, key)
+                       VALUES (3, 'Pyrrho', 3, 'COLL0003')""")
+        con.execute("""INSERT INTO items (itemID, itemTypeID, libraryID, key)
+                       VALUES (20, 2, 3, 'GROUP001')""")
+        con.execute('INSERT INTO collectionItems VALUES (3, 20, 0)')
+        con.commit()
+        con.close()
+        zq.backend.con = zq.backend.connect_zotero()
+        try:
+            serial = zq.backend._extract_items_serial()
+            bulk = zq.backend._extract_items()
+        finally:
+            zq.backend.con.close()
+        self.assertEqual(bulk['GROUP001']['zot-collections'][0]['group'],
+                         'Sceptics')
+        self.assertEqual(json.dumps(serial), json.dumps(bulk))
+
+    def test_renamed_collection_is_searchable(self):
+        self.change("""UPDATE collections SET collectionName = 'Hellenistic'
+                       WHERE collectionID = 1""")
+        self.assertTrue(zq.backend.is_fresh()[0])
+        self.refresh()
+        self.assertEqual(self.search('general', 'hellenistic'),
+                         ['ITEM0001', 'ITEM0002'])
+        self.assertEqual(self.search('general', 'greek'), [])
+        from zotquery import search
+        self.assertEqual([group['title'] for group
+                          in search.search_for_groups('collections', 'hel')],
+                         ['Hellenistic'])
+
+    def test_renamed_tag_is_searchable(self):
+        self.change("UPDATE tags SET name = 'semeion' WHERE tagID = 2")
+        self.refresh()
+        self.assertEqual(self.search('general', 'semeion'), ['ITEM0002'])
+
+    def test_deleted_note_leaves_parent(self):
+        self.assertEqual(self.search('notes', 'horace'), ['ITEM0001'])
+        # leave the parent older than the last sync
+        self.change("""UPDATE items SET dateModified = '2015-01-01 10:00:00',
+                       clientDateModified = '2015-01-01 10:00:00'
+                       WHERE itemID = 3""")
+        self.refresh()
+        self.change('DELETE FROM itemNotes WHERE itemID = 11')
+        self.change('DELETE FROM items WHERE itemID = 11')
+        self.assertTrue(zq.backend.is_fresh()[0])
+        self.refresh()
+        self.assertEqual(self.search('notes', 'horace'), [])
+        item = zq.backend.get_items(['ITEM0001'])['ITEM0001']
+        self.assertEqual(item['notes'], [])
+
+
+#------------------------------------------------------------------------------
+# Searching
+#------------------------------------------------------------------------------
+
+class SearchTests(ZoteroTestCase):
+
+    def setUp(self):
+        super(SearchTests, self).setUp()
+        self.refresh(full=True)
+        self.limit = config.RESULTS_LIMIT
+
+    def tearDown(self):
+        config.RESULTS_LIMIT = self.limit
+
+    def pages(self, scope, query):
+        from zotquery import search
+        (keys, offset, more) = ([], 0, True)
+        while more:
+            (results, more) = search.search_for_items(scope, query, offset)
+            keys.extend(result['arg'].split('_')[-1] for result in results)
+            offset += config.RESULTS_LIMIT
+        return keys
+
+    def test_pages_of_narrowed_results(self):
+        from zotquery import search
+        search.search_for_items('general', 't')
+        # narrowed from `t`'s results, whose order differs from `to`'s
+        config.RESULTS_LIMIT = 1
+        self.assertEqual(sorted(self.pages('general', 'to')),
+                         ['ITEM0001', 'ITEM0002'])
+
+    def test_search_after_query_without_tokens(self):
+        from zotquery import search
+        for query in ('', ' ', '.'):
+            search.search_for_items('general', query)
+        self.assertEqual(self.pages('general', 'vlastos'), ['ITEM0003'])
+
+    def test_feedback_of_new_formatting_version(self):
+        fingerprint = zq.backend.feedback_fingerprint()
+        version = backend.FEEDBACK_VERSION
+        backend.FEEDBACK_VERSION = version + 1
+        try:
+            self.assertNotEqual(zq.backend.feedback_fingerprint(),
+                                fingerprint)
+        finally:
+            backend.FEEDBACK_VERSION = version
+
+    def test_item_formatter_fails_on(self):
+        from zotquery import results
+        prepare = results.ResultsFormatter.prepare_item_feedback
+
+        def failing(formatter):
+            if formatter.item['key'] == 'ITEM0002':
+                raise ValueError('Cannot format')
+            return prepare(formatter)
+
+        results.ResultsFormatter.prepare_item_feedback = failing
+        try:
+            self.refresh(full=True)
+        finally:
+            results.ResultsFormatter.prepare_item_feedback = prepare
+        con = sqlite3.connect(zq.backend.fts_sqlite)
+        try:
+            rows = con.execute("""SELECT key FROM feedback
+                                  WHERE data IS NULL""").fetchall()
+        finally:
+            con.close()
+        self.assertEqual(rows, [('ITEM0002',)])
+        # formatted on demand instead
+        self.assertEqual(sorted(self.pages('general', 'e')),
+                         ['ITEM0001', 'ITEM0002'])
+
+    def test_malformed_query(self):
+        from zotquery import search
+        # FTS4's queries can't quote punctuation
+        config.USE_FTS5 = False
+        try:
+            self.refresh(full=True)
+        finally:
+            config.USE_FTS5 = True
+        db = zq.backend.fts_sqlite
+        with self.assertRaises(search.InvalidQuery):
+            search.count_item_matches(db, 'fts4', 'general',
+                                      'title:friend)*', 'friend)')
+        with self.assertRaises(search.InvalidQuery):
+            search.get_name_hits(db, 'general', 'margheim friend)',
+                                 'title:margheim* OR title:friend)*')
+        with self.assertRaises(search.InvalidQuery):
+            search.get_item_matches(db, 'general', 'title:friend)*',
+                                    'friend)', [1, 2])
+        zq.backend.schedule_refresh = lambda: False
+        feedback = FakeWorkflow()
+        search.search('general', 'friend)', feedback)
+        self.assertEqual(feedback.items, [{'title': 'Invalid query'}])
+
+
+#------------------------------------------------------------------------------
+# Indexing attachments' text
+#------------------------------------------------------------------------------
+
+class FulltextTests(ZoteroTestCase):
+
+    def setUp(self):
+        super(FulltextTests, self).setUp()
+        cache_dir = os.path.join(ZOTERO_DIR, 'storage', 'ATTACH01')
+        os.makedirs(cache_dir)
+        with open(os.path.join(cache_dir, backend.FULLTEXT_CACHE), 'w') as f:
+            f.write('the pleasures of friendship')
+
+    def touch(self, item_id, year):
+        con = self.zotero()
+        modified = '{}-01-01 10:00:00'.format(year)
+        con.execute("""UPDATE items
+                       SET dateModified = ?, clientDateModified = ?,
+                           version = ?
+                       WHERE itemID = ?""",
+                    (modified, modified, year, item_id))
+        con.commit()
+        con.close()
+
+    def test_refresh_only_queues_attachments(self):
+        self.refresh(full=True)
+        self.assertFalse(os.path.exists(zq.backend.fulltext_sqlite))
+        self.assertEqual(zq.backend.fulltext_queue(),
+                         set([backend.ALL_ATTACHMENTS]))
+        self.assertTrue(self.scheduled)
+
+    def test_fulltext_task_empties_queue(self):
+        self.refresh(full=True)
+        zq.backend.update_fulltext_index()
+        self.assertEqual(zq.backend.fulltext_queue(), set())
+        con = sqlite3.connect(zq.backend.fulltext_sqlite)
+        try:
+            rows = con.execute("SELECT rowid FROM fulltext "
+                               "WHERE fulltext MATCH 'friendship'").fetchall()
+        finally:
+            con.close()
+        self.assertEqual(rows, [(10,)])
+
+    def test_results_cache_dropped_once_per_update(self):
+        con = self.zotero()
+        con.execute("""INSERT INTO items (itemID, itemTypeID, key)
+                       VALUES (12, 14, 'ATTACH02')""")
+        con.execute("""INSERT INTO itemAttachments (itemID, sourceItemID,
+                                                    linkMode, mimeType, path)
+                       VALUES (12, 3, 1, 'application/pdf',
+                               'storage:medicine.pdf')""")
+        con.commit()
+        con.close()
+        cache_dir = os.path.join(ZOTERO_DIR, 'storage', 'ATTACH02')
+        os.makedirs(cache_dir)
+        with open(os.path.join(cache_dir, backend.FULLTEXT_CACHE), 'w') as f:
+            f.write('on ancient medicine')
+        self.refresh(full=True)
+        generations = []
+        zq.backend._new_generation = generations.append
+        batch_size = config.FULLTEXT_BATCH_SIZE
+        config.FULLTEXT_BATCH_SIZE = 1
+        try:
+            zq.backend.update_fulltext_index()
+        finally:
+            config.FULLTEXT_BATCH_SIZE = batch_size
+        self.assertEqual(len(generations), 1)
+
+    def test_incremental_refresh_queues_changed_attachments(self):
+        self.refresh(full=True)
+        # items last modified when the library was synced are synced again
+        self.touch(2, 2015)
+        self.refresh()
+        zq.backend.update_fulltext_index()
+        self.touch(3, 2016)
+        self.refresh()
+        self.assertEqual(zq.backend.fulltext_queue(), set())
+        self.touch(1, 2017)
+        self.refresh()
+        self.assertEqual(zq.backend.fulltext_queue(), set([10]))
+
+
+class ExtractTests(unittest.TestCase):
+
+    def setUp(self):
+        from zotquery import extract
+        self.extract = extract
+        self.tool = os.path.join(TEST_DIR, 'pdftotext')
+
+    def fake_pdftotext(self, script):
+        with open(self.tool, 'w') as f:
+            f.write('#!/bin/sh\n' + script + '\n')
+        os.chmod(self.tool, 0o755)
+
+    def test_hung_extractor_is_killed(self):
+        self.fake_pdftotext('sleep 30')
+        timeout = config.FULLTEXT_TIMEOUT
+        config.FULLTEXT_TIMEOUT = 0.5
+        try:
+            result = self.extract.extract((1, None, 'hung.pdf', self.tool))
+        finally:
+            config.FULLTEXT_TIMEOUT = timeout
+        self.assertEqual(result, (1, None))
+
+    def test_only_indexed_text_is_read(self):
+        self.fake_pdftotext('yes friendship')
+        max_bytes = self.extract.MAX_BYTES
+        self.extract.MAX_BYTES = 1000
+        try:
+            text = self.extract.pdf_text('endless.pdf', self.tool)
+        finally:
+            self.extract.MAX_BYTES = max_bytes
+        self.assertEqual(len(text), 1000)
+
+    def test_only_indexed_parts_of_epub_are_read(self):
+        import zipfile
+        path = os.path.join(TEST_DIR, 'long.epub')
+        with zipfile.ZipFile(path, 'w') as archive:
+            for i in range(10):
+                archive.writestr('chapter{}.xhtml'.format(i),
+                                 '<p>friendship</p>' * 100)
+        max_bytes = self.extract.MAX_BYTES
+        self.extract.MAX_BYTES = 2500
+        try:
+            text = self.extract.epub_text(path)
+        finally:
+            self.extract.MAX_BYTES = max_bytes
+        # the whole of the first chapter and a bit of the second
+        self.assertEqual(text.split().count('friendship'), 147)
+
+    def test_extract_all_in_batches(self):
+        tasks = []
+        for i in range(25):
+            path = os.path.join(TEST_DIR, 'cache{}.txt'.format(i))
+            with open(path, 'w') as f:
+                f.write('text {}'.format(i))
+            tasks.append((i, path, None, None))
+        results = dict(self.extract.extract_all(tasks, 2, 4))
+        self.assertEqual(results, dict((i, 'text {}'.format(i))
+                                       for i in range(25)))
+
+
+#------------------------------------------------------------------------------
+# Resident server
+#------------------------------------------------------------------------------
+
+class ServerTests(ZoteroTestCase):
+
+    def setUp(self):
+        super(ServerTests, self).setUp()
+        import resident
+        from zotquery import server
+        self.resident = resident
+        self.server_module = server
+        self.socket = resident.SOCKET
+        resident.SOCKET = os.path.join(TEST_DIR, 'test.sock')
+        self.server = server.ResidentServer(resident.SOCKET)
+        self.actions = dict(server.ACTIONS)
+
+    def tearDown(self):
+        self.server.server_close()
+        self.server_module.ACTIONS.update(self.actions)
+        self.resident.SOCKET = self.socket
+
+    def serve_one(self):
+        import threading
+        thread = threading.Thread(target=self.server.handle_request)
+        thread.start()
+        return thread
+
+    def test_socket_is_private(self):
+        mode = os.stat(self.resident.SOCKET).st_mode
+        self.assertEqual(mode & 0o777, 0o600)
+
+    def test_failed_command_is_not_run_again(self):
+        calls = []
+
+        def open_item(flag, arg, wf):
+            calls.append(arg)
+            raise ValueError('Open failed')
+
+        self.server_module.ACTIONS['open'] = open_item
+        thread = self.serve_one()
+        with self.assertRaises(self.resident.ServerError):
+            self.resident.request(['open', 'item', '0_ITEM0001'])
+        thread.join()
+        self.assertEqual(calls, ['0_ITEM0001'])
+
+    def test_command_runs_in_process_without_server(self):
+        self.server.server_close()
+        os.unlink(self.resident.SOCKET)
+        self.assertIsNone(self.resident.request(['search', 'general', 'x']))
+
+    def test_outdated_server_runs_nothing(self):
+        self.server.started = 0
+        thread = self.serve_one()
+        self.assertIsNone(self.resident.request(['search', 'general', 'x']))
+        thread.join()
+        self.assertTrue(self.server.stopping)
+
+    def test_all_code_is_watched(self):
+        files = self.server_module.source_files()
+        for name in ('resident.py', 'zotquery.py',
+                     os.path.join('workflow', 'workflow.py'),
+                     os.path.join('zotquery', 'lib', 'utils.py'),
+                     os.path.join('zotquery', 'server.py')):
+            self.assertTrue(any(path.endswith(os.sep + name)
+                                for path in files), name)
+
+
+
+#------------------------------------------------------------------------------
+# Starting up
+#------------------------------------------------------------------------------
+
+# Seconds `zotquery.py search` may take to import what it needs
+# (`dev/_benchmarks.py startup` breaks the time down by module)
+STARTUP_BUDGET = 0.3
+
+# Imports `zotquery` and the search codepath, as `zotquery.py search` does
+STARTUP_SCRIPT = """
+import json, time
+start = time.time()
+import zotquery
+from zotquery import search
+print(json.dumps({'total': time.time() - start,
+                  'web': zotquery.zq._web is not None}))
+"""
+
+
+class StartupTests(unittest.TestCase):
+
+    def start(self):
+        """Run :data:`STARTUP_SCRIPT`; get its result and its log."""
+        import json
+        import subprocess
+        source_dir = os.path.dirname(os.path.abspath(__file__))
+        proc = subprocess.Popen([sys.executable, '-c', STARTUP_SCRIPT],
+                                cwd=source_dir, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        (output, log) = proc.communicate()
+        self.assertEqual(proc.returncode, 0, log)
+        return (json.loads(output.splitlines()[-1]), log)
+
+    def test_search_starts_within_budget(self):
+        best = min((self.start()[0] for _ in range(3)),
+                   key=lambda result: result['total'])
+        self.assertFalse(best['web'])
+        self.assertLessEqual(best['total'], STARTUP_BUDGET)
+
+    def test_import_checks_for_no_update(self):
+        log = self.start()[1]
+        self.assertNotIn(b'Checking for update', log)
+        self.assertNotIn(b'Update check not due', log)
+
+def tearDownModule():
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
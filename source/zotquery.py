@@ -10,20 +10,31 @@ from __future__ import unicode_literals
 # Standard Library
 import sys
 
+# Thin client of the resident server
+import resident
+
+# Let the resident server answer, if it is running
+if __name__ == '__main__' and sys.argv[1:2] and \
+        sys.argv[1] in resident.SERVED:
+    try:
+        output = resident.request([arg.decode('utf-8')
+                                   for arg in sys.argv[1:]])
+    except resident.ServerError as err:
+        # searching again is harmless; exporting or opening again is not
+        if sys.argv[1] != 'search':
+            sys.stderr.write('{}\n'.format(err))
+            sys.exit(1)
+        output = None
+    if output is not None:
+        sys.stdout.write(output)
+        sys.exit(0)
+
 # Internal Dependencies
 from zotquery import config
 from zotquery.lib.docopt import docopt
 
-# Alfred-Workflow
-from workflow import Workflow
-from zotquery import search, export, append, store, open, configure, scan
-
-# create global methods from `Workflow()`
-WF = Workflow(update_settings={
-    'github_slug': 'smargh/alfred_zotquery',
-    'version': config.__version__,
-    'frequency': 7
-})
+# the workflow's shared `Workflow()`; each codepath imports its own module
+WF = config.WF
 
 
 class ZotWorkflow(object):
@@ -66,24 +77,36 @@ class ZotWorkflow(object):
                     raise ValueError('Unknown action: {}'.format(action))
 
     def search_codepath(self):
+        from zotquery import search
         return search.search(self.flag, self.arg, self.wf)
 
     def export_codepath(self):
+        from zotquery import export
         return export.export(self.flag, self.arg, self.wf)
 
     def append_codepath(self):
+        from zotquery import append
         return append.append(self.flag, self.arg, self.wf)
 
     def store_codepath(self):
+        from zotquery import store
         return store.store(self.flag, self.arg, self.wf)
 
     def open_codepath(self):
-        return open.open(self.flag, self.arg, self.wf)
+        from zotquery import open as zq_open
+        return zq_open.open(self.flag, self.arg, self.wf)
 
     def configure_codepath(self):
-        return configure.configure(self.flag, self.arg, self.wf)
+        from zotquery import configure
+        try:
+            return configure.configure(self.flag, self.arg, self.wf)
+        finally:
+            # the resident server would keep using the old settings
+            if self.flag in ('api', 'prefs', 'all'):
+                resident.stop()
 
     def scan_codepath(self):
+        from zotquery import scan
         return scan.scan(self.flag, self.arg, self.wf)
 
 
@@ -106,8 +129,14 @@ def main(wf):
     config.log.info('Input arguments : {}'.format(args))
     pd = ZotWorkflow(wf)
     res = pd.run(argv)
+    # have the resident server answer the next request
+    if args and args[0] in resident.SERVED:
+        resident.start()
     if res:
         print(res)
 
 if __name__ == '__main__':
+    # the shared `Workflow()` checks for updates only here
+    WF._update_settings = config.UPDATE_SETTINGS
+    WF.check_update()
     sys.exit(WF.run(main))
@@ -1,28 +1,33 @@
 #!/usr/bin/python
 # encoding: utf-8
-from workflow import Workflow
-WF = Workflow()
-
-from zotero import api
-from backend import data
+from config import WF
 
 
 class ZotQuery(object):
+    """Each part of ZotQuery is only built once it is first used, so
+    codepaths don't pay for (e.g.) Keychain look-ups they don't need.
+
+    """
     def __init__(self):
-        self._backend = data(WF)
-        self._web = api(WF)
-        self._local = self._backend.zotero
+        self._backend = None
+        self._web = None
 
     @property
     def backend(self):
+        if self._backend is None:
+            from backend import data
+            self._backend = data(WF)
         return self._backend
 
     @property
     def web(self):
+        if self._web is None:
+            from zotero import api
+            self._web = api(WF)
         return self._web
 
     @property
     def local(self):
-        return self._local
+        return self.backend.zotero
 
 zq = ZotQuery()
@@ -9,29 +9,88 @@ from __future__ import unicode_literals
 
 # Standard Library
 import os
-import re
+import json
+import uuid
 import struct
+import hashlib
 import sqlite3
 import os.path
 from time import time
+from itertools import islice
 from shutil import copyfile
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 
 # Internal Dependencies
 import config
 from lib import pashua, utils
 from zotero import zot
+from cache import normalize, trigrams
+from connections import pool
+from settings import file_signature
 from config import PropertyBase, stored_property
 
 # Alfred-Workflow
-from workflow import Workflow
+from workflow.workflow import isascii
 
 # create global methods from `Workflow()`
-WF = Workflow()
+WF = config.WF
 log = WF.logger
 decode = WF.decode
 fold = WF.fold_to_ascii
 
+# Seconds to wait for Zotero's lock before reading its database another way
+LIVE_TIMEOUT = 0.5
+
+# Version of the layout of ``fts_sqlite``; older indexes are rebuilt
+INDEX_SCHEMA = 6
+
+# Version of the layout of ``fulltext_sqlite``; older indexes are rebuilt
+FULLTEXT_SCHEMA = 2
+
+# File in an attachment's storage directory holding its extracted text
+FULLTEXT_CACHE = '.zotero-ft-cache'
+
+# Entry of the full text queue (see `queue_fulltext`) standing for every
+# attachment; Zotero's `itemID`s start at 1
+ALL_ATTACHMENTS = 0
+
+# Version of the formatting of items' Alfred results; bump it whenever
+# results should be formatted again (see `feedback_fingerprint`)
+FEEDBACK_VERSION = 1
+
+# Insert an item's formatted Alfred result, under the item's ``id``
+FEEDBACK_INSERT = """INSERT INTO feedback (id, key, data)
+                     VALUES ((SELECT id FROM items WHERE key = ?), ?, ?)"""
+
+# Insert one of an item's names, and one of their trigrams, by item key
+NAMES_INSERT = """INSERT INTO names (item_id, field, name)
+                  VALUES ((SELECT id FROM items WHERE key = ?), ?, ?)"""
+TRIGRAMS_INSERT = """INSERT OR IGNORE INTO trigrams (gram, item_id)
+                     VALUES (?, (SELECT id FROM items WHERE key = ?))"""
+
+# Row count and a checksum of each of Zotero's tables that ZotQuery's
+# data is built from, for the sync manifest (see `_sync_state`)
+MANIFEST_TABLES = OrderedDict([
+    ('items', 'TOTAL(itemID)'),
+    ('deletedItems', 'TOTAL(itemID)'),
+    ('itemData', 'TOTAL(itemID * fieldID + valueID)'),
+    ('itemCreators', 'TOTAL(itemID * creatorID + orderIndex)'),
+    ('collections', 'TOTAL(collectionID + COALESCE(parentCollectionID, 0))'),
+    ('collectionItems', 'TOTAL(collectionID * itemID)'),
+    ('tags', 'TOTAL(tagID)'),
+    ('itemTags', 'TOTAL(itemID * tagID)'),
+    ('itemAttachments', 'TOTAL(itemID + COALESCE(sourceItemID, 0))'),
+    ('itemNotes', 'TOTAL(itemID + COALESCE(sourceItemID, 0))'),
+    ('fulltextItems', 'TOTAL(itemID * COALESCE(version, 0) + '
+                      'COALESCE(indexedChars, 0))')
+])
+
+# PRAGMAs used while bulk-loading an FTS database. The previous values
+# are restored once the load has finished.
+BUILD_PRAGMAS = (('journal_mode', 'MEMORY'),
+                 ('synchronous', 'OFF'),
+                 ('cache_size', '-65536'))
+
 
 #------------------------------------------------------------------------------
 # :class:`ZotqueryBackend` ----------------------------------------------------
@@ -40,12 +99,12 @@ fold = WF.fold_to_ascii
 class ZotqueryBackend(PropertyBase):
     """Contains all relevant information about this workflow.
 
-    |       Key       |                 Description                  |
-    |-----------------|----------------------------------------------|
-    | `cloned_sqlite` | ZotQuery's clone of Zotero's sqlite database |
-    | `json_data`     | ZotQuery's JSON clone of Zotero's sqlite     |
-    | `fts_sqlite`    | ZotQuery's Full Text Search database         |
-    | `folded_sqlite` | ZotQuery's ASCII-only FTS database           |
+    |       Key         |                 Description                  |
+    |-------------------|----------------------------------------------|
+    | `cloned_sqlite`   | ZotQuery's clone of Zotero's sqlite database |
+    | `json_data`       | ZotQuery's JSON clone of Zotero's sqlite     |
+    | `fts_sqlite`      | ZotQuery's Full Text Search and item store   |
+    | `fulltext_sqlite` | ZotQuery's index of attachments' text        |
 
     Expects information to be stored in :file:`zotquery_data.json`.
     If file does not exist, it creates and stores dictionary.
@@ -63,6 +122,9 @@ class ZotqueryBackend(PropertyBase):
         # initialize base class, for access to `properties` dict
         PropertyBase.__init__(self, self.wf, secured=False)
         self.con = None
+        self._scope_ids = []
+        # ((index, generation), {(kind, key): name}) of looked-up groups
+        self._group_names = (None, {})
 
     # Properties --------------------------------------------------------------
 
@@ -75,9 +137,10 @@ class ZotqueryBackend(PropertyBase):
 
         """
         clone_path = self.wf.datafile('zotquery.sqlite')
-        if not os.path.exists(clone_path):
-            copyfile(self.zotero.original_sqlite, clone_path)
-            log.info('Created Clone SQLITE file')
+        # when reading Zotero's database live, the clone is only made
+        # once it is needed (see :meth:`zotero_sqlite`)
+        if not os.path.exists(clone_path) and not self.read_live():
+            self.update_clone()
         return clone_path
 
     @stored_property
@@ -90,7 +153,7 @@ class ZotqueryBackend(PropertyBase):
         """
         json_path = self.wf.datafile('zotquery.json')
         if not os.path.exists(json_path):
-            self.con = sqlite3.connect(self.cloned_sqlite)
+            self.con = self.connect_zotero()
             # Function to generate ZotQuery's JSON database
             self.to_json()
         return json_path
@@ -99,6 +162,10 @@ class ZotqueryBackend(PropertyBase):
     def fts_sqlite(self):
         """Return path to ZotQuery's Full Text Search sqlite database.
 
+        The index is diacritic-insensitive, so ASCII queries also match
+        accented text (see :meth:`create_index_db`). Alongside it, the
+        ``items`` table stores each item's JSON (see :meth:`get_items`).
+
         :returns: full path to file
         :rtype: :class:`unicode`
 
@@ -110,19 +177,17 @@ class ZotqueryBackend(PropertyBase):
         return fts_path
 
     @stored_property
-    def folded_sqlite(self):
-        """Return path to ZotQuery's Full Text Search sqlite database
-        where all text is ASCII only.
+    def fulltext_sqlite(self):
+        """Return path to ZotQuery's index of the text of attachments.
+
+        The index is built in the background (see
+        :meth:`update_fulltext_index`), so it may not exist yet.
 
         :returns: full path to file
         :rtype: :class:`unicode`
 
         """
-        folded_path = self.wf.datafile('folded.db')
-        if not os.path.exists(folded_path):
-            self.create_index_db(folded_path)
-            self.update_index_db(folded_path, folded=True)
-        return folded_path
+        return self.wf.datafile('fulltext.db')
 
     # ZotQuery Formatting Properties ------------------------------------------
 
@@ -144,7 +209,7 @@ class ZotqueryBackend(PropertyBase):
     def formatting_properties_setter(self):
         """Configure ZotQuery formatting perferences."""
         # Check if values have already been set
-        defaults = self.wf.cached_data('output_settings', max_age=0)
+        defaults = config.SETTINGS.cached('output_settings')
         if defaults is None:
             defaults = {'app': 'Standalone',
                         'csl': 'chicago-author-date',
@@ -184,65 +249,579 @@ class ZotqueryBackend(PropertyBase):
         res_dict = pashua.run(conf, encoding='utf8', pashua_path=config.PASHUA)
         if res_dict['cb'] != 1:
             del res_dict['cb']
-            self.wf.cache_data('output_settings', res_dict)
+            config.SETTINGS.cache('output_settings', res_dict)
 
     # Utility methods ---------------------------------------------------------
 
     def is_fresh(self):
         """Is ZotQuery up-to-date with Zotero?
 
-        Two specific questions:
-            + is ``cloned_sqlite`` parallel to :attr:`Zotero.original_sqlite`?
-            + is ``json_data`` parallel to ``cloned_sqlite``?
+        Zotero writes to its database constantly without changing any
+        items, so a newer database is not enough: the library's content
+        must differ from the manifest recorded by the last sync (see
+        :meth:`_sync_state`). The manifest is only computed again if
+        Zotero's database or write-ahead log has been written to since
+        it was last checked (see :meth:`_clone_source`).
 
         :returns: tuple with Boolean answer and rotten file
         :rtype: :class:`tuple`
 
         """
-        (update, spot) = (False, None)
-        zotero_mod = os.stat(self.zotero.original_sqlite)[8]
-        clone_mod = os.stat(self.cloned_sqlite)[8]
-        cache_mod = os.stat(self.json_data)[8]
-        # Check if cloned sqlite database is up-to-date with `zotero` database
-        if zotero_mod > clone_mod:
-            update, spot = (True, "Clone")
-        # Check if JSON cache is up-to-date with the cloned database
-        elif (cache_mod - clone_mod) > 10:
-            update, spot = (True, "JSON")
-        if update:
-            log.debug('Update {}? {}'.format(spot, update))
-        return (update, spot)
+        # indexes built by an older version of ZotQuery need rebuilding
+        if self.index_meta(self.fts_sqlite).get('schema') != INDEX_SCHEMA:
+            log.debug('Update Index? True')
+            return (True, "Index")
+        # the index of attachments' text is built by its own task
+        if (not os.path.exists(self.fulltext_sqlite) and
+                not self.fulltext_queue()):
+            self.queue_fulltext()
+        # make sure there is a JSON file, and a sync state to compare with
+        self.json_data
+        state = self.wf.stored_data('sync_state') or {}
+        if self._clone_source() == state.get('checked'):
+            return (False, None)
+        self.con = self.connect_zotero()
+        try:
+            current = self._sync_state()
+        finally:
+            self.con.close()
+        if not self._same_content(state, current):
+            log.debug('Update JSON? True')
+            return (True, "JSON")
+        # remember that this version of Zotero's database is known
+        state['checked'] = current['checked']
+        self.wf.store_data('sync_state', state, serializer='json')
+        return (False, None)
+
+    def schedule_refresh(self):
+        """Bring ZotQuery up-to-date with Zotero in the background.
+
+        At most once every ``config.REFRESH_INTERVAL`` seconds, starts
+        `configure freshen` as a background task, which checks
+        :meth:`is_fresh` and updates whatever is stale. Meanwhile,
+        searches are answered from the current index, which the updated
+        one replaces atomically (see :meth:`update_indexes`).
+
+        :returns: ``True`` if a refresh was started
+        :rtype: :class:`boolean`
+
+        """
+        from workflow.background import is_running, run_in_background
+        stamp = self.wf.cachefile('refresh.stamp')
+        try:
+            if time() - os.stat(stamp).st_mtime < config.REFRESH_INTERVAL:
+                return False
+        except OSError:
+            pass
+        with open(stamp, 'a'):
+            os.utime(stamp, None)
+        if is_running('zotquery_refresh'):
+            return False
+        run_in_background('zotquery_refresh',
+                          ['/usr/bin/python',
+                           self.wf.workflowfile('zotquery.py'),
+                           'configure', 'freshen', 'False'])
+        return True
+
+    def refresh_lock(self, wait=False):
+        """Lock held while ZotQuery's data is being updated, so only one
+        process updates it at a time.
+
+        Use as ``with zq.backend.refresh_lock() as acquired:``.
+
+        :param wait: wait for the process holding the lock, if any
+        :type wait: :class:`boolean`
+
+        """
+        return utils.try_lock(self.wf.cachefile('refresh.lock'), wait)
+
+    def schedule_fulltext(self):
+        """Index the text of queued attachments in the background.
+
+        Starts `configure fulltext` as a background task, unless it is
+        already running (see :meth:`update_fulltext_index`).
+
+        :returns: ``True`` if the task was started
+        :rtype: :class:`boolean`
+
+        """
+        from workflow.background import is_running, run_in_background
+        if is_running('zotquery_fulltext'):
+            return False
+        run_in_background('zotquery_fulltext',
+                          ['/usr/bin/python',
+                           self.wf.workflowfile('zotquery.py'),
+                           'configure', 'fulltext'])
+        return True
+
+    def fulltext_lock(self):
+        """Lock held while the index of attachments' text is updated.
+
+        Separate from :meth:`refresh_lock`, so the (possibly hours-long)
+        extraction of attachments' text never holds up a refresh.
+
+        """
+        return utils.try_lock(self.wf.cachefile('fulltext.lock'))
 
     def update_clone(self):
         """Update `cloned_sqlite` so that it's current with `original_sqlite`.
 
+        The copy is made into a temporary file (see :meth:`_copy_sqlite`)
+        and only replaces the clone once it passes ``PRAGMA quick_check``.
+
+        :returns: ``True`` if the clone was replaced
+        :rtype: :class:`boolean`
+
         """
         clone_path = self.wf.datafile('zotquery.sqlite')
-        copyfile(self.zotero.original_sqlite, clone_path)
-        log.info('Updated Clone SQLITE file')
+        temp_path = clone_path + '.tmp'
+        remove_sqlite(temp_path)
+        start = time()
+        # taken first, so writes made while copying date the clone
+        source = self._clone_source()
+        try:
+            method = self._copy_sqlite(self.zotero.original_sqlite,
+                                       temp_path)
+        except (IOError, sqlite3.OperationalError) as err:
+            remove_sqlite(temp_path)
+            log.error('Cannot copy Zotero database ({}); '
+                      'keeping previous clone'.format(err))
+            return False
+        con = sqlite3.connect(temp_path)
+        try:
+            # rolls back (or replays) the copied journal, then drops it,
+            # so the clone is a single self-contained file
+            con.execute('PRAGMA journal_mode = DELETE')
+            (pages,) = con.execute('PRAGMA page_count').fetchone()
+            (check,) = con.execute('PRAGMA quick_check').fetchone()
+        except sqlite3.DatabaseError as err:
+            (pages, check) = (0, err)
+        finally:
+            con.close()
+        if check != 'ok':
+            remove_sqlite(temp_path)
+            log.error('Clone failed quick_check ({}); '
+                      'keeping previous clone'.format(check))
+            return False
+        # atomic, so readers never see a partial clone
+        os.rename(temp_path, clone_path)
+        self.wf.store_data('clone_source', source, serializer='json')
+        log.info('Updated Clone SQLITE file ({} pages by {}) '
+                 'in {:0.3}s'.format(pages, method, time() - start))
+        return True
+
+    @staticmethod
+    def _copy_sqlite(source_path, target_path):
+        """Copy the database at ``source_path`` to ``target_path``.
+
+        While the copy is made, a read transaction is held on the
+        source, so no other process can commit to it, and its
+        write-ahead log (if any) is copied alongside it. If Zotero
+        holds an exclusive lock, which it does while it runs, the
+        database is copied with its rollback journal or write-ahead
+        log, and copied again (up to ``config.CLONE_COPY_ATTEMPTS``
+        times) until none of the files changed meanwhile. Opening the
+        copy then rolls back any transaction that was in progress.
+
+        :param source_path: path to database to copy
+        :type source_path: :class:`unicode`
+        :param target_path: path to write copy to
+        :type target_path: :class:`unicode`
+        :returns: how the database was copied
+        :rtype: :class:`unicode`
+        :raises: :class:`sqlite3.OperationalError` if the database kept
+            changing while it was being copied
+
+        """
+        source = utils.connect_readonly(source_path, timeout=LIVE_TIMEOUT)
+        try:
+            try:
+                # a shared lock, held until the connection is closed
+                source.execute('BEGIN')
+                source.execute('SELECT 1 FROM sqlite_master LIMIT 1')
+            except sqlite3.OperationalError as err:
+                log.debug('Cannot lock Zotero database ({}), '
+                          'copying it unlocked'.format(err))
+                suffixes = ('', '-journal', '-wal')
+                for _ in range(config.CLONE_COPY_ATTEMPTS):
+                    before = [file_signature(source_path + suffix)
+                              for suffix in suffixes]
+                    copy_sqlite(source_path, target_path, suffixes)
+                    after = [file_signature(source_path + suffix)
+                             for suffix in suffixes]
+                    if before == after:
+                        return 'unlocked copy'
+                raise sqlite3.OperationalError('database kept changing '
+                                               'while it was copied')
+            # a live writer's journal only holds pages the database
+            # file still has; the log holds committed pages it lacks
+            copy_sqlite(source_path, target_path, ('', '-wal'))
+            return 'locked copy'
+        finally:
+            source.close()
+
+    def zotero_sqlite(self):
+        """Return path to the database Zotero's data should be read from.
+
+        If it can be read live (see :meth:`read_live`), this is Zotero's
+        own database, unless Zotero currently holds a lock on it.
+        Otherwise (or then) it is ``cloned_sqlite``, refreshed first if
+        it is out-of-date.
 
-    def update_json(self):
-        """Update `json_data` so that it's current with `cloned_sqlite`.
+        :returns: full path to file
+        :rtype: :class:`unicode`
+
+        """
+        if self.read_live():
+            live_path = self.zotero.original_sqlite
+            con = utils.connect_readonly(live_path, timeout=LIVE_TIMEOUT)
+            try:
+                # Zotero locks its database exclusively while running
+                con.execute('SELECT 1 FROM items LIMIT 1')
+                return live_path
+            except sqlite3.OperationalError as err:
+                log.debug('Cannot read Zotero database ({}), '
+                          'using clone'.format(err))
+            finally:
+                con.close()
+        clone_path = self.cloned_sqlite
+        if (not os.path.exists(clone_path) or
+                self.wf.stored_data('clone_source') != self._clone_source()):
+            self.update_clone()
+        return clone_path
+
+    def _clone_source(self):
+        """Get the signature of Zotero's database and its write-ahead log
+        (see :func:`file_signature`), as stored, i.e. as JSON.
+
+        The clone is out-of-date once it differs from the one taken when
+        the clone was made. Zotero may commit to its write-ahead log
+        without touching its database, and more than once a second.
+
+        """
+        path = self.zotero.original_sqlite
+        return json.loads(json.dumps([file_signature(path + suffix)
+                                      for suffix in ('', '-wal')]))
+
+    @staticmethod
+    def read_live():
+        """Read Zotero's database in place rather than from a clone?
+
+        Only with ``config.READ_LIVE``, and only if this Python can open
+        it truly read-only (see :func:`utils.can_open_readonly`).
+
+        :rtype: :class:`boolean`
 
         """
-        self.con = sqlite3.connect(self.cloned_sqlite)
+        return config.READ_LIVE and utils.can_open_readonly()
+
+    def connect_zotero(self):
+        """Open a read-only connection to ``zotero_sqlite``.
+
+        :returns: connection to Zotero's data
+        :rtype: :class:`sqlite3.Connection`
+
+        """
+        db = self.zotero_sqlite()
+        # nothing else writes to the clone, so it can be opened immutable
+        immutable = (db != self.zotero.original_sqlite)
+        return utils.connect_readonly(db, immutable=immutable)
+
+    def update_json(self, incremental=True):
+        """Update `json_data` so that it's current with `zotero_sqlite`.
+
+        If ``incremental`` and a previous sync has been recorded, only
+        the items that changed since then are re-extracted and patched
+        into the existing JSON file. Otherwise the whole file is backed
+        up and regenerated.
+
+        :param incremental: patch the existing JSON if possible
+        :type incremental: :class:`boolean`
+        :returns: keys of updated and removed items, or ``None`` if
+            the whole library was regenerated
+        :rtype: :class:`tuple` or ``None``
+
+        """
+        json_path = self.wf.datafile('zotquery.json')
+        state = self.wf.stored_data('sync_state')
+        self.con = self.connect_zotero()
+        if incremental and state and os.path.exists(json_path):
+            return self.sync_json(state)
         # backup previous version of library
-        if os.path.exists(self.json_data):
-            copyfile(self.json_data, self.wf.datafile('backup.json'))
+        if os.path.exists(json_path):
+            copyfile(json_path, self.wf.datafile('backup.json'))
         # update library
         self.to_json()
         log.info('Updated and backed-up JSON file')
+        return None
+
+    def sync_json(self, state):
+        """Patch `json_data` with the items changed since the last sync.
+
+        Items are re-extracted if their own, or one of their attachments'
+        or notes', modification timestamps or version moved past those
+        in ``state``. So are the members of renamed or deleted
+        collections and tags, which Zotero doesn't mark as modified, and
+        items that gained or lost attachments or notes (see
+        :meth:`_changed_groups`). Items that were deleted or moved to
+        the trash are removed.
+
+        :param state: sync state recorded by the previous sync
+        :type state: :class:`dict`
+        :returns: keys of updated items and keys of removed items
+        :rtype: :class:`tuple`
 
-    ## JSON to FTS sub-methods ------------------------------------------------
+        """
+        start = time()
+        new_state = self._sync_state()
+        all_items = self.wf.stored_data('zotquery')
+        # key and ID of every item that should be in the library
+        current = dict((basic[0], basic[1])
+                       for basic in self._library_items())
+        deleted = set(all_items) - set(current)
+        for key in deleted:
+            del all_items[key]
+        # items that were edited, plus items that are new to the JSON
+        changed = self._changed_item_ids(state)
+        changed.update(item_id for (key, item_id) in current.iteritems()
+                       if key not in all_items)
+        groups = self._changed_groups(state, new_state)
+        changed.update(self._group_member_ids(groups, all_items, current))
+        changed.update(int(parent) for parent in changed_entries(
+            state.get('children', {}), new_state['children']))
+        changed.intersection_update(current.itervalues())
+        updated = self._extract_items(changed)
+        all_items.update(updated)
+        self.con.close()
+        self.wf.store_data('zotquery', all_items, serializer='json')
+        self.wf.store_data('sync_state', new_state, serializer='json')
+        # Zotero re-indexed attachments without modifying their items
+        if (state.get('tables', {}).get('fulltextItems') !=
+                new_state['tables'].get('fulltextItems')):
+            self.queue_fulltext()
+        log.info('Synced JSON file ({} updated, {} removed) '
+                 'in {:0.3}s'.format(len(updated), len(deleted),
+                                     time() - start))
+        return (set(updated), deleted)
+
+    def _sync_state(self):
+        """Get the manifest of the content of Zotero's library.
+
+        Records the highest modification timestamps and version of
+        Zotero's items, the row count and a checksum of each of
+        :const:`MANIFEST_TABLES`, and a checksum of the most recently
+        modified items. Renaming a collection or tag, or removing an
+        attachment or note, changes no item's timestamps, so the name
+        of each collection and tag (``groups``) and a checksum of each
+        item's children (``children``) are recorded as well. Also
+        records the signature of Zotero's database and write-ahead log
+        (``checked``, see :meth:`_clone_source`) when the manifest was
+        taken.
+
+        :returns: sync state for the current contents of Zotero's data
+        :rtype: :class:`dict`
+
+        """
+        checked = self._clone_source()
+        sql = """
+            SELECT MAX(clientDateModified), MAX(dateModified), MAX(version)
+            FROM items
+        """
+        (client_modified,
+         modified,
+         version) = self._execute(sql).fetchone()
+        tables = {}
+        for (table, checksum) in MANIFEST_TABLES.items():
+            sql = 'SELECT COUNT(*), {} FROM {}'.format(checksum, table)
+            try:
+                tables[table] = list(self._execute(sql).fetchone())
+            except sqlite3.OperationalError:
+                # table (or column) not in this version of Zotero
+                tables[table] = None
+        sql = """
+            SELECT itemID, dateModified, version FROM items
+            WHERE clientDateModified = ?
+            ORDER BY itemID
+        """
+        touched = self.con.execute(sql, (client_modified,)).fetchall()
+        return {'client_modified': client_modified,
+                'modified': modified,
+                'version': version,
+                'tables': tables,
+                'touched': hashlib.md5(repr(touched)).hexdigest(),
+                'groups': self._group_state(),
+                'children': self._children_state(),
+                'checked': checked}
+
+    def _group_state(self):
+        """Get the name of each collection and tag in Zotero's library.
+
+        :returns: names, keyed on ``c:<key>`` for collections and
+            ``t:<key>`` for tags
+        :rtype: :class:`dict`
+
+        """
+        names = {}
+        for (kind, sql) in (('c', "SELECT key, collectionName "
+                                  "FROM collections"),
+                            ('t', "SELECT key, name FROM tags")):
+            try:
+                names.update(('{}:{}'.format(kind, key), name)
+                             for (key, name) in self._execute(sql))
+            except sqlite3.OperationalError:
+                # table (or column) not in this version of Zotero
+                pass
+        return names
+
+    def _children_state(self):
+        """Get the number and a checksum of each item's attachments
+        and notes.
+
+        :returns: ``[count, checksum]``, keyed on the parent's ``itemID``
+        :rtype: :class:`dict`
+
+        """
+        sql = """
+            SELECT sourceItemID, COUNT(*), TOTAL(itemID)
+            FROM (SELECT itemID, sourceItemID FROM itemAttachments
+                  UNION ALL
+                  SELECT itemID, sourceItemID FROM itemNotes)
+            WHERE sourceItemID IS NOT NULL
+            GROUP BY sourceItemID
+        """
+        return dict((str(parent), [count, checksum])
+                    for (parent, count, checksum) in self._execute(sql))
+
+    @staticmethod
+    def _changed_groups(state, other):
+        """Get the collections and tags that were added, renamed or
+        deleted between sync states ``state`` and ``other``.
+
+        :returns: ``(kind, key)`` of each group
+        :rtype: :class:`set`
+
+        """
+        return set(tuple(group.split(':', 1)) for group in changed_entries(
+            state.get('groups', {}), other['groups']))
+
+    def _group_member_ids(self, groups, all_items, current):
+        """Get IDs of the items in ``groups``, as they were when last
+        synced and as they are in Zotero.
+
+        :param groups: ``(kind, key)`` of collections and tags
+        :type groups: :class:`set`
+        :param all_items: items in `json_data`, keyed on their key
+        :type all_items: :class:`dict`
+        :param current: ``itemID`` of library items, keyed on their key
+        :type current: :class:`dict`
+        :returns: ``itemID`` of each member
+        :rtype: :class:`set`
+
+        """
+        if not groups:
+            return set()
+        members = set()
+        for (key, item) in all_items.iteritems():
+            item_groups = set(('c', collection['key']) for collection
+                              in item.get('zot-collections', []))
+            item_groups.update(('t', tag['key'])
+                               for tag in item.get('zot-tags', []))
+            if item_groups & groups and key in current:
+                members.add(current[key])
+        for (kind, sql) in (('c', """SELECT collectionItems.itemID
+                                     FROM collectionItems
+                                     JOIN collections USING (collectionID)
+                                     WHERE collections.key IN ({})"""),
+                            ('t', """SELECT itemTags.itemID FROM itemTags
+                                     JOIN tags USING (tagID)
+                                     WHERE tags.key IN ({})""")):
+            keys = [key for (group_kind, key) in groups if group_kind == kind]
+            # stay below SQLite's limit on bound parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                sql_chunk = sql.format(', '.join('?' * len(chunk)))
+                members.update(item_id for (item_id,)
+                               in self.con.execute(sql_chunk, chunk))
+        return members
 
     @staticmethod
-    def create_index_db(db):
+    def _same_content(state, other):
+        """Do sync states ``state`` and ``other`` describe the same library?
+
+        :param state: sync state (see :meth:`_sync_state`)
+        :type state: :class:`dict`
+        :param other: another sync state
+        :type other: :class:`dict`
+        :rtype: :class:`boolean`
+
+        """
+        def content(manifest):
+            # compare as stored, i.e. as JSON
+            manifest = json.loads(json.dumps(manifest))
+            return dict((name, value) for (name, value) in manifest.items()
+                        if name != 'checked')
+        return content(state) == content(other)
+
+    def _changed_item_ids(self, state):
+        """Get IDs of items modified at or after the sync ``state``.
+
+        An item also counts as modified if one of its attachments or
+        notes was modified.
+
+        :param state: sync state recorded by the previous sync
+        :type state: :class:`dict`
+        :returns: ``itemID`` of each modified item
+        :rtype: :class:`set`
+
+        """
+        sql = """
+            SELECT COALESCE(itemAttachments.sourceItemID,
+                            itemNotes.sourceItemID,
+                            items.itemID)
+            FROM items
+            LEFT JOIN itemAttachments
+                ON itemAttachments.itemID = items.itemID
+            LEFT JOIN itemNotes
+                ON itemNotes.itemID = items.itemID
+            WHERE
+                items.clientDateModified >= ?
+                or items.dateModified >= ?
+                or items.version > ?
+        """
+        params = (state['client_modified'] or '',
+                  state['modified'] or '',
+                  state['version'] or 0)
+        cur = self.con.cursor()
+        return set(row[0] for row in cur.execute(sql, params))
+
+    ## JSON to FTS sub-methods ------------------------------------------------
+
+    @classmethod
+    def create_index_db(cls, db):
         """Create FTS virtual table with data from ``json_data``
 
+        The table uses the best module from :meth:`fts_module`. If that
+        module has a diacritic-folding tokenizer (see
+        :meth:`fts_tokenizer`), diacritics are folded by the tokenizer.
+        Otherwise each value is indexed along with its ASCII-folded
+        shadow copy. Both choices are recorded in the database's
+        ``meta`` table.
+
+        Items' JSON is kept in the ``items`` table, whose ``id`` is the
+        ``rowid`` of the item's row in the FTS table. The ``feedback``
+        table holds each item's formatted Alfred result under the same
+        ``id`` (see :meth:`update_feedback`). Collections and tags are
+        indexed in ``group_index``, ``group_tree`` and ``group_members``
+        (see :meth:`update_group_index`). The ``names`` of each item in
+        ``config.TRIGRAM_COLUMNS`` are indexed by their ``trigrams``.
+
         :param db: path to `.db` file
         :type db: :class:`unicode`
 
         """
+        module = cls.fts_module()
+        tokenizer = cls.fts_tokenizer(module)
+        folding = 'tokenizer' if tokenizer else 'shadow'
         con = sqlite3.connect(db)
         with con:
             cur = con.cursor()
@@ -251,56 +830,1027 @@ class ZotqueryBackend(PropertyBase):
             if columns:
                 # convert list to string
                 columns = ', '.join(columns)
+                if tokenizer:
+                    columns = ', '.join([columns, tokenizer])
                 sql = """CREATE VIRTUAL TABLE zotquery
-                         USING fts3({cols})""".format(cols=columns)
+                         USING {module}({cols})""".format(module=module,
+                                                          cols=columns)
                 cur.execute(sql)
-                log.debug('Created FTS database: {}'.format(db))
+                cur.execute("""CREATE TABLE items
+                               (id INTEGER PRIMARY KEY,
+                                key TEXT UNIQUE,
+                                data TEXT)""")
+                cur.execute("""CREATE TABLE feedback
+                               (id INTEGER PRIMARY KEY,
+                                key TEXT UNIQUE,
+                                data TEXT)""")
+                cur.execute("""CREATE TABLE meta
+                               (name TEXT PRIMARY KEY, value)""")
+                cur.execute("""CREATE TABLE group_index
+                               (id INTEGER PRIMARY KEY,
+                                kind TEXT,
+                                key TEXT,
+                                name TEXT,
+                                folded TEXT COLLATE NOCASE,
+                                items INTEGER,
+                                UNIQUE (kind, key))""")
+                cur.execute("""CREATE INDEX group_index_folded
+                               ON group_index (kind, folded)""")
+                cur.execute("""CREATE TABLE group_tree
+                               (ancestor INTEGER,
+                                descendant INTEGER,
+                                depth INTEGER,
+                                PRIMARY KEY (ancestor, descendant))""")
+                cur.execute("""CREATE TABLE group_members
+                               (group_id INTEGER,
+                                item_id INTEGER,
+                                PRIMARY KEY (group_id, item_id))""")
+                cur.execute("""CREATE TABLE names
+                               (item_id INTEGER,
+                                field TEXT,
+                                name TEXT)""")
+                cur.execute("""CREATE INDEX names_item
+                               ON names (item_id)""")
+                cur.execute("""CREATE TABLE trigrams
+                               (gram TEXT,
+                                item_id INTEGER,
+                                PRIMARY KEY (gram, item_id))
+                               WITHOUT ROWID""")
+                cur.execute("""CREATE INDEX trigrams_item
+                               ON trigrams (item_id)""")
+                cur.executemany("INSERT INTO meta VALUES (?, ?)",
+                                (('module', module),
+                                 ('folding', folding),
+                                 ('schema', INDEX_SCHEMA),
+                                 ('feedback', cls.feedback_fingerprint()),
+                                 ('generation', uuid.uuid4().hex)))
+                log.debug('Created {} database ({} folding): {}'.format(
+                    module, folding, db))
+        con.close()
+
+    @staticmethod
+    def fts_module():
+        """Return the best FTS module this SQLite library supports.
+
+        FTS5 is preferred if ``config.USE_FTS5``; otherwise FTS4, then
+        FTS3.
+
+        :returns: name of FTS module
+        :rtype: :class:`unicode`
+
+        """
+        modules = ['fts4', 'fts3']
+        if config.USE_FTS5:
+            modules.insert(0, 'fts5')
+        con = sqlite3.connect(':memory:')
+        try:
+            for module in modules:
+                try:
+                    con.execute("""CREATE VIRTUAL TABLE temp.probe
+                                   USING {}(a)""".format(module))
+                    return module
+                except sqlite3.OperationalError:
+                    continue
+        finally:
+            con.close()
+
+    @staticmethod
+    def fts_tokenizer(module):
+        """Return a diacritic-folding tokenizer option for ``module``.
 
-    def update_index_db(self, fts_path, folded=False):
+        :param module: name of FTS module
+        :type module: :class:`unicode`
+        :returns: tokenizer option for ``CREATE VIRTUAL TABLE``, or
+            ``None`` if ``module`` has no such tokenizer
+        :rtype: :class:`unicode`
+
+        """
+        if module == 'fts5':
+            tokenizer = "tokenize = 'unicode61 remove_diacritics 1'"
+        else:
+            tokenizer = 'tokenize=unicode61 "remove_diacritics=1"'
+        con = sqlite3.connect(':memory:')
+        try:
+            con.execute("""CREATE VIRTUAL TABLE temp.probe
+                           USING {}(a, {})""".format(module, tokenizer))
+            con.execute("INSERT INTO temp.probe (a) VALUES (?)", ('noël',))
+            (found,) = con.execute("""SELECT count(*) FROM temp.probe
+                                      WHERE probe MATCH 'noel'""").fetchone()
+            return tokenizer if found else None
+        except sqlite3.OperationalError:
+            return None
+        finally:
+            con.close()
+
+    @staticmethod
+    def index_meta(db):
+        """Return the settings the index at ``db`` was built with.
+
+        :param db: path to `.db` file
+        :type db: :class:`unicode`
+        :returns: contents of the ``meta`` table
+        :rtype: :class:`dict`
+
+        """
+        try:
+            return dict(pool.connect(db).execute(
+                "SELECT name, value FROM meta"))
+        except (OSError, sqlite3.OperationalError):
+            # missing databases, or ones built before `meta` was added
+            return {}
+
+    @classmethod
+    def index_module(cls, db):
+        """Return the FTS module the index at ``db`` was built with.
+
+        :param db: path to `.db` file
+        :type db: :class:`unicode`
+        :returns: name of FTS module
+        :rtype: :class:`unicode`
+
+        """
+        return cls.index_meta(db).get('module', 'fts3')
+
+    def update_index_db(self, fts_path):
         """Update ``fts_sqlite`` with JSON data from ``json_data``.
 
-        Reads in data from ``json_data`` and adds it to the FTS database.
+        Reads in data from ``json_data`` and streams it into the item
+        store and FTS table with ``executemany``, committing every
+        ``config.INDEX_BATCH_SIZE`` items. :const:`BUILD_PRAGMAS` are
+        in effect for the duration of the load.
 
         :param fts_path: path to `.db` file
         :type fts_path: :class:`unicode`
-        :param folded: should all text be ASCII-normalized?
-        :type folded: :class:`boolean`
 
         """
         # grab start time
         start = time()
+        json_data = utils.read_json(self.json_data)
+        log.debug('Index build: read JSON in {:0.3}s'.format(time() - start))
+        shadow = self.index_meta(fts_path).get('folding') == 'shadow'
         con = sqlite3.connect(fts_path)
-        count = 0
-        with con:
-            cur = con.cursor()
-            # iterate over every item in library
-            for row in self.generate_data():
-                # names of all keys for item (cf. `FILTERS['general']`)
-                columns = ', '.join([x.keys()[0]
-                                     for x in row])
-                values = ['"' + re.sub(r'"|\'', '', x.values()[0]) + '"'
-                          for x in row]
-                values = ', '.join(values)
-                # fold to ASCII-only?
-                if folded:
-                    values = fold(values)
-                sql = """INSERT OR IGNORE INTO zotquery
-                         ({columns}) VALUES ({data})
-                        """.format(columns=columns, data=values)
-                cur.execute(sql)
-                count += 1
+        previous = self._set_pragmas(con, BUILD_PRAGMAS)
+        count = len(json_data)
+        try:
+            phase = time()
+            for (sql, rows) in self._index_inserts(json_data, shadow):
+                for batch in iter(lambda: list(islice(
+                        rows, config.INDEX_BATCH_SIZE)), []):
+                    with con:
+                        con.executemany(sql, batch)
+            log.debug('Index build: inserted {} items in {:0.3}s'.format(
+                count, time() - phase))
+            with con:
+                self.update_group_index(con, json_data)
+            phase = time()
+            # merge the b-tree segments written by each batch
+            with con:
+                con.execute("INSERT INTO zotquery(zotquery) "
+                            "VALUES('optimize')")
+            log.debug('Index build: optimized in {:0.3}s'.format(
+                time() - phase))
+        finally:
+            self._set_pragmas(con, previous)
+            con.close()
         log.debug('Added/Updated {} items in {:0.3}s'.format(count,
                                                              time() - start))
 
-    def generate_data(self):
+    def sync_index_db(self, fts_path, changed, deleted):
+        """Bring ``fts_path`` in line with a set of changed and deleted items.
+
+        The stored item, feedback, FTS row, names and trigrams of each
+        ``changed`` and ``deleted`` key are removed and the ``changed``
+        items are re-inserted from ``json_data``, all in one transaction.
+
+        :param fts_path: path to `.db` file
+        :type fts_path: :class:`unicode`
+        :param changed: keys of items added or updated in ``json_data``
+        :type changed: :class:`set`
+        :param deleted: keys of items removed from ``json_data``
+        :type deleted: :class:`set`
+
+        """
+        start = time()
+        shadow = self.index_meta(fts_path).get('folding') == 'shadow'
+        con = sqlite3.connect(fts_path)
+        with con:
+            keys = [(key,) for key in changed | deleted]
+            con.executemany("""DELETE FROM zotquery WHERE rowid =
+                               (SELECT id FROM items WHERE key = ?)""", keys)
+            con.executemany("""DELETE FROM names WHERE item_id =
+                               (SELECT id FROM items WHERE key = ?)""", keys)
+            con.executemany("""DELETE FROM trigrams WHERE item_id =
+                               (SELECT id FROM items WHERE key = ?)""", keys)
+            con.executemany("DELETE FROM feedback WHERE key = ?", keys)
+            con.executemany("DELETE FROM items WHERE key = ?", keys)
+            all_items = utils.read_json(self.json_data)
+            json_data = dict((key, all_items[key]) for key in changed
+                             if key in all_items)
+            for (sql, rows) in self._index_inserts(json_data, shadow):
+                con.executemany(sql, rows)
+            self.update_group_index(con, all_items)
+            self._new_generation(con)
+            count = len(json_data)
+        con.close()
+        log.debug('Synced {} items in {:0.3}s ({} removed)'.format(
+            count, time() - start, len(deleted)))
+
+    def rebuild_index_db(self, fts_path):
+        """Rebuild ``fts_path`` from scratch with data from ``json_data``.
+
+        The new index is built beside the old one, which it replaces
+        with an atomic rename once complete, so searches never see a
+        partial index.
+
+        :param fts_path: path to `.db` file
+        :type fts_path: :class:`unicode`
+
+        """
+        temp_path = fts_path + '.tmp'
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        self.create_index_db(temp_path)
+        self.update_index_db(temp_path)
+        os.rename(temp_path, fts_path)
+
+    def update_indexes(self, changes=None):
+        """Update the FTS database after ``json_data`` has been updated.
+
+        Either way, searches see the previous index until the new one
+        is complete: changes are synced in one transaction, and a
+        rebuild is swapped in by :meth:`rebuild_index_db`. The
+        attachments of changed items are then queued for the index of
+        attachments' text, which is updated in the background (see
+        :meth:`queue_fulltext`).
+
+        :param changes: keys of updated and removed items, as returned
+            by :meth:`update_json`. If ``None``, the database is rebuilt.
+        :type changes: :class:`tuple`
+
+        """
+        fts_path = self.wf.datafile('zotquery.db')
+        # the separate ASCII-only index is no longer used
+        folded_path = self.wf.datafile('folded.db')
+        if os.path.exists(folded_path):
+            os.unlink(folded_path)
+        if (changes is None or not os.path.exists(fts_path) or
+                self.index_meta(fts_path).get('schema') != INDEX_SCHEMA):
+            self.rebuild_index_db(fts_path)
+            self.queue_fulltext()
+        else:
+            (changed, deleted) = changes
+            self.sync_index_db(fts_path, changed, deleted)
+            self.queue_fulltext(self._changed_attachment_ids(changed,
+                                                             deleted))
+
+    def update_group_index(self, con, json_data):
+        """Rebuild the index of collections and tags in ``con``.
+
+        ``group_index`` holds the name of each collection and tag, its
+        normalized name (see :func:`cache.normalize`) and the number of
+        items in ``json_data`` it directly contains. ``group_tree`` is
+        the closure of the collection hierarchy: a row for each
+        collection and each of its (sub-)subcollections, and its depth
+        below the collection. Tags are their own only descendant.
+        ``group_members`` is the posting list of each group: the
+        ``id`` of each item it directly contains, in order.
+
+        Must be called after the items themselves have been stored,
+        as their ``id`` is only known then.
+
+        :param con: open connection to the FTS database
+        :type con: :class:`sqlite3.Connection`
+        :param json_data: all items, keyed on their keys
+        :type json_data: :class:`dict`
+
+        """
+        members = defaultdict(set)
+        tags = {}
+        item_ids = dict(con.execute('SELECT key, id FROM items'))
+        for (key, item) in json_data.iteritems():
+            for collection in item.get('zot-collections', []):
+                members[('c', collection['key'])].add(item_ids.get(key))
+            for tag in item.get('zot-tags', []):
+                members[('t', tag['key'])].add(item_ids.get(key))
+                tags[tag['key']] = tag['name']
+        zotero = self.connect_zotero()
+        try:
+            collections = zotero.execute("""
+                SELECT collectionID, key, collectionName,
+                    parentCollectionID, libraryID
+                FROM collections""").fetchall()
+        finally:
+            zotero.close()
+        if config.PERSONAL_ONLY is True:
+            collections = [row for row in collections if row[4] is None]
+        con.execute('DELETE FROM group_index')
+        con.execute('DELETE FROM group_tree')
+        con.execute('DELETE FROM group_members')
+        groups = [('c', key, name) for (_, key, name, _, _) in collections]
+        groups.extend(('t', key, name) for (key, name) in tags.iteritems())
+        con.executemany("""INSERT INTO group_index
+                           (kind, key, name, folded, items)
+                           VALUES (?, ?, ?, ?, ?)""",
+                        ((kind, key, name, normalize(name),
+                          len(members[(kind, key)]))
+                         for (kind, key, name) in groups))
+        ids = dict(((kind, key), group_id) for (group_id, kind, key)
+                   in con.execute('SELECT id, kind, key FROM group_index'))
+        parents = dict((collection_id, parent_id) for
+                       (collection_id, _, _, parent_id, _) in collections)
+        index_ids = dict((collection_id, ids[('c', key)]) for
+                         (collection_id, key, _, _, _) in collections)
+        tree = [(group_id, group_id, 0) for group_id in ids.itervalues()]
+        for (collection_id, group_id) in index_ids.iteritems():
+            # walk up to the top-level collection
+            (ancestor, depth) = (parents.get(collection_id), 1)
+            while ancestor in index_ids and depth <= len(index_ids):
+                tree.append((index_ids[ancestor], group_id, depth))
+                (ancestor, depth) = (parents.get(ancestor), depth + 1)
+        con.executemany('INSERT OR IGNORE INTO group_tree VALUES (?, ?, ?)',
+                        tree)
+        con.executemany('INSERT INTO group_members VALUES (?, ?)',
+                        ((ids[group], item_id)
+                         for (group, item_ids) in sorted(members.items())
+                         if group in ids
+                         for item_id in sorted(item_ids)
+                         if item_id is not None))
+        log.debug('Indexed {} collections and {} tags'.format(
+            len(collections), len(tags)))
+
+    ## Attachments' text sub-methods ------------------------------------------
+
+    @classmethod
+    def create_fulltext_db(cls, db):
+        """Create the index of attachments' text at ``db``.
+
+        The FTS table ``fulltext`` holds the text of each attachment
+        under its Zotero ``itemID``. The ``sources`` table maps each
+        attachment to the key of its parent item, and records the
+        signature of the text that was indexed (see
+        :meth:`_fulltext_sources`). Diacritics are folded as in
+        :meth:`create_index_db`.
+
+        :param db: path to `.db` file
+        :type db: :class:`unicode`
+
+        """
+        module = cls.fts_module()
+        tokenizer = cls.fts_tokenizer(module)
+        folding = 'tokenizer' if tokenizer else 'shadow'
+        columns = ', '.join(['text', tokenizer]) if tokenizer else 'text'
+        con = sqlite3.connect(db)
+        with con:
+            con.execute("""CREATE VIRTUAL TABLE fulltext
+                           USING {module}({cols})""".format(module=module,
+                                                           cols=columns))
+            con.execute("""CREATE TABLE sources
+                           (id INTEGER PRIMARY KEY,
+                            parent TEXT,
+                            signature TEXT)""")
+            con.execute("""CREATE TABLE meta
+                           (name TEXT PRIMARY KEY, value)""")
+            con.executemany("INSERT INTO meta VALUES (?, ?)",
+                            (('module', module),
+                             ('folding', folding),
+                             ('schema', FULLTEXT_SCHEMA),
+                             ('generation', uuid.uuid4().hex)))
+        con.close()
+        log.debug('Created {} full text database ({} folding): {}'.format(
+            module, folding, db))
+
+    def update_fulltext_index(self):
+        """Bring ``fulltext_sqlite`` up-to-date for the queued attachments.
+
+        Runs as the `configure fulltext` background task, until the
+        queue (see :meth:`queue_fulltext`) is empty. Only attachments
+        whose text changed since they were indexed are read again. An
+        index built by an older version of ZotQuery is replaced by a
+        new one, built beside it. If building it was interrupted, the
+        next update carries on where it stopped.
+
+        """
+        ft_path = self.fulltext_sqlite
+        while True:
+            queued = self.fulltext_queue()
+            fresh = self.index_meta(ft_path).get('schema') == FULLTEXT_SCHEMA
+            if fresh and not queued:
+                return
+            if fresh:
+                att_ids = None if ALL_ATTACHMENTS in queued else queued
+                self.sync_fulltext_db(ft_path, att_ids)
+            else:
+                temp_path = ft_path + '.tmp'
+                if self.index_meta(temp_path).get('schema') != FULLTEXT_SCHEMA:
+                    if os.path.exists(temp_path):
+                        os.unlink(temp_path)
+                    self.create_fulltext_db(temp_path)
+                self.sync_fulltext_db(temp_path)
+                os.rename(temp_path, ft_path)
+            self.dequeue_fulltext(queued)
+
+    def queue_fulltext(self, att_ids=None):
+        """Queue attachments to be (re-)indexed, and start indexing them.
+
+        :meth:`update_fulltext_index` empties the queue in the
+        background (see :meth:`schedule_fulltext`).
+
+        The queue is kept in a small database of its own, so the
+        refresh that fills it and the task that empties it never wait
+        for each other for long.
+
+        :param att_ids: Zotero ``itemID`` of each attachment, or
+            ``None`` for every attachment
+        :type att_ids: :class:`set`
+
+        """
+        att_ids = [ALL_ATTACHMENTS] if att_ids is None else att_ids
+        if not att_ids:
+            return
+        con = self._connect_fulltext_queue()
+        try:
+            with con:
+                con.executemany("INSERT OR IGNORE INTO queue VALUES (?)",
+                                ((att_id,) for att_id in att_ids))
+        finally:
+            con.close()
+        self.schedule_fulltext()
+
+    def fulltext_queue(self):
+        """Get the queued attachments' ``itemID`` (see :meth:`queue_fulltext`).
+
+        :returns: queued IDs, with :const:`ALL_ATTACHMENTS` if the
+            whole index is to be updated
+        :rtype: :class:`set`
+
+        """
+        con = self._connect_fulltext_queue()
+        try:
+            return set(att_id for (att_id,) in
+                       con.execute("SELECT id FROM queue"))
+        finally:
+            con.close()
+
+    def dequeue_fulltext(self, att_ids):
+        """Remove indexed attachments from the queue; those queued again
+        meanwhile were already there, and are indexed again anyway.
+        """
+        con = self._connect_fulltext_queue()
+        try:
+            with con:
+                con.executemany("DELETE FROM queue WHERE id = ?",
+                                ((att_id,) for att_id in att_ids))
+        finally:
+            con.close()
+
+    def _connect_fulltext_queue(self):
+        con = sqlite3.connect(self.wf.datafile('fulltext_queue.db'),
+                              timeout=30)
+        con.execute("CREATE TABLE IF NOT EXISTS queue "
+                    "(id INTEGER PRIMARY KEY)")
+        return con
+
+    def _changed_attachment_ids(self, changed, deleted):
+        """Get the attachments of the items with keys ``changed`` and
+        ``deleted``, as they are in Zotero and as they were indexed.
+
+        :returns: Zotero ``itemID`` of each attachment
+        :rtype: :class:`set`
+
+        """
+        keys = list(set(changed) | set(deleted))
+        att_ids = set()
+        zotero = self.connect_zotero()
+        indexed = (pool.connect(self.fulltext_sqlite)
+                   if os.path.exists(self.fulltext_sqlite) else None)
+        try:
+            # stay below SQLite's limit on bound parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                params = ', '.join('?' * len(chunk))
+                sql = """SELECT itemAttachments.itemID FROM itemAttachments
+                         JOIN items
+                             ON items.itemID = itemAttachments.sourceItemID
+                         WHERE items.key IN ({})""".format(params)
+                att_ids.update(att_id for (att_id,) in
+                               zotero.execute(sql, chunk))
+                if indexed is not None:
+                    sql = """SELECT id FROM sources
+                             WHERE parent IN ({})""".format(params)
+                    att_ids.update(att_id for (att_id,) in
+                                   indexed.execute(sql, chunk))
+        finally:
+            zotero.close()
+        return att_ids
+
+    def sync_fulltext_db(self, ft_path, att_ids=None):
+        """Re-index the attachments whose text changed, and remove those
+        that are gone, of all attachments or only those in ``att_ids``.
+
+        The text of changed attachments is extracted in parallel (see
+        :func:`extract.extract_all`) and written as it comes in, in
+        transactions of ``config.FULLTEXT_BATCH_SIZE`` attachments. An
+        attachment keeps its previous text until its new text has been
+        written, so an interrupted update leaves a usable index, and
+        the next one skips what was already written. Cached results
+        (see :class:`cache.ResultCache`) are dropped once, as the
+        update ends.
+
+        :param ft_path: path to `.db` file
+        :type ft_path: :class:`unicode`
+        :param att_ids: Zotero ``itemID`` of attachments to check
+        :type att_ids: :class:`set`
+
+        """
+        start = time()
+        shadow = self.index_meta(ft_path).get('folding') == 'shadow'
+        self.con = self.connect_zotero()
+        con = sqlite3.connect(ft_path)
+        (removed, done) = ([], 0)
+        try:
+            sources = self._fulltext_sources(att_ids)
+            indexed = dict(con.execute("SELECT id, signature FROM sources"))
+            removed = [(att_id,) for att_id in indexed
+                       if att_id not in sources and
+                       (att_ids is None or att_id in att_ids)]
+            fresh = dict((att_id, source)
+                         for (att_id, source) in sources.items()
+                         if indexed.get(att_id) != source[3])
+            with con:
+                con.executemany("DELETE FROM fulltext WHERE rowid = ?",
+                                removed)
+                con.executemany("DELETE FROM sources WHERE id = ?", removed)
+            rows = self._fulltext_rows(fresh, shadow)
+            for batch in iter(lambda: list(islice(
+                    rows, config.FULLTEXT_BATCH_SIZE)), []):
+                with con:
+                    ids = [(row[0],) for row in batch]
+                    con.executemany("DELETE FROM fulltext WHERE rowid = ?",
+                                    ids)
+                    con.executemany("DELETE FROM sources WHERE id = ?", ids)
+                    con.executemany("INSERT INTO fulltext (rowid, text) "
+                                    "VALUES (?, ?)",
+                                    ((row[0], row[3]) for row in batch))
+                    con.executemany("INSERT INTO sources VALUES (?, ?, ?)",
+                                    (row[:3] for row in batch))
+                done += len(batch)
+                log.info('Indexed text of {}/{} attachments in {:0.3}s'.format(
+                    done, len(fresh), time() - start))
+        finally:
+            if removed or done:
+                with con:
+                    self._new_generation(con)
+            con.close()
+            self.con.close()
+        log.debug('Synced full text of {} attachments in {:0.3}s '
+                  '({} removed)'.format(len(fresh), time() - start,
+                                        len(removed)))
+
+    def _fulltext_rows(self, sources, shadow):
+        """Extract the text of the attachments in ``sources``.
+
+        Text comes from Zotero's :const:`FULLTEXT_CACHE` file or from
+        the attachment's file (see :func:`extract.extract`), read by
+        ``config.FULLTEXT_PROCESSES`` processes. Failing those, the
+        words Zotero indexed for the attachment are used.
+
+        :param sources: attachments, as from :meth:`_fulltext_sources`
+        :type sources: :class:`dict`
+        :param shadow: append an ASCII-folded copy to non-ASCII text?
+        :type shadow: :class:`boolean`
+        :returns: ``(id, parent item's key, signature, text)`` rows
+        :rtype: :class:`generator`
+
+        """
+        import extract
+        data_dir = os.path.dirname(self.zotero.original_sqlite)
+        pdftotext = extract.find_pdftotext(data_dir)
+        tasks = [(att_id, self._fulltext_cache(att_key), path, pdftotext)
+                 for (att_id, (att_key, parent, path, signature))
+                 in sources.iteritems()]
+        for (att_id, text) in extract.extract_all(
+                tasks, config.FULLTEXT_PROCESSES,
+                config.FULLTEXT_BATCH_SIZE):
+            if text is None:
+                text = self._fulltext_words(att_id)
+            if shadow and not isascii(text):
+                text = ' '.join([text, fold(text)])
+            (att_key, parent, path, signature) = sources[att_id]
+            yield (att_id, parent, signature, text)
+
+    def _fulltext_sources(self, att_ids=None):
+        """Get the attachments of library items whose text can be indexed
+        (only those in ``att_ids``, if given).
+
+        An attachment's signature changes whenever its text may have:
+        it is made of its ``fulltextItems`` row, the size and mtime of
+        its :const:`FULLTEXT_CACHE` file, and the path, size and mtime
+        of the attachment's file.
+
+        :returns: ``(key, parent item's key, path, signature)`` of each
+            attachment, keyed on its ``itemID``
+        :rtype: :class:`dict`
+
+        """
+        sql = """
+            SELECT itemAttachments.itemID, attachment.key, parent.key,
+                itemAttachments.path, fulltextItems.version,
+                fulltextItems.indexedChars
+            FROM itemAttachments
+            JOIN items AS attachment
+                ON attachment.itemID = itemAttachments.itemID
+            JOIN items AS parent
+                ON parent.itemID = itemAttachments.sourceItemID
+            LEFT JOIN fulltextItems
+                ON fulltextItems.itemID = itemAttachments.itemID
+        """
+        try:
+            rows = self._execute(sql).fetchall()
+        except sqlite3.OperationalError:
+            # no full text tables in this version of Zotero
+            return {}
+        # only attachments of items in ZotQuery's library
+        library = set(self.get_item_keys())
+        sources = {}
+        for (att_id, att_key, parent, att_path, version, chars) in rows:
+            if parent not in library:
+                continue
+            if att_ids is not None and att_id not in att_ids:
+                continue
+            attachment = self._attachment_dict(att_path, att_key) or {}
+            path = attachment.get('path')
+            cache = file_signature(self._fulltext_cache(att_key))
+            stat = file_signature(path) if path else None
+            if version is None and chars is None and not (cache or stat):
+                continue
+            signature = json.dumps([version, chars, cache, path, stat])
+            sources[att_id] = (att_key, parent, path, signature)
+        return sources
+
+    def _fulltext_words(self, att_id):
+        """Join the words Zotero indexed for an attachment.
+
+        :param att_id: Zotero ``itemID`` of the attachment
+        :type att_id: :class:`int`
+        :returns: the attachment's words
+        :rtype: :class:`unicode`
+
+        """
+        sql = """
+            SELECT fulltextWords.word
+            FROM fulltextItemWords
+            JOIN fulltextWords
+                ON fulltextWords.wordID = fulltextItemWords.wordID
+            WHERE fulltextItemWords.itemID = ?
+        """
+        return ' '.join(word for (word,) in self.con.execute(sql, (att_id,)))
+
+    def _fulltext_cache(self, att_key):
+        return os.path.join(self.zotero.internal_storage or '', att_key,
+                            FULLTEXT_CACHE)
+
+    def get_group_name(self, db, kind, key):
+        """Get the name of a collection or tag from the group index.
+
+        Names are remembered until the index's ``generation`` changes.
+
+        :param db: path to `.db` file
+        :type db: :class:`unicode`
+        :param kind: ``c`` (collection) or ``t`` (tag)
+        :type kind: :class:`unicode`
+        :param key: Zotero key of the group
+        :type key: :class:`unicode`
+        :returns: name of group, or ``None`` if it isn't indexed
+        :rtype: :class:`unicode`
+
+        """
+        index = (db, self.index_meta(db).get('generation'))
+        if self._group_names[0] != index:
+            self._group_names = (index, {})
+        names = self._group_names[1]
+        if (kind, key) not in names:
+            row = pool.connect(db).execute("""SELECT name FROM group_index
+                                              WHERE kind = ? AND key = ?""",
+                                           (kind, key)).fetchone()
+            names[(kind, key)] = row[0] if row else None
+        return names[(kind, key)]
+
+    def get_items(self, keys):
+        """Load the items with ``keys`` from the item store.
+
+        Only the requested items are read and decoded, rather than all
+        of ``json_data``.
+
+        :param keys: Zotero keys of items
+        :type keys: :class:`list`
+        :returns: found items, keyed on their Zotero key
+        :rtype: :class:`dict`
+
+        """
+        keys = list(keys)
+        items = {}
+        con = pool.connect(self.fts_sqlite)
+        # stay below SQLite's limit on bound parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            params = ', '.join('?' * len(chunk))
+            sql = """SELECT key, data FROM items
+                     WHERE key IN ({})""".format(params)
+            items.update((key, json.loads(data))
+                         for (key, data) in con.execute(sql, chunk))
+        return items
+
+    def get_feedback(self, keys):
+        """Load the formatted Alfred results of the items with ``keys``.
+
+        :param keys: Zotero keys of items
+        :type keys: :class:`list`
+        :returns: JSON of each found item's result, keyed on its key
+        :rtype: :class:`dict`
+
+        """
+        keys = list(keys)
+        feedback = {}
+        con = pool.connect(self.fts_sqlite)
+        # stay below SQLite's limit on bound parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            params = ', '.join('?' * len(chunk))
+            sql = """SELECT key, data FROM feedback
+                     WHERE key IN ({})""".format(params)
+            feedback.update(con.execute(sql, chunk))
+        # results that couldn't be formatted when indexed
+        for key in [key for key in feedback if feedback[key] is None]:
+            feedback[key] = self.format_feedback(key)
+            if feedback[key] is None:
+                del feedback[key]
+        return feedback
+
+    def get_item(self, key):
+        """Load the item with ``key`` from the item store.
+
+        :param key: Zotero key of item
+        :type key: :class:`unicode`
+        :returns: the item, or ``None`` if it isn't stored
+        :rtype: :class:`dict`
+
+        """
+        return self.get_items([key]).get(key)
+
+    def get_item_keys(self):
+        """Get the keys of all stored items.
+
+        :returns: Zotero keys of all items
+        :rtype: :class:`list`
+
+        """
+        con = pool.connect(self.fts_sqlite)
+        return [key for (key,) in con.execute("SELECT key FROM items")]
+
+    def update_feedback(self, fts_path):
+        """Re-format the stored feedback if its settings have changed.
+
+        Each item's Alfred result is formatted once, when it is indexed.
+        If the code or settings that format them no longer match the
+        fingerprint in the ``meta`` table (see
+        :meth:`feedback_fingerprint`), every result is formatted again
+        from the ``items`` table.
+
+        :param fts_path: path to `.db` file
+        :type fts_path: :class:`unicode`
+
+        """
+        fingerprint = self.feedback_fingerprint()
+        if self.index_meta(fts_path).get('feedback') == fingerprint:
+            return
+        start = time()
+        con = sqlite3.connect(fts_path)
+        with con:
+            items = [(key, json.loads(data)) for (key, data)
+                     in con.execute("SELECT key, data FROM items")]
+            con.execute("DELETE FROM feedback")
+            con.executemany(FEEDBACK_INSERT, self._feedback_rows(items))
+            con.execute("INSERT OR REPLACE INTO meta VALUES ('feedback', ?)",
+                        (fingerprint,))
+            self._new_generation(con)
+        con.close()
+        log.debug('Re-formatted {} results in {:0.3}s'.format(
+            len(items), time() - start))
+
+    @staticmethod
+    def feedback_fingerprint():
+        """Fingerprint of the code and settings that determine item feedback.
+
+        :returns: hash of :const:`FEEDBACK_VERSION`, the source of the
+            modules that format results (:mod:`results`, and
+            :mod:`config`, which defines ``QUICK_COPY``, ``LARGE_TEXT``
+            and ``ALFRED_LEARN`` and whatever they call), and the values
+            of those settings that aren't functions
+        :rtype: :class:`unicode`
+
+        """
+        import results
+        digest = hashlib.md5(str(FEEDBACK_VERSION))
+        for module in (config, results):
+            path = os.path.splitext(module.__file__)[0] + '.py'
+            with open(path, 'rb') as file_obj:
+                digest.update(file_obj.read())
+        for setting in (config.QUICK_COPY, config.LARGE_TEXT,
+                        config.ALFRED_LEARN):
+            if not callable(setting):
+                digest.update(repr(setting))
+        return digest.hexdigest().decode('ascii')
+
+    def format_feedback(self, key):
+        """Format the Alfred result of the item with ``key`` on demand,
+        if it couldn't be when the item was indexed.
+
+        :param key: Zotero key of item
+        :type key: :class:`unicode`
+        :returns: JSON of the result, or ``None`` if it can't be formatted
+        :rtype: :class:`unicode`
+
+        """
+        item = self.get_item(key)
+        if item is None:
+            return None
+        return self._format_feedback(key, item)
+
+    @staticmethod
+    def _new_generation(con):
+        """Mark the index at ``con`` as changed, e.g. for cached results.
+
+        :param con: open connection
+        :type con: :class:`sqlite3.Connection`
+
+        """
+        con.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)",
+                    (uuid.uuid4().hex,))
+
+    @staticmethod
+    def _feedback_rows(items):
+        """Format ``(key, item)`` pairs into rows for the ``feedback`` table.
+
+        :param items: ``(key, item)`` pairs
+        :type items: :class:`list`
+        :returns: values for :const:`FEEDBACK_INSERT`
+        :rtype: :class:`generator`
+
+        """
+        for (key, item) in items:
+            yield (key, key, ZotqueryBackend._format_feedback(key, item))
+
+    @staticmethod
+    def _format_feedback(key, item):
+        """Format one item's Alfred result.
+
+        An item the formatter fails on is logged and gets ``None``
+        (stored as ``NULL``), so one bad item can't stop the others
+        from being formatted.
+
+        :returns: JSON of the result, or ``None``
+        :rtype: :class:`unicode`
+
+        """
+        from results import ResultsFormatter
+        try:
+            return json.dumps(ResultsFormatter(item).prepare_item_feedback())
+        except Exception:
+            log.error('Cannot format result of item {}:\n{}'.format(
+                key, utils.full_stack()))
+            return None
+
+    def _index_inserts(self, json_data, shadow):
+        """Statements and rows to store and index the items in ``json_data``.
+
+        Items are stored first, so each FTS row and result can take the
+        ``id`` of its item.
+
+        :param json_data: items to insert, keyed on their Zotero key
+        :type json_data: :class:`dict`
+        :param shadow: append an ASCII-folded copy to non-ASCII values?
+        :type shadow: :class:`boolean`
+        :returns: ``(sql, rows)`` pairs, in the order they must run
+        :rtype: :class:`tuple`
+
+        """
+        items = ((key, json.dumps(item))
+                 for (key, item) in json_data.iteritems())
+        rows = self._index_rows(self.generate_data(json_data=json_data),
+                                shadow)
+        feedback = self._feedback_rows(json_data.iteritems())
+        names = ((key, field, name)
+                 for (key, item) in json_data.iteritems()
+                 for (field, name) in self._item_names(item))
+        grams = ((gram, key)
+                 for (key, item) in json_data.iteritems()
+                 for gram in set(gram for (_, name) in self._item_names(item)
+                                 for gram in trigrams(name)))
+        return (("INSERT INTO items (key, data) VALUES (?, ?)", items),
+                (self._index_insert_sql(), rows),
+                (FEEDBACK_INSERT, feedback),
+                (NAMES_INSERT, names),
+                (TRIGRAMS_INSERT, grams))
+
+    @staticmethod
+    def _item_names(item):
+        """Get the normalized names of ``item`` in each of
+        ``config.TRIGRAM_COLUMNS``, e.g. its creators' family names.
+
+        File extensions in ``config.ATTACH_EXTS`` are dropped.
+
+        :param item: the item's JSON
+        :type item: :class:`dict`
+        :returns: ``(column, name)`` pairs
+        :rtype: :class:`set`
+
+        """
+        names = set()
+        for column in config.TRIGRAM_COLUMNS:
+            (key, val) = config.FILTERS_MAP[column]
+            for entry in item.get(key) or []:
+                name = normalize(entry.get(val) or '')
+                (stem, ext) = os.path.splitext(name)
+                if ext[1:] in config.ATTACH_EXTS:
+                    name = stem
+                if name:
+                    names.add((column, name))
+        return names
+
+    @staticmethod
+    def _index_insert_sql():
+        """SQL to insert one row of bound values into the FTS table.
+
+        The first value is the item's key, to look up the row's ``rowid``
+        in the ``items`` table.
+
+        """
+        # names of all columns (cf. `FILTERS['general']`)
+        columns = [column for column in config.FILTERS['general']
+                   if column in config.FILTERS_MAP]
+        return """INSERT INTO zotquery (rowid, {columns})
+                  VALUES ((SELECT id FROM items WHERE key = ?),
+                          {params})""".format(
+            columns=', '.join(columns),
+            params=', '.join('?' * len(columns)))
+
+    @staticmethod
+    def _index_rows(rows, shadow):
+        """Convert rows from :meth:`generate_data` into value tuples.
+
+        :param rows: rows from :meth:`generate_data`
+        :type rows: :class:`generator`
+        :param shadow: append an ASCII-folded copy to non-ASCII values?
+        :type shadow: :class:`boolean`
+        :returns: item key, then values of each row in column order
+        :rtype: :class:`generator`
+
+        """
+        for row in rows:
+            values = [x.values()[0] for x in row]
+            key = values[config.FILTERS['general'].index('key')]
+            if shadow:
+                values = [value if isascii(value)
+                          else ' '.join([value, fold(value)])
+                          for value in values]
+            yield tuple([key] + values)
+
+    @staticmethod
+    def _set_pragmas(con, pragmas):
+        """Apply ``pragmas`` to ``con`` and return their previous values.
+
+        :param con: open connection
+        :type con: :class:`sqlite3.Connection`
+        :param pragmas: ``(name, value)`` pairs
+        :type pragmas: :class:`tuple`
+        :returns: ``(name, value)`` pairs as they were before
+        :rtype: :class:`tuple`
+
+        """
+        previous = []
+        for (name, value) in pragmas:
+            (current,) = con.execute('PRAGMA {}'.format(name)).fetchone()
+            previous.append((name, current))
+            con.execute('PRAGMA {} = {}'.format(name, value))
+        return tuple(previous)
+
+    def generate_data(self, keys=None, json_data=None):
         """Create a genererator with dictionaries for each item
         in ``json_data``.
 
+        :param keys: only generate data for these items (default: all)
+        :type keys: :class:`set`
+        :param json_data: library data, if already loaded
+        :type json_data: :class:`dict`
         :returns: ``list`` of ``dicts`` with all item's data as ``strings``
         :rtype: :class:`genererator`
 
         """
-        json_data = utils.read_json(self.json_data)
+        if json_data is None:
+            json_data = utils.read_json(self.json_data)
+        if keys is not None:
+            json_data = dict((key, json_data[key]) for key in keys
+                             if key in json_data)
         # for each `item`, get its data in dict format
         for item in json_data.itervalues():
             array = list()
@@ -354,7 +1904,9 @@ class ZotqueryBackend(PropertyBase):
 
     @staticmethod
     def make_rank_func(weights):
-        """Search ranking function.
+        """Search ranking function for FTS3/FTS4 indexes.
+
+        FTS5 indexes are ranked with SQLite's built-in ``bm25()`` instead.
 
         Use floats (1.0 not 1) for more accurate results. Use 0 to ignore a
         column.
@@ -444,16 +1996,77 @@ class ZotqueryBackend(PropertyBase):
 
         """
         start = time()
+        # record sync state before reading, so no edit can slip between
+        state = self._sync_state()
+        all_items = self._extract_items()
+        self.con.close()
+        self.wf.store_data('zotquery', all_items, serializer='json')
+        self.wf.store_data('sync_state', state, serializer='json')
+        log.info('Created JSON file in {:0.3}s'.format(time() - start))
+
+    def _extract_items(self, item_ids=None):
+        """Build every item's dictionary from a handful of bulk queries.
+
+        Each relation (creators, metadata, collections, tags, attachments,
+        notes) is read with one joined query over the whole library and
+        grouped in Python by ``itemID``. The result is identical to
+        :meth:`_extract_items_serial`, which queries item by item.
+
+        :param item_ids: only extract these items (default: all)
+        :type item_ids: :class:`set`
+        :returns: all items, keyed on their Zotero key
+        :rtype: :class:`dict`
+
+        """
         all_items = {}
-        # get key data for each Zotero item
-        info_sql = """
-            SELECT key, itemID, itemTypeID, libraryID
-            FROM items
-            WHERE
-                itemTypeID not IN (1, 13, 14)
-            ORDER BY dateAdded DESC
+        scoped = item_ids is not None
+        # bulk queries are limited to these items (see :meth:`_scope`);
+        # kept in SQL rather than a temp table, as Zotero's data is
+        # opened read-only
+        self._scope_ids = sorted(item_ids) if scoped else []
+        type_names = dict(self._execute("""
+            SELECT itemTypeID, typeName
+            FROM itemTypes
+        """).fetchall())
+        # each relation is read only once for the entire library
+        relations = (
+            ('creators', self._bulk_creators(scoped), list),
+            ('data', self._bulk_metadata(scoped), OrderedDict),
+            ('zot-collections', self._bulk_collections(scoped), list),
+            ('zot-tags', self._bulk_tags(scoped), list),
+            ('attachments', self._bulk_attachments(scoped), list),
+            ('notes', self._bulk_notes(scoped), list))
+        for basic in self._library_items(scoped):
+            (item_key,
+             item_id,
+             item_type_id,
+             library_id) = basic
+            library_id = library_id if library_id is not None else '0'
+            # prepare item's root dict
+            item_dict = OrderedDict()
+            item_dict['key'] = item_key
+            item_dict['library'] = library_id
+            item_dict['type'] = type_names.get(item_type_id)
+            # attach pre-grouped data for each relation
+            for (name, grouped, empty) in relations:
+                item_dict[name] = grouped.get(item_id, empty())
+            all_items[item_key] = item_dict
+        return all_items
+
+    def _extract_items_serial(self):
+        """Build every item's dictionary with per-item queries.
+
+        This is the original extraction path. It is kept as the reference
+        implementation for :meth:`_extract_items` (see
+        :file:`dev/_benchmarks.py`).
+
+        :returns: all items, keyed on their Zotero key
+        :rtype: :class:`dict`
+
         """
-        basic_info = self._execute(info_sql)
+        all_items = {}
+        # get key data for each Zotero item
+        basic_info = self._execute(self._basic_info_sql()).fetchall()
         # iterate thru every item
         for basic in basic_info:
             # prepare item's root dict and metadata dict
@@ -486,9 +2099,54 @@ class ZotqueryBackend(PropertyBase):
             item_dict['notes'] = self._item_notes(item_id)
             # add all data as value of `item_key`
             all_items[item_key] = item_dict
-        self.con.close()
-        self.wf.store_data('zotquery', all_items, serializer='json')
-        log.info('Created JSON file in {:0.3}s'.format(time() - start))
+        return all_items
+
+    def _library_items(self, scoped=False):
+        """Get key data for each Zotero item that belongs in the library.
+
+        :param scoped: only read the items passed to :meth:`_extract_items`
+        :type scoped: :class:`boolean`
+        :returns: ``(key, itemID, itemTypeID, libraryID)`` of each item
+        :rtype: :class:`list`
+
+        """
+        sql = self._basic_info_sql(self._scope('itemID', scoped))
+        # If user only wants personal library
+        return [basic for basic in self._execute(sql).fetchall()
+                if not (config.PERSONAL_ONLY is True and
+                        basic[3] is not None)]
+
+    @staticmethod
+    def _basic_info_sql(scope='1'):
+        """SQL to get key data for each Zotero item not in the trash.
+
+        """
+        return """
+            SELECT key, itemID, itemTypeID, libraryID
+            FROM items
+            WHERE
+                itemTypeID not IN (1, 13, 14)
+                and itemID not IN (SELECT itemID FROM deletedItems)
+                and {scope}
+            ORDER BY dateAdded DESC
+        """.format(scope=scope)
+
+    def _scope(self, column, scoped):
+        """SQL condition limiting ``column`` to the items being extracted.
+
+        :param column: name of column holding an ``itemID``
+        :type column: :class:`unicode`
+        :param scoped: only match the items passed to
+            :meth:`_extract_items`
+        :type scoped: :class:`boolean`
+        :returns: SQL condition
+        :rtype: :class:`unicode`
+
+        """
+        if scoped:
+            ids = ', '.join(str(int(item_id)) for item_id in self._scope_ids)
+            return '{} IN ({})'.format(column, ids)
+        return '1'
 
     def _execute(self, sql):
         """Execute sqlite query and return sqlite object.
@@ -669,8 +2327,10 @@ class ZotqueryBackend(PropertyBase):
                 #if self.personal_only == False:
                 group_info_sql = """
                     SELECT collections.collectionName,
-                        collections.key, groups.name, groups.libraryID
-                    FROM collections, groups
+                        collections.key, groups.name, collections.libraryID
+                    FROM collections
+                    LEFT JOIN groups
+                        ON groups.libraryID = collections.libraryID
                     WHERE
                         collections.collectionID = {0}
                         and collections.libraryID is not null
@@ -805,6 +2465,280 @@ class ZotqueryBackend(PropertyBase):
             all_notes.append(note[33:-10])
         return all_notes
 
+    ### Bulk Item Data --------------------------------------------------------
+
+    def _group_rows(self, sql):
+        """Run ``sql`` once and group the rows on their first column.
+
+        Rows keep the order in which the query returns them.
+
+        :param sql: SQL query whose first column is an ``itemID``
+        :type sql: :class:`unicode`
+        :returns: remaining columns of each row, keyed on ``itemID``
+        :rtype: :class:`dict`
+
+        """
+        grouped = defaultdict(list)
+        for row in self._execute(sql):
+            grouped[row[0]].append(row[1:])
+        return grouped
+
+    def _bulk_creators(self, scoped=False):
+        """Get creator information for every item in one query.
+
+        :param scoped: only read the items passed to :meth:`_extract_items`
+        :type scoped: :class:`boolean`
+        :returns: creator information, keyed on ``itemID``
+        :rtype: :class:`dict`
+
+        """
+        sql = """
+            SELECT itemCreators.itemID, creatorData.lastName,
+                creatorData.firstName, creatorTypes.creatorType,
+                itemCreators.orderIndex
+            FROM itemCreators
+            JOIN creators
+                ON creators.creatorID = itemCreators.creatorID
+            JOIN creatorData
+                ON creatorData.creatorDataID = creators.creatorDataID
+            JOIN creatorTypes
+                ON creatorTypes.creatorTypeID = itemCreators.creatorTypeID
+            WHERE
+                {scope}
+            ORDER BY itemCreators.itemID, itemCreators.creatorID,
+                itemCreators.creatorTypeID, itemCreators.orderIndex
+        """.format(scope=self._scope('itemCreators.itemID', scoped))
+        all_creators = {}
+        for (item_id, rows) in self._group_rows(sql).iteritems():
+            all_creators[item_id] = [{'family': last_name,
+                                      'given': first_name,
+                                      'type': c_type,
+                                      'index': order_index}
+                                     for (last_name,
+                                          first_name,
+                                          c_type,
+                                          order_index) in rows]
+        return all_creators
+
+    def _bulk_metadata(self, scoped=False):
+        """Get metadata for every item in one query.
+
+        :param scoped: only read the items passed to :meth:`_extract_items`
+        :type scoped: :class:`boolean`
+        :returns: metadata information, keyed on ``itemID``
+        :rtype: :class:`dict`
+
+        """
+        sql = """
+            SELECT itemData.itemID, fields.fieldName, itemDataValues.value
+            FROM itemData
+            JOIN fields
+                ON fields.fieldID = itemData.fieldID
+            JOIN itemDataValues
+                ON itemDataValues.valueID = itemData.valueID
+            WHERE
+                {scope}
+            ORDER BY itemData.itemID, itemData.fieldID
+        """.format(scope=self._scope('itemData.itemID', scoped))
+        all_meta = {}
+        for (item_id, rows) in self._group_rows(sql).iteritems():
+            item_meta = OrderedDict()
+            for (field_name, value_name) in rows:
+                # if unique metadata field
+                if field_name in item_meta:
+                    continue
+                if field_name == 'date':
+                    item_meta[field_name] = value_name[0:4]
+                else:
+                    item_meta[field_name] = value_name
+            all_meta[item_id] = item_meta
+        return all_meta
+
+    def _bulk_collections(self, scoped=False):
+        """Get collection information for every item in one query.
+
+        :param scoped: only read the items passed to :meth:`_extract_items`
+        :type scoped: :class:`boolean`
+        :returns: collection information, keyed on ``itemID``
+        :rtype: :class:`dict`
+
+        """
+        sql = """
+            SELECT collectionItems.itemID, collections.collectionName,
+                collections.key, collections.libraryID, groups.name
+            FROM collectionItems
+            JOIN collections
+                ON collections.collectionID = collectionItems.collectionID
+            LEFT JOIN groups
+                ON groups.libraryID = collections.libraryID
+            WHERE
+                {scope}
+            ORDER BY collectionItems.itemID, collectionItems.rowid
+        """.format(scope=self._scope('collectionItems.itemID', scoped))
+        all_collections = {}
+        for (item_id, rows) in self._group_rows(sql).iteritems():
+            collections = []
+            for (name, key, library_id, group_name) in rows:
+                # personal collections have no library
+                if library_id is None:
+                    collections.append({'name': name,
+                                        'key': key,
+                                        'library_id': '0',
+                                        'group': 'personal'})
+                else:
+                    collections.append({'name': name,
+                                        'key': key,
+                                        'library_id': library_id,
+                                        'group': group_name})
+            all_collections[item_id] = collections
+        return all_collections
+
+    def _bulk_tags(self, scoped=False):
+        """Get tag information for every item in one query.
+
+        :param scoped: only read the items passed to :meth:`_extract_items`
+        :type scoped: :class:`boolean`
+        :returns: tag information, keyed on ``itemID``
+        :rtype: :class:`dict`
+
+        """
+        sql = """
+            SELECT itemTags.itemID, tags.name, tags.key
+            FROM itemTags
+            JOIN tags
+                ON tags.tagID = itemTags.tagID
+            WHERE
+                {scope}
+            ORDER BY itemTags.itemID, itemTags.tagID
+        """.format(scope=self._scope('itemTags.itemID', scoped))
+        all_tags = {}
+        for (item_id, rows) in self._group_rows(sql).iteritems():
+            all_tags[item_id] = [{'name': tag_name,
+                                  'key': tag_key}
+                                 for (tag_name, tag_key) in rows]
+        return all_tags
+
+    def _bulk_attachments(self, scoped=False):
+        """Get attachment information for every item in one query.
+
+        :param scoped: only read the items passed to :meth:`_extract_items`
+        :type scoped: :class:`boolean`
+        :returns: attachment information, keyed on ``itemID``
+        :rtype: :class:`dict`
+
+        """
+        sql = """
+            SELECT itemAttachments.sourceItemID, itemAttachments.path,
+                items.key
+            FROM itemAttachments
+            LEFT JOIN items
+                ON items.itemID = itemAttachments.itemID
+            WHERE
+                itemAttachments.sourceItemID IS NOT NULL
+                and {scope}
+            ORDER BY itemAttachments.sourceItemID, itemAttachments.itemID
+        """.format(scope=self._scope('itemAttachments.sourceItemID', scoped))
+        all_attachments = {}
+        for (item_id, rows) in self._group_rows(sql).iteritems():
+            attachments = []
+            for (att_path, att_key) in rows:
+                attachment = self._attachment_dict(att_path, att_key)
+                if attachment:
+                    attachments.append(attachment)
+            all_attachments[item_id] = attachments
+        return all_attachments
+
+    def _attachment_dict(self, att_path, att_key):
+        """Generate the dict for one attachment, if it should be listed.
+
+        :param att_path: path of attachment as stored by Zotero
+        :type att_path: :class:`unicode`
+        :param att_key: Zotero key of the attachment item
+        :type att_key: :class:`unicode`
+        :returns: attachment information or ``None``
+        :rtype: :class:`dict`
+
+        """
+        # if attachment has no path
+        if not att_path:
+            return None
+        # if internal attachment
+        if att_path[:8] == "storage:":
+            att_path = att_path[8:]
+            base = os.path.join(self.zotero.internal_storage, att_key)
+        # if external attachment
+        elif att_path[:12] == "attachments:":
+            att_path = att_path[12:]
+            base = self.zotero.external_storage
+        # if other kind of attachment
+        else:
+            return {'name': att_path.split('/')[-1],
+                    'key': None,
+                    'path': att_path}
+        # if right kind of attachment
+        if True in (att_path.endswith(ext) for ext in config.ATTACH_EXTS):
+            return {'name': att_path,
+                    'key': att_key,
+                    'path': os.path.join(base, att_path)}
+        return None
+
+    def _bulk_notes(self, scoped=False):
+        """Get notes for every item in one query.
+
+        :param scoped: only read the items passed to :meth:`_extract_items`
+        :type scoped: :class:`boolean`
+        :returns: note information, keyed on ``itemID``
+        :rtype: :class:`dict`
+
+        """
+        sql = """
+            SELECT sourceItemID, note
+            FROM itemNotes
+            WHERE
+                sourceItemID IS NOT NULL
+                and {scope}
+            ORDER BY sourceItemID, itemID
+        """.format(scope=self._scope('sourceItemID', scoped))
+        all_notes = {}
+        for (item_id, rows) in self._group_rows(sql).iteritems():
+            # strip note HTML before adding
+            all_notes[item_id] = [note[33:-10] for (note,) in rows]
+        return all_notes
+
+
+#-----------------------------------------------------------------------------
+# Helper functions
+#-----------------------------------------------------------------------------
+
+def changed_entries(manifest, other):
+    """Get the keys whose values differ between dicts ``manifest``
+    (as stored, i.e. as JSON) and ``other``, or are only in one.
+
+    """
+    other = json.loads(json.dumps(other))
+    return set(key for key in set(manifest) | set(other)
+               if manifest.get(key) != other.get(key))
+
+
+def copy_sqlite(source_path, target_path, suffixes):
+    """Copy the database at ``source_path`` and whichever of its
+    journal files (by ``suffixes``) exist, removing stale ones.
+
+    """
+    for suffix in suffixes:
+        if os.path.exists(source_path + suffix):
+            copyfile(source_path + suffix, target_path + suffix)
+        elif os.path.exists(target_path + suffix):
+            os.unlink(target_path + suffix)
+
+
+def remove_sqlite(path):
+    """Remove the database at ``path`` and its journal files."""
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+
+
 #-----------------------------------------------------------------------------
 # Alias
 #-----------------------------------------------------------------------------
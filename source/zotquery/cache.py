@@ -0,0 +1,244 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright © 2014 stephen.margheim@gmail.com
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+from __future__ import unicode_literals
+
+# Standard Library
+import re
+import json
+import sqlite3
+import unicodedata
+from time import time
+
+# Internal Dependencies
+import config
+
+log = config.log
+
+# Runs of letters and digits, as split by the `unicode61` tokenizer
+TOKENS = re.compile(r'[^\W_]+', re.UNICODE)
+
+# Version of the layout of the results cache; older caches are dropped
+RESULT_CACHE_SCHEMA = 2
+
+
+#------------------------------------------------------------------------------
+# :class:`ResultCache` --------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class ResultCache(object):
+    """Persistent cache of item search results, for search-as-you-type.
+
+    Results are keyed on ``(scope, normalized query)`` and only valid
+    for the index ``generation`` they were read from. A query that
+    extends a cached query (`margh` after `marg`) can only match a
+    subset of its results, so with FTS5's query semantics they are
+    narrowed from the cached results instead of searching the index.
+    Queries without results are cached too, but not queries without
+    tokens (`''`, `'.'`), which would be a prefix of every query and
+    narrow it down to nothing. Least recently used
+    entries are evicted once the cache exceeds
+    ``config.RESULT_CACHE_SIZE`` bytes.
+
+    Each result is stored as ``(feedback, text)``: the Alfred feedback
+    and the text of the columns it was matched on. Only the first page
+    of results is cached (see ``config.RESULTS_LIMIT``); only a complete
+    one, with every result of its query, can be narrowed down.
+
+    """
+    def __init__(self, path, generation):
+        """Initialize class instance.
+
+        :param path: path to cache `.db` file
+        :type path: :class:`unicode`
+        :param generation: generation of the current search index
+        :type generation: :class:`unicode`
+
+        """
+        self.generation = generation
+        self.con = sqlite3.connect(path)
+        (version,) = self.con.execute('PRAGMA user_version').fetchone()
+        with self.con:
+            if version != RESULT_CACHE_SCHEMA:
+                self.con.execute('DROP TABLE IF EXISTS results')
+                self.con.execute('PRAGMA user_version = {}'.format(
+                    RESULT_CACHE_SCHEMA))
+            self.con.execute("""CREATE TABLE IF NOT EXISTS results
+                                (scope TEXT,
+                                 query TEXT,
+                                 generation TEXT,
+                                 data TEXT,
+                                 complete INTEGER,
+                                 used REAL,
+                                 PRIMARY KEY (scope, query))""")
+
+    def get(self, scope, query, narrow=False):
+        """Get cached results for ``query``.
+
+        :param scope: search scope
+        :type scope: :class:`unicode`
+        :param query: user's query
+        :type query: :class:`unicode`
+        :param narrow: may results be narrowed from a shorter query's?
+        :type narrow: :class:`boolean`
+        :returns: ``(results, complete)``, with ``(feedback, text)``
+            results, or ``None`` if the query must be run against the
+            index
+        :rtype: :class:`tuple`
+
+        """
+        query = normalize(query)
+        rows = self.con.execute("""SELECT query, data, complete FROM results
+                                   WHERE scope = ? AND generation = ?
+                                   AND substr(?, 1, length(query)) = query
+                                   AND (complete OR query = ?)
+                                   ORDER BY length(query) DESC""",
+                                (scope, self.generation, query, query))
+        # only narrow down from queries with tokens (see `put`)
+        row = next((row for row in rows
+                     if row[0] == query or tokenize(row[0])), None)
+        if not row:
+            return None
+        (cached_query, data, complete) = row
+        if cached_query != query:
+            if not narrow:
+                return None
+            terms = [tokenize(term) for term in query.split()]
+            # punctuation-only terms can't be matched outside of the index
+            if not all(terms):
+                return None
+        with self.con:
+            self.con.execute("""UPDATE results SET used = ?
+                                WHERE scope = ? AND query = ?""",
+                             (time(), scope, cached_query))
+        results = json.loads(data)
+        if cached_query != query:
+            superset = results
+            results = [result for result in superset
+                       if matches(terms, tokenize(result[1]))]
+            log.debug('Narrowed {} cached results for `{}` '
+                      'to {}'.format(len(superset), cached_query,
+                                     len(results)))
+            self.put(scope, query, results)
+        return (results, bool(complete))
+
+    def put(self, scope, query, results, complete=True):
+        """Cache ``results`` for ``query`` and evict old entries.
+
+        :param scope: search scope
+        :type scope: :class:`unicode`
+        :param query: user's query
+        :type query: :class:`unicode`
+        :param results: ``(feedback, text)`` results
+        :type results: :class:`list`
+        :param complete: are these all of the query's results?
+        :type complete: :class:`boolean`
+
+        """
+        if not tokenize(query):
+            return
+        with self.con:
+            self.con.execute("DELETE FROM results WHERE generation != ?",
+                             (self.generation,))
+            self.con.execute("""INSERT OR REPLACE INTO results
+                                VALUES (?, ?, ?, ?, ?, ?)""",
+                             (scope, normalize(query), self.generation,
+                              json.dumps(results), complete, time()))
+            self._evict()
+
+    def close(self):
+        self.con.close()
+
+    def _evict(self):
+        """Drop least recently used entries until within budget.
+
+        """
+        rows = self.con.execute("""SELECT rowid, length(data) FROM results
+                                   ORDER BY used DESC""").fetchall()
+        size = 0
+        for (rowid, length) in rows:
+            size += length
+            if size > config.RESULT_CACHE_SIZE:
+                self.con.execute("DELETE FROM results WHERE rowid = ?",
+                                 (rowid,))
+
+
+#------------------------------------------------------------------------------
+# Matching helpers ------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+def normalize(text):
+    """Lowercase ``text``, strip diacritics and collapse whitespace."""
+    text = unicodedata.normalize('NFD', config.decode(text).lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.split())
+
+
+def tokenize(text):
+    """Split ``text`` into normalized tokens, like the index does."""
+    return TOKENS.findall(normalize(text))
+
+
+def matches(terms, tokens):
+    """Would FTS5 match ``tokens`` against a query of ``terms``?
+
+    Each term is a phrase of tokens that must all be found, the last
+    one as a prefix (see :func:`search.make_item_fuzzy`).
+
+    :param terms: tokens of each term in the query
+    :type terms: :class:`list`
+    :param tokens: tokens of the text being searched
+    :type tokens: :class:`list`
+    :rtype: :class:`boolean`
+
+    """
+    last = len(terms) - 1
+    return all(contains(tokens, term, prefix=(i == last))
+               for (i, term) in enumerate(terms))
+
+
+def contains(tokens, phrase, prefix=False):
+    """Is ``phrase`` a run of ``tokens``? If ``prefix``, its last token
+    need only start a token."""
+    size = len(phrase)
+    for start in range(len(tokens) - size + 1):
+        window = tokens[start:start + size]
+        if window[:-1] != phrase[:-1]:
+            continue
+        if window[-1] == phrase[-1] or (prefix and
+                                        window[-1].startswith(phrase[-1])):
+            return True
+    return False
+
+
+def trigrams(text):
+    """Every run of three characters in ``text``."""
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def edit_distance(a, b, limit):
+    """Number of edits (insertions, deletions, substitutions and swaps
+    of neighbours) between ``a`` and ``b``, or ``limit + 1`` if it is
+    more than ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = range(len(b) + 1)
+    for (i, char_a) in enumerate(a, 1):
+        current = [i]
+        for (j, char_b) in enumerate(b, 1):
+            cost = min(previous[j] + 1,
+                       current[j - 1] + 1,
+                       previous[j - 1] + (char_a != char_b))
+            if (i > 1 and j > 1 and char_a == b[j - 2] and
+                    a[i - 2] == char_b):
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        (before, previous) = (previous, current)
+    return min(previous[-1], limit + 1)
@@ -11,20 +11,31 @@ from __future__ import unicode_literals
 
 # Standard Library
 import re
+import sys
 import json
 import os.path
 import functools
 
 # Internal Dependencies
 from lib import utils
-from workflow import Workflow, PasswordNotFound
+from settings import Settings, BACKENDS
+from workflow import Workflow
 
+__version__ = '10.0'
+
+# Where and how often to check for a new release of ZotQuery; only
+# runs of `zotquery.py` from Alfred check, not every import of `config`
+UPDATE_SETTINGS = {
+    'github_slug': 'smargh/alfred_zotquery',
+    'version': __version__,
+    'frequency': 7
+}
+
+# the `Workflow()` shared by all of ZotQuery
 WF = Workflow()
 log = WF.logger
 decode = WF.decode
 
-__version__ = '10.0'
-
 __usage__ = """
 ZotQuery -- An Alfred GUI for `zotero`
 
@@ -111,9 +122,32 @@ LARGE_TEXT = large_text
 # Only save and search items from your Personal Zotero library?
 PERSONAL_ONLY = False
 
+# Also search a collection's subcollections when searching within it?
+SUBCOLLECTIONS = False
+
 # Cache formatted references for faster re-retrieval?
 CACHE_REFERENCES = True
 
+# Read Zotero's database in place (read-only) instead of from a clone?
+# The clone is still used whenever Zotero has the database locked, and
+# always where SQLite can't open it read-only (see `can_open_readonly`).
+READ_LIVE = True
+
+# Where to look for Zotero's `prefs.js`: Zotero Standalone's and
+# Firefox's profiles, on a Mac and on Linux. Only if none is found is
+# Spotlight searched (on a Mac).
+ZOTERO_PREFS_PATHS = [
+    '~/Library/Application Support/Zotero/Profiles/*/prefs.js',
+    '~/Library/Application Support/Firefox/Profiles/*/prefs.js',
+    '~/.zotero/zotero/*/prefs.js',
+    '~/.mozilla/firefox/*/prefs.js'
+]
+
+# Zotero data directories to try if Zotero's preferences don't name one
+ZOTERO_DATA_DIRS = [
+    '~/Zotero'
+]
+
 # Allow ZotQuery to learn which items are used more frequently?
 ALFRED_LEARN = False
 
@@ -165,6 +199,11 @@ FILTERS = {
     'notes': [
         'key', 'notes'
     ],
+    # metadata, plus the text of attachments (see `backend.fulltext_sqlite`)
+    'fulltext': [
+        'key', 'title', 'creators', 'collection_title',
+        'date', 'tags', 'collections', 'attachments', 'notes'
+    ],
     'tag': [
         'key', 'tags'
     ],
@@ -173,18 +212,91 @@ FILTERS = {
     ]
 }
 
+# Relative ranking weight of each search column. Columns outside of
+# the current search filter are always weighted `0.0`. `fulltext` is
+# the weight of the text of attachments, in the `fulltext` filter.
+COLUMN_WEIGHTS = {
+    'key': 1.0,
+    'title': 1.0,
+    'creators': 1.0,
+    'collection_title': 1.0,
+    'date': 1.0,
+    'tags': 1.0,
+    'collections': 1.0,
+    'attachments': 1.0,
+    'notes': 1.0,
+    'fulltext': 1.0
+}
+
+# Search columns whose names are also indexed by their trigrams, so a
+# query matches inside them, and despite typos (see `search.get_name_hits`)
+TRIGRAM_COLUMNS = ['creators', 'attachments']
+
+# Number of typos forgiven in each query term matched against those names
+TRIGRAM_TYPOS = 1
+
 # Map of search types (`key`) to search filters (`value`)
 SCOPE_TYPES = {
-    'items': ['general', 'titles', 'creators', 'attachments', 'notes'],
+    'items': ['general', 'titles', 'creators', 'attachments', 'notes',
+              'fulltext'],
     'groups': ['collections', 'tags'],
     'in-groups': ['in-collection', 'in-tag'],
     'meta': ['debug', 'new']
 }
 
+# Build search indexes with SQLite's FTS5 module (and its native `bm25()`
+# ranking) when available? Falls back to FTS4/FTS3 otherwise.
+USE_FTS5 = True
+
+# Number of items written per transaction when building a search index
+INDEX_BATCH_SIZE = 1000
+
+# Number of attachments whose text is written per transaction when
+# indexing attachments; an interrupted update resumes after the last
+FULLTEXT_BATCH_SIZE = 100
+
+# Number of processes extracting attachments' text (`None`: one per core)
+FULLTEXT_PROCESSES = None
+
+# Maximum number of characters of an attachment's text that are indexed
+FULLTEXT_MAX_CHARS = 500000
+
+# Seconds `pdftotext` or `textutil` may take over one attachment before
+# it is killed, and the attachment's text is left out
+FULLTEXT_TIMEOUT = 60
+
+# Times Zotero's database is copied while Zotero holds its lock, before
+# giving up on a copy nothing was written to meanwhile
+CLONE_COPY_ATTEMPTS = 3
+
+# Maximum size (in bytes) of the cache of search-as-you-type results
+RESULT_CACHE_SIZE = 8 * 1024 * 1024
+
+# Number of results shown for an item search. Ending a query with
+# MORE_RESULTS shows the next page of results (`marg >>`: the third)
+RESULTS_LIMIT = 50
+MORE_RESULTS = '>'
+
+# Seconds between background checks of whether the index is up-to-date
+REFRESH_INTERVAL = 60
+
+# Seconds the resident server waits for a request before exiting
+SERVER_IDLE = 15 * 60
+
+# Where the Zotero API key and user ID are kept: `keychain`, or `file`
+# (a JSON file only the user can read) where there is no Keychain
+SECRETS_BACKEND = 'keychain' if sys.platform == 'darwin' else 'file'
+
+# Seconds a secret is trusted before it is looked up again
+SECRET_TTL = 10 * 60
+
 # Path to `pashua` housed in bundler directory
 PASHUA = os.path.join(WF.workflowfile('zotquery/lib/Pashua.app'),
                       'Contents/MacOS/Pashua')
 
+# settings snapshot shared by all of ZotQuery
+SETTINGS = Settings(WF, BACKENDS[SECRETS_BACKEND](WF), SECRET_TTL)
+
 
 # -----------------------------------------------------------------------------
 # WORKFLOW Classes and Functions
@@ -213,12 +325,11 @@ class PropertyBase(object):
         """
         def getter():
             # look for file in workflow's storage dir
-            return self.wf.stored_data(self.class_name)
+            return SETTINGS.stored(self.class_name)
 
         def setter(properties):
             # save that dictionary to disk in JSON format
-            self.wf.store_data(self.class_name, properties,
-                               serializer='json')
+            SETTINGS.store(self.class_name, properties)
             return True
 
         return self.get_properties(getter, setter)
@@ -235,8 +346,8 @@ class PropertyBase(object):
                 return pw
 
         def setter(properties):
-            json_str = json.dumps(properties)
-            self.wf.save_password(self.class_name, json_str)
+            json_str = json.dumps(properties, sort_keys=True)
+            SETTINGS.save_secret(self.class_name, json_str)
 
         return self.get_properties(getter, setter)
 
@@ -283,17 +394,17 @@ class PropertyBase(object):
         Return empty string if no password found.
 
         """
-        try:
-            return self.wf.get_password(account)
-        except PasswordNotFound:
-            if setter:
-                setter()
-                return self.check_password(account)
-            else:
-                return ''
+        password = SETTINGS.secret(account)
+        if password is not None:
+            return password
+        if setter:
+            setter()
+            return self.check_password(account)
+        else:
+            return ''
 
     def check_storage(self, name, setter=False):
-        settings = self.wf.cached_data('output_settings', max_age=0)
+        settings = SETTINGS.cached('output_settings')
         try:
             return settings[name]
         except (KeyError, TypeError):
@@ -2,6 +2,7 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 # Internal Dependencies
+import config
 from . import zq
 
 
@@ -12,6 +13,8 @@ def configure(flag, arg, wf):
     """
     if flag == 'freshen':
         return config_freshen(arg)
+    elif flag == 'fulltext':
+        return config_fulltext(arg)
     elif flag == 'api':
         return zq.web.api_properties_setter()
     elif flag == 'prefs':
@@ -24,15 +27,37 @@ def configure(flag, arg, wf):
 def config_freshen(arg):
     """Update relevant data stores.
 
+    Does nothing if another process is already updating them, unless
+    asked to rebuild them (`arg` is `True`), which waits for it.
+
+    """
+    with zq.backend.refresh_lock(wait=(arg == 'True')) as acquired:
+        if not acquired:
+            config.log.info('Data stores already being updated')
+            return 0
+        if arg == 'True':
+            if not zq.backend.read_live():
+                zq.backend.update_clone()
+            zq.backend.update_json(incremental=False)
+            zq.backend.update_indexes()
+            return 0
+        update, spot = zq.backend.is_fresh()
+        if update:
+            # patch JSON and search indexes with whatever changed
+            changes = zq.backend.update_json()
+            zq.backend.update_indexes(changes)
+    return 0
+
+
+def config_fulltext(arg):
+    """Index the text of the attachments queued by refreshes.
+
+    Does nothing if another process is already indexing them.
+
     """
-    if arg == 'True':
-        zq.backend.update_clone()
-        zq.backend.update_json()
-        return 0
-    update, spot = zq.backend.is_fresh()
-    if update:
-        if spot == 'Clone':
-            zq.backend.update_clone()
-        elif spot == 'JSON':
-            zq.backend.update_json()
+    with zq.backend.fulltext_lock() as acquired:
+        if not acquired:
+            config.log.info('Attachments\' text already being indexed')
+            return 0
+        zq.backend.update_fulltext_index()
     return 0
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright © 2014 stephen.margheim@gmail.com
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+from __future__ import unicode_literals
+
+# Standard Library
+import os
+
+# Internal Dependencies
+import config
+from lib import utils
+
+log = config.log
+
+# PRAGMAs set on every pooled connection: map up to 64 MiB of the
+# database into memory, and cache up to 8 MiB of pages
+READ_PRAGMAS = (('mmap_size', 64 * 1024 * 1024),
+                ('cache_size', -8 * 1024))
+
+
+#------------------------------------------------------------------------------
+# :class:`ConnectionPool` -----------------------------------------------------
+#------------------------------------------------------------------------------
+
+class ConnectionPool(object):
+    """Read-only SQLite connections, kept open for each database file.
+
+    A connection is opened (see :func:`utils.connect_readonly`) the
+    first time its file is read, and reused until the file is replaced
+    (e.g. when an index is rebuilt and renamed over the old one). SQL
+    functions registered on a connection are remembered, so they are
+    only created again when their arguments change.
+
+    Connections live as long as the process: one run of `zotquery.py`,
+    or the resident server.
+
+    """
+    def __init__(self, pragmas=READ_PRAGMAS):
+        """Initialize class instance.
+
+        :param pragmas: ``(name, value)`` PRAGMAs set on new connections
+        :type pragmas: :class:`tuple`
+
+        """
+        self.pragmas = pragmas
+        # path -> (identity of file, connection)
+        self._connections = {}
+        # path -> {function name: arguments it was created with}
+        self._functions = {}
+
+    def connect(self, path):
+        """Get the open connection to the database at ``path``.
+
+        :param path: path to database file
+        :type path: :class:`unicode`
+        :returns: read-only connection
+        :rtype: :class:`sqlite3.Connection`
+
+        """
+        identity = file_identity(path)
+        try:
+            (known, con) = self._connections[path]
+            if known == identity:
+                return con
+            log.debug('Database replaced, reconnecting: {}'.format(path))
+            self.close(path)
+        except KeyError:
+            pass
+        con = utils.connect_readonly(path)
+        for (name, value) in self.pragmas:
+            con.execute('PRAGMA {} = {}'.format(name, value))
+        self._connections[path] = (identity, con)
+        self._functions[path] = {}
+        return con
+
+    def create_function(self, path, name, nargs, factory, *args):
+        """Register ``factory(*args)`` as SQL function ``name`` on the
+        connection to ``path``, unless it already is.
+
+        :param path: path to database file
+        :type path: :class:`unicode`
+        :param name: name of SQL function
+        :type name: :class:`unicode`
+        :param nargs: number of arguments of the SQL function
+        :type nargs: :class:`int`
+        :param factory: makes the Python function
+        :type factory: ``callable``
+
+        """
+        con = self.connect(path)
+        if self._functions[path].get(name) != args:
+            con.create_function(name, nargs, factory(*args))
+            self._functions[path][name] = args
+
+    def close(self, path=None):
+        """Close the connection to ``path``, or all connections.
+
+        :param path: path to database file
+        :type path: :class:`unicode`
+
+        """
+        paths = [path] if path else list(self._connections)
+        for path in paths:
+            (_, con) = self._connections.pop(path, (None, None))
+            self._functions.pop(path, None)
+            if con is not None:
+                con.close()
+
+
+def file_identity(path):
+    """Return ``(device, inode)`` of the file at ``path``, which only
+    change if the file is replaced.
+
+    """
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino)
+
+
+# the pool shared by all of ZotQuery
+pool = ConnectionPool()
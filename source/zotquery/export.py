@@ -76,7 +76,7 @@ def export_group(uid):
         marker = item_id
         ref_method = zq.web.collection_references
     elif group_type == 't':
-        marker = search._get_tag_name(item_id)
+        marker = search.get_tag_name(item_id)
         ref_method = zq.web.tag_references
     cites = ref_method(marker,
                        style=zq.backend.csl_style)
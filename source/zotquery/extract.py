@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright © 2014 stephen.margheim@gmail.com
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+from __future__ import unicode_literals
+
+# Standard Library
+import os
+import re
+import glob
+import zipfile
+import threading
+import subprocess
+import multiprocessing
+from itertools import islice
+from distutils.spawn import find_executable
+
+# Internal Dependencies
+import config
+
+log = config.log
+
+# Zotero's own copy of `pdftotext`, in its data directory
+ZOTERO_PDFTOTEXT = 'pdftotext-*'
+
+# Most bytes of text read for an attachment: enough for
+# `config.FULLTEXT_MAX_CHARS` characters of UTF-8
+MAX_BYTES = 4 * config.FULLTEXT_MAX_CHARS
+
+
+#------------------------------------------------------------------------------
+# Extracting the text of one attachment
+#------------------------------------------------------------------------------
+
+def extract(task):
+    """Get the text of one attachment.
+
+    Zotero's cache of the attachment's text is read if there is one.
+    Otherwise the text is extracted from the file itself, if it is of a
+    kind listed in :data:`EXTRACTORS`. Runs in the worker processes of
+    :func:`extract_all`, so it must not touch any shared state.
+
+    :param task: ``(id, cache path, file path, path of pdftotext)``
+    :type task: :class:`tuple`
+    :returns: ``(id, text)``, with ``None`` as text if there is none
+    :rtype: :class:`tuple`
+
+    """
+    (att_id, cache_path, file_path, pdftotext) = task
+    text = None
+    try:
+        text = read_text(cache_path)
+        if text is None and file_path:
+            ext = os.path.splitext(file_path)[1].lower().lstrip('.')
+            extractor = EXTRACTORS.get(ext)
+            if extractor and os.path.isfile(file_path):
+                text = extractor(file_path, pdftotext)
+    except Exception as err:
+        log.debug('Could not extract text of {}: {}'.format(file_path, err))
+    if text is not None:
+        text = text[:config.FULLTEXT_MAX_CHARS]
+    return (att_id, text)
+
+
+def read_text(path):
+    """Read the UTF-8 text file at ``path``, or ``None`` if there is none.
+
+    """
+    if not path:
+        return None
+    try:
+        with open(path, 'rb') as file_obj:
+            return file_obj.read(MAX_BYTES).decode('utf-8', 'replace')
+    except IOError:
+        return None
+
+
+def run_text(cmd):
+    """Run ``cmd`` and get (at most :data:`MAX_BYTES` of) its output.
+
+    ``cmd`` is killed if it runs for longer than
+    ``config.FULLTEXT_TIMEOUT`` seconds, or once enough of its output
+    has been read.
+
+    :param cmd: command and its arguments
+    :type cmd: :class:`list`
+    :returns: the command's output
+    :rtype: :class:`unicode`
+    :raises: :class:`RuntimeError` if ``cmd`` failed or was killed
+
+    """
+    with open(os.devnull, 'wb') as devnull:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=devnull)
+    timed_out = []
+
+    def kill():
+        timed_out.append(True)
+        proc.kill()
+
+    timer = threading.Timer(config.FULLTEXT_TIMEOUT, kill)
+    timer.start()
+    try:
+        output = proc.stdout.read(MAX_BYTES)
+    finally:
+        timer.cancel()
+    complete = len(output) < MAX_BYTES
+    if not complete:
+        # the rest would not be indexed anyway
+        proc.kill()
+    proc.stdout.close()
+    status = proc.wait()
+    if timed_out:
+        raise RuntimeError('{} timed out'.format(cmd[0]))
+    if complete and status != 0:
+        raise RuntimeError('{} exited with status {}'.format(cmd[0], status))
+    return output.decode('utf-8', 'replace')
+
+
+def pdf_text(path, pdftotext):
+    """Extract the text of a PDF with `pdftotext`."""
+    if not pdftotext:
+        return None
+    return run_text([pdftotext, '-enc', 'UTF-8', '-nopgbrk', path, '-'])
+
+
+def docx_text(path, pdftotext=None):
+    """Extract the text of (at most :data:`MAX_BYTES` of) a Word
+    document's main XML part."""
+    with zipfile.ZipFile(path) as archive:
+        return xml_text(read_member(archive, 'word/document.xml', MAX_BYTES))
+
+
+def epub_text(path, pdftotext=None):
+    """Extract the text of each (X)HTML document in an EPUB, until
+    :data:`MAX_BYTES` of them have been read."""
+    (parts, left) = ([], MAX_BYTES)
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            if left <= 0:
+                break
+            if name.lower().endswith(('.html', '.xhtml', '.htm')):
+                data = read_member(archive, name, left)
+                left -= len(data)
+                parts.append(xml_text(data))
+    return ' '.join(parts)
+
+
+def doc_text(path, pdftotext=None):
+    """Extract the text of a legacy Word document with `textutil`."""
+    textutil = find_executable('textutil')
+    if not textutil:
+        return None
+    return run_text([textutil, '-convert', 'txt', '-stdout', path])
+
+
+def read_member(archive, name, size):
+    """Read at most ``size`` bytes of file ``name`` in zip ``archive``."""
+    member = archive.open(name)
+    try:
+        return member.read(size)
+    finally:
+        member.close()
+
+
+def xml_text(data):
+    """Strip the tags from (X)HTML or XML ``data``."""
+    text = re.sub(br'<[^>]*>', b' ', data).decode('utf-8', 'replace')
+    return ' '.join(text.split())
+
+
+# Extension of each kind of file text can be extracted from
+# (cf. `config.ATTACH_EXTS`)
+EXTRACTORS = {
+    'pdf': pdf_text,
+    'docx': docx_text,
+    'epub': epub_text,
+    'doc': doc_text
+}
+
+
+def find_pdftotext(data_dir=None):
+    """Find a `pdftotext`: Zotero's own, or one on the ``PATH``.
+
+    :param data_dir: Zotero's data directory
+    :type data_dir: :class:`unicode`
+    :returns: full path to executable, or ``None``
+    :rtype: :class:`unicode`
+
+    """
+    if data_dir:
+        for path in sorted(glob.glob(os.path.join(data_dir,
+                                                  ZOTERO_PDFTOTEXT))):
+            if os.access(path, os.X_OK):
+                return path
+    return find_executable('pdftotext')
+
+
+#------------------------------------------------------------------------------
+# Extracting the text of many attachments
+#------------------------------------------------------------------------------
+
+def extract_all(tasks, processes=None, batch_size=None):
+    """Get the text of each attachment in ``tasks``, in parallel.
+
+    The attachments are spread over a pool of ``processes`` worker
+    processes (by default, one per CPU core), ``batch_size`` at a time
+    (by default, ``config.FULLTEXT_BATCH_SIZE``), so no more than one
+    batch of texts is ever held in memory. Results are yielded as soon
+    as they are ready, in no particular order, so the caller can store
+    them as it goes. A few attachments are read in this process.
+
+    :param tasks: tasks for :func:`extract`
+    :type tasks: :class:`list`
+    :param processes: number of worker processes
+    :type processes: :class:`int`
+    :param batch_size: number of tasks handed to the pool at a time
+    :type batch_size: :class:`int`
+    :returns: ``(id, text)`` of each attachment
+    :rtype: :class:`generator`
+
+    """
+    processes = processes or multiprocessing.cpu_count()
+    batch_size = batch_size or config.FULLTEXT_BATCH_SIZE
+    if processes < 2 or len(tasks) < 2 * processes:
+        for task in tasks:
+            yield extract(task)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        tasks = iter(tasks)
+        for batch in iter(lambda: list(islice(tasks, batch_size)), []):
+            for result in pool.imap_unordered(extract, batch, chunksize=4):
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -11,13 +11,23 @@ from __future__ import unicode_literals
 
 # Standard Library
 import subprocess
+import contextlib
 import traceback
+import tempfile
+import sqlite3
+import shutil
 import codecs
+import fcntl
 import json
 import sys
 import os
 import re
 
+try:
+    from urllib import pathname2url
+except ImportError:  # Python 3
+    from urllib.request import pathname2url
+
 
 def full_stack():
     exc = sys.exc_info()[0]
@@ -63,6 +73,96 @@ def write_json(data, path):
     return True
 
 
+# Result of `can_open_readonly`, once probed
+_OPENS_READONLY = None
+
+
+def connect_uri(uri, timeout=5.0):
+    """Open sqlite URI `uri`.
+
+    Python 2's `sqlite3` has no `uri` argument, but hands the filename
+    to SQLite, which reads it as a URI if built with `SQLITE_USE_URI`
+    (see `can_open_readonly`).
+    """
+    try:
+        return sqlite3.connect(uri, timeout=timeout, uri=True)
+    except TypeError:
+        return sqlite3.connect(uri, timeout=timeout)
+
+
+def can_open_readonly():
+    """Can this Python's `sqlite3` open databases read-only?
+
+    Those that open URIs can. Python 3.4+ always does; for Python 2 it
+    depends on how SQLite was built, so a scratch database is opened
+    as a `mode=ro` URI and written to, which must fail.
+    """
+    global _OPENS_READONLY
+    if _OPENS_READONLY is not None:
+        return _OPENS_READONLY
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'probe.sqlite')
+        con = sqlite3.connect(path)
+        con.execute('CREATE TABLE probe (id INTEGER)')
+        con.close()
+        try:
+            con = connect_uri('file:{}?mode=ro'.format(
+                pathname2url(path.encode('utf-8'))))
+            try:
+                con.execute('INSERT INTO probe VALUES (1)')
+                _OPENS_READONLY = False
+            finally:
+                con.close()
+        except sqlite3.OperationalError as err:
+            # not a URI to this SQLite: no such file
+            _OPENS_READONLY = 'readonly' in str(err)
+    finally:
+        shutil.rmtree(tempdir)
+    return _OPENS_READONLY
+
+
+def connect_readonly(path, immutable=False, timeout=5.0):
+    """Open sqlite database at `path` without write access.
+
+    Opens a `mode=ro` URI, adding `immutable=1` if `immutable` (only safe
+    for files nothing else writes to). Where `sqlite3` can't open URIs
+    (see `can_open_readonly`), this is a plain, read-write connection
+    with `PRAGMA query_only` instead, which only keeps this connection's
+    own queries from writing: SQLite itself may still write to the
+    database, e.g. to roll back a hot journal.
+    """
+    if not can_open_readonly():
+        con = sqlite3.connect(path, timeout=timeout)
+        con.execute('PRAGMA query_only = ON')
+        return con
+    uri = 'file:{}?mode=ro'.format(pathname2url(path.encode('utf-8')))
+    if immutable:
+        uri += '&immutable=1'
+    return connect_uri(uri, timeout=timeout)
+
+
+@contextlib.contextmanager
+def try_lock(path, wait=False):
+    """Hold an exclusive lock on the file at `path`, unless another
+    process holds it (or until it releases it, if `wait`). Yields
+    whether the lock was acquired.
+
+    The lock is released when the block exits or the process dies.
+    """
+    flags = fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB
+    with open(path, 'a') as file_obj:
+        try:
+            fcntl.flock(file_obj, flags)
+        except IOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(file_obj, fcntl.LOCK_UN)
+
+
 def read_path(path, encoding='utf-8'):
     """Read data from `path`"""
     if os.path.exists(path):
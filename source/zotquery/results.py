@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# encoding: utf-8
+from __future__ import unicode_literals
+# Internal Dependencies
+import config
+from backend import ZotqueryBackend
+
+
+#------------------------------------------------------------------------------
+#  Class to convert ZotQuery dictionaries into Alfred dictionaries
+#------------------------------------------------------------------------------
+
+class ResultsFormatter(object):
+    """Convert ZotQuery Python ``dict`` into Alfred results ``dict``.
+
+    For example, this class will convert the following ZotQuery dictionary:
+        ```
+        "MNMJCJ4T": {
+          "key": "MNMJCJ4T",
+          "library": "0",
+          "type": "book",
+          "creators": [
+            {
+              "index": 1,
+              "given": "Kirk R.",
+              "type": "editor",
+              "family": "Sanders"
+            },
+            {
+              "index": 0,
+              "given": "Jeffrey",
+              "type": "editor",
+              "family": "Fish"
+            }
+          ],
+          "data": {
+            "publisher": "Cambridge University Press",
+            "ISBN": "0521194784",
+            "date": "2011",
+            "extra": "Cited by 0001",
+            "libraryCatalog": "Amazon.com",
+            "title": "Epicurus and the Epicurean Tradition",
+            "numPages": 280
+          },
+          "zot-collections": [
+            {
+              "library_id": "0",
+              "group": "personal",
+              "name": "Epicurus on Friendship",
+              "key": "GXWGBRJD"
+            },
+            {
+              "library_id": "0",
+              "group": "personal",
+              "name": "Sources",
+              "key": "WU57N494"
+            }
+          ],
+          "zot-tags": [],
+          "attachments": [
+            {
+              "path": "/Users/smargh/Downloads/fish_sanders_2011_epicurus and the epicurean tradition_book.pdf",
+              "name": "fish_sanders_2011_epicurus and the epicurean tradition_book.pdf",
+              "key": "T2E9X482"
+            }
+          ],
+          "notes": []
+        }
+        ```
+
+    This item would be converted into the following Alfred-ready dictionary:
+        ```
+        {
+            "largetext": "",
+            "subtitle": "Fish (ed.) and Sanders (ed.). 2011. Attachments: 1",
+            "title": "Epicurus and the Epicurean Tradition.",
+            "valid": true,
+            "arg": "0_MNMJCJ4T",
+            "copytext": "{@Sanders, & Fish_2011_J4T}",
+            "icon": "icons/att_book.png"
+        }
+        ```
+
+    """
+    def __init__(self, item):
+        """``item`` is a Python dictionary for an item in the JSON db
+        `zotquery.json`.
+
+        """
+        self.item = item
+
+    def prepare_item_feedback(self):
+        """Format the subtitle string for ``item``
+
+        """
+        alfred = {}
+        alfred['title'] = self.format_title()
+        alfred['subtitle'] = self.format_subtitle()
+        alfred['valid'] = True
+        alfred['arg'] = self.format_arg()
+        alfred['icon'] = self.format_icon()
+        alfred['largetext'] = self.format_largetext()
+        alfred['copytext'] = self.format_quickcopy()
+        if config.ALFRED_LEARN:
+            alfred['uid'] = str(self.item['id'])
+        return alfred
+
+    def prepare_group_feedback(self):
+        """Prepare Alfred data for groups.
+
+        """
+        #{'flag': scope, 'name': coll[0], 'key': coll[1]}
+        alfred = {}
+        alfred['title'] = self.item['name']
+        alfred['subtitle'] = self.item['flag'][:-1].capitalize()
+        alfred['valid'] = True
+        alfred['arg'] = '_'.join([self.item['flag'][0], self.item['key']])
+        alfred['icon'] = "icons/n_{}.png".format(self.item['flag'][:-1])
+        if config.ALFRED_LEARN:
+            alfred['uid'] = str(self.item['key'])
+        return alfred
+
+    ##  -----------------------------------------------------------------------
+
+    def format_title(self):
+        """Properly format the title information for ``item``.
+
+        """
+        try:
+            if not self.item['data']['title'][-1] in ('.', '?', '!'):
+                title_final = self.item['data']['title'] + '.'
+            else:
+                title_final = self.item['data']['title']
+        except KeyError:
+            title_final = 'xxx.'
+        return title_final
+
+    def format_subtitle(self):
+        subtitle = ' '.join([self.format_creator(),
+                             self.format_date()])
+        if self.item['attachments'] != []:
+            subtitle = ' '.join([subtitle, 'Attachments:',
+                                str(len(self.item['attachments']))])
+        return subtitle
+
+    def format_arg(self):
+        return '_'.join([str(self.item['library']),
+                         str(self.item['key'])])
+
+    def format_icon(self):
+        """Properly format the icon for ``item``.
+
+        """
+        icn_type = 'n'
+        if self.item['attachments'] != []:
+            icn_type = 'att'
+
+        icon = 'icons/{}_written.png'.format(icn_type)
+        if self.item['type'] == 'journalArticle':
+            icon = 'icons/{}_article.png'.format(icn_type)
+        elif self.item['type'] == 'book':
+            icon = 'icons/{}_book.png'.format(icn_type)
+        elif self.item['type'] == 'bookSection':
+            icon = 'icons/{}_chapter.png'.format(icn_type)
+        elif self.item['type'] == 'conferencePaper':
+            icon = 'icons/{}_conference.png'.format(icn_type)
+        return icon
+
+    def format_largetext(self):
+        """Generate `str` to be displayed by Alfred's large text.
+
+        """
+        if isinstance(config.LARGE_TEXT, unicode):
+            # get search map from column
+            json_map = config.FILTERS_MAP.get(config.LARGE_TEXT, None)
+            if json_map:
+                # get data from `item` using search map
+                largetext = ZotqueryBackend.get_datum(self.item, json_map)
+        elif hasattr(config.LARGE_TEXT, '__call__'):
+            largetext = config.LARGE_TEXT(self.item)
+        else:
+            largetext = ''
+        return largetext
+
+    def format_quickcopy(self):
+        """Generate `str` to be copied to clipboard by `cmd+c`.
+
+        """
+        if isinstance(config.QUICK_COPY, unicode):
+            # get search map from column
+            json_map = config.FILTERS_MAP.get(config.QUICK_COPY, None)
+            if json_map:
+                # get data from `item` using search map
+                quickcopy = ZotqueryBackend.get_datum(self.item, json_map)
+        elif hasattr(config.QUICK_COPY, '__call__'):
+            quickcopy = config.QUICK_COPY(self.item)
+        else:
+            quickcopy = ''
+        return quickcopy
+
+    ###  ----------------------------------------------------------------------
+
+    def format_creator(self):
+        """Properly format the creator information for ``item``.
+
+        """
+        creators_num = len(self.item['creators'])
+        creator_list = []
+        # Order last names by index
+        for author in self.item['creators']:
+            last = author['family']
+            index = author['index']
+            if author['type'] == 'editor':
+                last = last + ' (ed.)'
+            elif author['type'] == 'translator':
+                last = last + ' (trans.)'
+            creator_list.insert(index, last)
+        # Format last names into string
+        if creators_num == 0:
+            creator_ref = 'xxx.'
+        elif creators_num == 1:
+            creator_ref = ''.join(creator_list)
+        elif creators_num == 2:
+            creator_ref = ' and '.join(creator_list)
+        elif creators_num > 2:
+            creator_ref = ', '.join(creator_list[:-1])
+            creator_ref = creator_ref + ', and ' + creator_list[-1]
+        # Format final period (`.`)
+        if not creator_ref[-1] in ('.', '!', '?'):
+            creator_ref = creator_ref + '.'
+        return creator_ref
+
+    def format_date(self):
+        """Properly format the date information for ``item``.
+
+        """
+        try:
+            return str(self.item['data']['date']) + '.'
+        except KeyError:
+            return 'xxx.'
@@ -41,8 +41,7 @@ def reference_scan(md_text):
     Adapted from <https://github.com/smathot/academicmarkdown>
 
     """
-    data = utils.read_json(zq.backend.json_data)
-    keys = data.keys()
+    keys = zq.backend.get_item_keys()
     ref_count = 1
     zot_items = []
     found_cks = []
@@ -56,6 +55,7 @@ def reference_scan(md_text):
         ref_count += 1
         possible_keys = [key for key in keys if key.endswith(key_end)]
         if len(possible_keys) > 1:
+            data = zq.backend.get_items(possible_keys)
             for key in possible_keys:
                 item = data.get(key)
                 try:
@@ -2,246 +2,25 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 # Standard Library
+import re
+import json
+import heapq
 import sqlite3
 # Internal Dependencies
-from workflow.workflow import isascii
 from lib import utils
 from . import zq
 import config
+from cache import (ResultCache, normalize, tokenize, trigrams,
+                   edit_distance)
+from connections import pool
+from results import ResultsFormatter
 
+# No collection is nested deeper than this below the one searched
+MAX_DEPTH = 1 << 30
 
-#------------------------------------------------------------------------------
-#  Class to convert ZotQuery dictionaries into Alfred dictionaries
-#------------------------------------------------------------------------------
 
-class ResultsFormatter(object):
-    """Convert ZotQuery Python ``dict`` into Alfred results ``dict``.
-
-    For example, this class will convert the following ZotQuery dictionary:
-        ```
-        "MNMJCJ4T": {
-          "key": "MNMJCJ4T",
-          "library": "0",
-          "type": "book",
-          "creators": [
-            {
-              "index": 1,
-              "given": "Kirk R.",
-              "type": "editor",
-              "family": "Sanders"
-            },
-            {
-              "index": 0,
-              "given": "Jeffrey",
-              "type": "editor",
-              "family": "Fish"
-            }
-          ],
-          "data": {
-            "publisher": "Cambridge University Press",
-            "ISBN": "0521194784",
-            "date": "2011",
-            "extra": "Cited by 0001",
-            "libraryCatalog": "Amazon.com",
-            "title": "Epicurus and the Epicurean Tradition",
-            "numPages": 280
-          },
-          "zot-collections": [
-            {
-              "library_id": "0",
-              "group": "personal",
-              "name": "Epicurus on Friendship",
-              "key": "GXWGBRJD"
-            },
-            {
-              "library_id": "0",
-              "group": "personal",
-              "name": "Sources",
-              "key": "WU57N494"
-            }
-          ],
-          "zot-tags": [],
-          "attachments": [
-            {
-              "path": "/Users/smargh/Downloads/fish_sanders_2011_epicurus and the epicurean tradition_book.pdf",
-              "name": "fish_sanders_2011_epicurus and the epicurean tradition_book.pdf",
-              "key": "T2E9X482"
-            }
-          ],
-          "notes": []
-        }
-        ```
-
-    This item would be converted into the following Alfred-ready dictionary:
-        ```
-        {
-            "largetext": "",
-            "subtitle": "Fish (ed.) and Sanders (ed.). 2011. Attachments: 1",
-            "title": "Epicurus and the Epicurean Tradition.",
-            "valid": true,
-            "arg": "0_MNMJCJ4T",
-            "copytext": "{@Sanders, & Fish_2011_J4T}",
-            "icon": "icons/att_book.png"
-        }
-        ```
-
-    """
-    def __init__(self, item):
-        """``item`` is a Python dictionary for an item in the JSON db
-        `zotquery.json`.
-
-        """
-        self.item = item
-
-    def prepare_item_feedback(self):
-        """Format the subtitle string for ``item``
-
-        """
-        alfred = {}
-        alfred['title'] = self.format_title()
-        alfred['subtitle'] = self.format_subtitle()
-        alfred['valid'] = True
-        alfred['arg'] = self.format_arg()
-        alfred['icon'] = self.format_icon()
-        alfred['largetext'] = self.format_largetext()
-        alfred['copytext'] = self.format_quickcopy()
-        if config.ALFRED_LEARN:
-            alfred['uid'] = str(self.item['id'])
-        return alfred
-
-    def prepare_group_feedback(self):
-        """Prepare Alfred data for groups.
-
-        """
-        #{'flag': scope, 'name': coll[0], 'key': coll[1]}
-        alfred = {}
-        alfred['title'] = self.item['name']
-        alfred['subtitle'] = self.item['flag'][:-1].capitalize()
-        alfred['valid'] = True
-        alfred['arg'] = '_'.join([self.item['flag'][0], self.item['key']])
-        alfred['icon'] = "icons/n_{}.png".format(self.item['flag'][:-1])
-        if config.ALFRED_LEARN:
-            alfred['uid'] = str(self.item['key'])
-        return alfred
-
-    ##  -----------------------------------------------------------------------
-
-    def format_title(self):
-        """Properly format the title information for ``item``.
-
-        """
-        try:
-            if not self.item['data']['title'][-1] in ('.', '?', '!'):
-                title_final = self.item['data']['title'] + '.'
-            else:
-                title_final = self.item['data']['title']
-        except KeyError:
-            title_final = 'xxx.'
-        return title_final
-
-    def format_subtitle(self):
-        subtitle = ' '.join([self.format_creator(),
-                             self.format_date()])
-        if self.item['attachments'] != []:
-            subtitle = ' '.join([subtitle, 'Attachments:',
-                                str(len(self.item['attachments']))])
-        return subtitle
-
-    def format_arg(self):
-        return '_'.join([str(self.item['library']),
-                         str(self.item['key'])])
-
-    def format_icon(self):
-        """Properly format the icon for ``item``.
-
-        """
-        icn_type = 'n'
-        if self.item['attachments'] != []:
-            icn_type = 'att'
-
-        icon = 'icons/{}_written.png'.format(icn_type)
-        if self.item['type'] == 'journalArticle':
-            icon = 'icons/{}_article.png'.format(icn_type)
-        elif self.item['type'] == 'book':
-            icon = 'icons/{}_book.png'.format(icn_type)
-        elif self.item['type'] == 'bookSection':
-            icon = 'icons/{}_chapter.png'.format(icn_type)
-        elif self.item['type'] == 'conferencePaper':
-            icon = 'icons/{}_conference.png'.format(icn_type)
-        return icon
-
-    def format_largetext(self):
-        """Generate `str` to be displayed by Alfred's large text.
-
-        """
-        if isinstance(config.LARGE_TEXT, unicode):
-            # get search map from column
-            json_map = config.FILTERS_MAP.get(config.LARGE_TEXT, None)
-            if json_map:
-                # get data from `item` using search map
-                largetext = zq.backend.get_datum(self.item, json_map)
-        elif hasattr(config.LARGE_TEXT, '__call__'):
-            largetext = config.LARGE_TEXT(self.item)
-        else:
-            largetext = ''
-        return largetext
-
-    def format_quickcopy(self):
-        """Generate `str` to be copied to clipboard by `cmd+c`.
-
-        """
-        if isinstance(config.QUICK_COPY, unicode):
-            # get search map from column
-            json_map = config.FILTERS_MAP.get(config.QUICK_COPY, None)
-            if json_map:
-                # get data from `item` using search map
-                quickcopy = zq.backend.get_datum(self.item, json_map)
-        elif hasattr(config.QUICK_COPY, '__call__'):
-            quickcopy = config.QUICK_COPY(self.item)
-        else:
-            quickcopy = ''
-        return quickcopy
-
-    ###  ----------------------------------------------------------------------
-
-    def format_creator(self):
-        """Properly format the creator information for ``item``.
-
-        """
-        creators_num = len(self.item['creators'])
-        creator_list = []
-        # Order last names by index
-        for author in self.item['creators']:
-            last = author['family']
-            index = author['index']
-            if author['type'] == 'editor':
-                last = last + ' (ed.)'
-            elif author['type'] == 'translator':
-                last = last + ' (trans.)'
-            creator_list.insert(index, last)
-        # Format last names into string
-        if creators_num == 0:
-            creator_ref = 'xxx.'
-        elif creators_num == 1:
-            creator_ref = ''.join(creator_list)
-        elif creators_num == 2:
-            creator_ref = ' and '.join(creator_list)
-        elif creators_num > 2:
-            creator_ref = ', '.join(creator_list[:-1])
-            creator_ref = creator_ref + ', and ' + creator_list[-1]
-        # Format final period (`.`)
-        if not creator_ref[-1] in ('.', '!', '?'):
-            creator_ref = creator_ref + '.'
-        return creator_ref
-
-    def format_date(self):
-        """Properly format the date information for ``item``.
-
-        """
-        try:
-            return str(self.item['data']['date']) + '.'
-        except KeyError:
-            return 'xxx.'
+class InvalidQuery(Exception):
+    """The index can't parse a search query (see :func:`execute_sql`)."""
 
 
 #------------------------------------------------------------------------------
@@ -249,42 +28,106 @@ class ResultsFormatter(object):
 #------------------------------------------------------------------------------
 
 # 1.  -------------------------------------------------------------------------
-def search_for_items(scope, query):
+def search_for_items(scope, query, offset=0):
+    """Find a page of the items matching ``query`` in ``scope``.
+
+    Items are ranked by the index, and followed by those that only
+    match inside, or nearly match, their names (see
+    :func:`get_name_hits`). Only the ``config.RESULTS_LIMIT`` results
+    from ``offset`` on are read and formatted.
+
+    :returns: Alfred dictionaries, and whether more results follow
+    :rtype: :class:`tuple`
+
+    """
+    limit = config.RESULTS_LIMIT
+    # Choose database and its FTS module
+    db = zq.backend.fts_sqlite
+    module = zq.backend.index_module(db)
+    zq.backend.update_feedback(db)
+    # Reuse (or narrow down) results of this or an earlier query
+    generation = '{}-{}'.format(
+        zq.backend.index_meta(db).get('generation'),
+        zq.backend.index_meta(zq.backend.fulltext_sqlite).get('generation'))
+    cache = ResultCache(config.WF.cachefile('results.db'), generation)
+    # results' text is only their metadata, too little to narrow down
+    # full text results with
+    narrow = module == 'fts5' and scope != 'fulltext'
     # Generate appropriate sqlite query
-    sqlite_query = make_item_sqlite_query(scope, query)
-    config.log.info('Item sqlite query : {}'.format(sqlite_query))
-    # Run sqlite query and get back item keys
-    item_keys = run_item_sqlite_query(sqlite_query)
-    # Get JSON data of user's Zotero library
-    data = utils.read_json(zq.backend.json_data)
-    results_dict = []
-    for key in item_keys:
-        item = data.get(key, None)
-        if item:
-            # Prepare dictionary for Alfred
-            formatter = ResultsFormatter(item)
-            alfred_dict = formatter.prepare_item_feedback()
-            results_dict.append(alfred_dict)
-    return results_dict
+    sqlite_query = make_item_sqlite_query(scope, query, module)
+    # Number of items the index matched, if known
+    matched = None
+    try:
+        cached = cache.get(scope, query, narrow=narrow)
+        # A complete entry holds all of the index's results, in the order
+        # its first page was shown in (which, if they were narrowed down
+        # from an earlier query's, is not the index's order), so every
+        # page is served from it. Otherwise only the first page is cached.
+        if cached is not None and (cached[1] or not offset):
+            (results, complete) = cached
+            if complete:
+                matched = len(results)
+            more = not complete or len(results) > offset + limit
+            results = results[offset:offset + limit]
+        else:
+            config.log.info('Item sqlite query : {}'.format(sqlite_query))
+            # Run sqlite query and get back Alfred dictionaries, ready-made;
+            # one more than a page tells whether there are more
+            if scope == 'fulltext':
+                results = run_fulltext_sqlite_query(db, module, sqlite_query,
+                                                    query, offset, limit + 1)
+            else:
+                results = run_item_sqlite_query(db, module, scope,
+                                                sqlite_query, offset=offset,
+                                                limit=limit + 1)
+            more = len(results) > limit
+            results = results[:limit]
+            if not offset:
+                cache.put(scope, query, results, complete=not more)
+    finally:
+        cache.close()
+    found = [alfred_dict for (alfred_dict, text) in results]
+    if not more:
+        # Items that only match inside, or nearly match, their names
+        # follow the last of the index's results
+        if matched is None and (results or not offset):
+            matched = offset + len(results)
+        elif matched is None:
+            matched = count_item_matches(db, module, scope, sqlite_query,
+                                         query)
+        hits = get_name_hits(db, scope, query, sqlite_query)
+        start = max(0, offset - matched)
+        page = hits[start:start + limit - len(found)]
+        feedback = get_feedback(db, page)
+        found.extend(feedback[item_id][1] for item_id in page
+                     if feedback[item_id][1] is not None)
+        more = len(hits) > start + len(page)
+    return ([json.loads(alfred_dict) for alfred_dict in found], more)
 
 
 ## 1.1  -----------------------------------------------------------------------
-def make_item_sqlite_query(scope, query):
-    fuzzy_query = make_item_fuzzy(query)
+def make_item_sqlite_query(scope, query, module):
+    fuzzy_query = make_item_fuzzy(query, module)
     columns = get_item_columns(scope)
-    query = make_disjunctive_item_query(fuzzy_query, columns)
-    return get_item_sql().format(query)
+    return make_disjunctive_item_query(fuzzy_query, columns, module)
 
 
 ### 1.1.1  --------------------------------------------------------------------
-def make_item_fuzzy(query):
+def make_item_fuzzy(query, module):
+    if module == 'fts5':
+        # Quote each term, so punctuation can't break FTS5's query syntax
+        terms = ['"{}"'.format(term.replace('"', '""'))
+                 for term in query.split()]
+        if not terms:
+            return '""*'
+        return ' '.join(terms) + '*'
     return ''.join([query, '*'])
 
 
 ### 1.1.2  --------------------------------------------------------------------
 def get_item_columns(scope):
     if scope in config.FILTERS.keys():
-        columns = config.FILTERS.get(scope)
+        columns = list(config.FILTERS.get(scope))
         columns.remove('key')
         return columns
     else:
@@ -293,7 +136,10 @@ def get_item_columns(scope):
 
 
 ### 1.1.3  --------------------------------------------------------------------
-def make_disjunctive_item_query(query, columns):
+def make_disjunctive_item_query(query, columns, module):
+    if module == 'fts5':
+        # Restrict the whole query to the scope's columns
+        return '{{{}}} : ({})'.format(' '.join(columns), query)
     # Format `column:query`
     bits = ['{}:{}'.format(col, query)
             for col in columns]
@@ -301,48 +147,306 @@ def make_disjunctive_item_query(query, columns):
     return ' OR '.join(bits)
 
 
-### 1.1.4; 3.2.2.1  -----------------------------------------------------------
-def get_item_sql():
-    sections = ("SELECT key, rank(matchinfo(zotquery)) AS score",
-                "FROM zotquery",
-                "WHERE zotquery MATCH '{}'",
-                "ORDER BY score DESC;")
-    sql_str = ' '.join(sections)
-    return sql_str.strip()
+### 1.1.4  --------------------------------------------------------------------
+def get_item_sql(module, weights, columns, in_group=False, ranking=False):
+    # Text of the searched columns, to narrow cached results with
+    text = " || ' ' || ".join('zotquery.{}'.format(col) for col in columns)
+    # Only each item's key and score (in full), or a page of results
+    if ranking:
+        (select, page) = ("SELECT feedback.key,", "")
+    else:
+        (select, page) = ("SELECT feedback.data, {}, feedback.key,".format(
+            text), "LIMIT ? OFFSET ?")
+    # Only keep members of the group (or its subgroups, up to a depth)
+    group = ("AND zotquery.rowid IN (SELECT item_id FROM group_members "
+             "WHERE group_id IN (SELECT descendant FROM group_tree "
+             "WHERE ancestor = (SELECT id FROM group_index "
+             "WHERE kind = ? AND key = ?) AND depth <= ?))"
+             if in_group else "")
+    if module == 'fts5':
+        # `bm25()` scores are negative: the lower, the better the match
+        weights = ', '.join(str(weight) for weight in weights)
+        sections = (select,
+                    "bm25(zotquery, {}) AS score".format(weights),
+                    "FROM zotquery",
+                    "JOIN feedback ON feedback.id = zotquery.rowid",
+                    "WHERE zotquery MATCH ?",
+                    group,
+                    "ORDER BY score, zotquery.rowid",
+                    page)
+    else:
+        sections = (select,
+                    "rank(matchinfo(zotquery)) AS score",
+                    "FROM zotquery",
+                    "JOIN feedback ON feedback.id = zotquery.rowid",
+                    "WHERE zotquery MATCH ?",
+                    group,
+                    "ORDER BY score DESC, zotquery.rowid",
+                    page)
+    sql_str = ' '.join(section for section in sections if section)
+    return sql_str.strip() + ';'
+
+
+### 1.1.5  --------------------------------------------------------------------
+def get_column_weights(scope):
+    """Weight of each index column for ``scope``, in column order."""
+    columns = config.FILTERS.get(scope, config.FILTERS['general'])
+    return [config.COLUMN_WEIGHTS.get(col, 1.0) if col in columns else 0.0
+            for col in config.FILTERS['general']]
 
 
 ## 1.2  -----------------------------------------------------------------------
-def run_item_sqlite_query(query):
-    db = get_fts_db(query)
+def run_item_sqlite_query(db, module, scope, query, group=None, offset=0,
+                          limit=-1):
     config.log.info('Connecting to : `{}`'.format(db.split('/')[-1]))
-
-    def ranker(con):
-        ranks = [1.0] * len(config.FILTERS['general'])
-        con.create_function('rank',
-                            1,
-                            zq.backend.make_rank_func(ranks))
-
-    results = execute_sql(db, query, context=ranker).fetchall()
+    weights = get_column_weights(scope)
+    sql = get_item_sql(module, weights, get_item_columns(scope),
+                       in_group=bool(group))
+    # SQLite reads a negative `LIMIT` as no limit
+    params = (query,) + tuple(group or ()) + (limit, offset)
+    # FTS5 ranks inside SQLite; only FTS3/FTS4 need the Python ranker
+    if module != 'fts5':
+        pool.create_function(db, 'rank', 1, zq.backend.make_rank_func,
+                             tuple(weights))
+    results = execute_sql(db, sql, params).fetchall()
     config.log.info('Number of results : {}'.format(len(results)))
-    # Omit rankings from the returned list
-    return [x[0] for x in results]
+    # Omit keys and rankings from the returned list, formatting the
+    # results that couldn't be when they were indexed
+    results = [(x[0] if x[0] is not None
+                else zq.backend.format_feedback(x[2]), x[1])
+               for x in results]
+    return [result for result in results if result[0] is not None]
 
 
 ### 1.2.1  --------------------------------------------------------------------
-def get_fts_db(query):
-    # Search against either Unicode or ASCII database
-    db = zq.backend.folded_sqlite
-    if not isascii(query):
-        db = zq.backend.fts_sqlite
-    return db
+def run_fulltext_sqlite_query(db, module, sqlite_query, query, offset=0,
+                              limit=-1):
+    """Rank items on their metadata and their attachments' text together,
+    and format those ranked from ``offset`` to ``offset + limit``.
+
+    An item's score is the score of its metadata, plus the score of its
+    best-matching attachment weighted by ``COLUMN_WEIGHTS['fulltext']``.
+    """
+    scores = get_fulltext_ranking(db, module, sqlite_query, query)
+    rank = lambda key: (-scores[key], key)
+    # only sort as much of the ranking as is needed
+    if limit < 0:
+        ranked = sorted(scores, key=rank)[offset:]
+    else:
+        ranked = heapq.nsmallest(offset + limit, scores, key=rank)[offset:]
+    config.log.info('Number of results : {}'.format(len(scores)))
+    feedback = zq.backend.get_feedback(ranked)
+    # results' text is only used to narrow down cached results with,
+    # which full text results never are
+    return [(feedback[key], '') for key in ranked if key in feedback]
+
+
+### 1.2.2  --------------------------------------------------------------------
+def get_fulltext_ranking(db, module, sqlite_query, query):
+    """Score of every item matching ``query``, on its metadata or its
+    attachments' text."""
+    weights = get_column_weights('fulltext')
+    sql = get_item_sql(module, weights, get_item_columns('fulltext'),
+                       ranking=True)
+    if module != 'fts5':
+        pool.create_function(db, 'rank', 1, zq.backend.make_rank_func,
+                             tuple(weights))
+    scores = {}
+    for (key, score) in execute_sql(db, sql, (sqlite_query,)).fetchall():
+        scores[key] = get_score(module, score)
+    weight = config.COLUMN_WEIGHTS.get('fulltext', 1.0)
+    for (key, score) in get_fulltext_scores(query).items():
+        scores[key] = scores.get(key, 0.0) + weight * score
+    return scores
+
+
+### 1.2.3  --------------------------------------------------------------------
+def get_fulltext_scores(query):
+    """Score of the best-matching attachment of each item."""
+    db = zq.backend.fulltext_sqlite
+    meta = zq.backend.index_meta(db)
+    # the index is built in the background, and may not exist yet
+    if not meta:
+        return {}
+    module = meta.get('module', 'fts3')
+    if module == 'fts5':
+        score = 'bm25(fulltext)'
+    else:
+        score = 'rank(matchinfo(fulltext))'
+        pool.create_function(db, 'rank', 1, zq.backend.make_rank_func,
+                             (1.0,))
+    sql = """SELECT sources.parent, {} FROM fulltext
+             JOIN sources ON sources.id = fulltext.rowid
+             WHERE fulltext MATCH ?""".format(score)
+    fuzzy_query = make_item_fuzzy(query, module)
+    scores = {}
+    for (key, rank) in execute_sql(db, sql, (fuzzy_query,)).fetchall():
+        score = get_score(module, rank)
+        scores[key] = max(scores.get(key, score), score)
+    return scores
+
+
+### 1.2.4  --------------------------------------------------------------------
+def get_score(module, score):
+    """Turn a ranking from ``module`` into a score; higher is better."""
+    # `bm25()` scores are negative: the lower, the better the match
+    return -score if module == 'fts5' else score
 
 
 ## 1.3  -----------------------------------------------------------------------
+def get_name_hits(db, scope, query, sqlite_query):
+    """Find items with names (in ``config.TRIGRAM_COLUMNS``) that
+    contain each term of ``query``, or would with a few typos, but that
+    the index doesn't match ``sqlite_query`` on.
+
+    Candidates are the items that share enough trigrams with every
+    term; their names are then checked, and they are ranked on how
+    well they match.
+
+    :returns: ID of each found item, best match first
+    :rtype: :class:`list`
+    :raises: :class:`InvalidQuery` if the index can't parse
+        ``sqlite_query``
+
+    """
+    fields = [column for column in get_item_columns(scope)
+              if column in config.TRIGRAM_COLUMNS]
+    terms = normalize(query).split()
+    if not fields or not any(len(term) >= 3 for term in terms):
+        return []
+    candidates = None
+    for term in terms:
+        grams = trigrams(term)
+        # short terms are only checked against the candidates' names
+        if not grams:
+            continue
+        sql = """SELECT item_id FROM trigrams WHERE gram IN ({})
+                 GROUP BY item_id HAVING COUNT(*) >= ?""".format(
+            ', '.join('?' * len(grams)))
+        params = tuple(grams) + (max(1, len(grams) - 3 * get_typos(term)),)
+        ids = set(item_id for (item_id,) in execute_sql(db, sql, params))
+        candidates = ids if candidates is None else candidates & ids
+        if not candidates:
+            return []
+    candidates -= get_item_matches(db, scope, sqlite_query, query, candidates)
+    # many items share a name, so score each name only once
+    name_scores = {}
+    scores = {}
+    for (item_id, names) in get_names(db, candidates, fields).items():
+        for name in names:
+            if name not in name_scores:
+                name_scores[name] = [get_name_score(term, name)
+                                     for term in terms]
+        term_scores = [max(name_scores[name][i] for name in names)
+                       for i in range(len(terms))]
+        if all(term_scores):
+            scores[item_id] = sum(term_scores)
+    config.log.info('Number of name matches : {}'.format(len(scores)))
+    return sorted(scores, key=lambda x: (-scores[x], x))
+
+
+### 1.3.1  --------------------------------------------------------------------
+def get_typos(term):
+    """Number of typos forgiven in ``term``."""
+    # a typo can break three trigrams; at least two must be left
+    grams = len(term) - 2
+    return max(0, min(config.TRIGRAM_TYPOS, (grams - 2) // 3))
+
+
+### 1.3.2  --------------------------------------------------------------------
+def get_names(db, item_ids, fields):
+    """Names of each item in ``item_ids``, from ``fields`` only."""
+    item_ids = list(item_ids)
+    names = {}
+    # stay below SQLite's limit on bound parameters
+    for i in range(0, len(item_ids), 500):
+        chunk = item_ids[i:i + 500]
+        sql = """SELECT item_id, field, name FROM names
+                 WHERE item_id IN ({})""".format(', '.join('?' * len(chunk)))
+        for (item_id, field, name) in execute_sql(db, sql, chunk).fetchall():
+            if field in fields:
+                names.setdefault(item_id, []).append(name)
+    return names
+
+
+### 1.3.3  --------------------------------------------------------------------
+def get_item_matches(db, scope, sqlite_query, query, item_ids):
+    """Those of ``item_ids`` the index matches ``sqlite_query`` on (and,
+    in the ``fulltext`` scope, those whose attachments match ``query``).
+    Raises :class:`InvalidQuery` if the index can't parse either.
+    """
+    item_ids = sorted(item_ids)
+    matches = set()
+    # stay below SQLite's limit on bound parameters
+    for i in range(0, len(item_ids), 500):
+        chunk = item_ids[i:i + 500]
+        sql = """SELECT rowid FROM zotquery WHERE zotquery MATCH ?
+                 AND rowid IN ({})""".format(', '.join('?' * len(chunk)))
+        matches.update(item_id for (item_id,) in
+                       execute_sql(db, sql, [sqlite_query] + chunk))
+    if scope == 'fulltext':
+        keys = get_fulltext_scores(query)
+        matches.update(item_id for (item_id, (key, data)) in
+                       get_feedback(db, item_ids).items() if key in keys)
+    return matches
+
+
+### 1.3.4  --------------------------------------------------------------------
+def get_name_score(term, name):
+    """How well ``term`` matches ``name``: ``3`` if it starts a word,
+    ``2`` if it is inside one, less for each typo, and ``0`` if not at
+    all."""
+    words = tokenize(name)
+    if any(word.startswith(term) for word in words):
+        return 3
+    if term in name:
+        return 2
+    typos = get_typos(term)
+    if not typos or not words:
+        return 0
+    # the word, or as much of it as has been typed
+    distance = min(edit_distance(term, candidate, typos)
+                   for word in words
+                   for candidate in (word, word[:len(term)]))
+    return max(0, 1 - distance / (typos + 1.0))
+
+
+## 1.4  -----------------------------------------------------------------------
 def get_item_dict(key):
     
     item = data.get(key, None)
 
 
+## 1.5  -----------------------------------------------------------------------
+def get_feedback(db, item_ids):
+    """Key and Alfred feedback of each item in ``item_ids``; feedback
+    that can't be formatted is ``None``."""
+    item_ids = list(item_ids)
+    feedback = {}
+    # stay below SQLite's limit on bound parameters
+    for i in range(0, len(item_ids), 500):
+        chunk = item_ids[i:i + 500]
+        sql = """SELECT id, key, data FROM feedback
+                 WHERE id IN ({})""".format(', '.join('?' * len(chunk)))
+        for (item_id, key, data) in execute_sql(db, sql, chunk).fetchall():
+            feedback[item_id] = (key, data)
+    # results that couldn't be formatted when indexed
+    for (item_id, (key, data)) in feedback.items():
+        if data is None:
+            feedback[item_id] = (key, zq.backend.format_feedback(key))
+    return feedback
+
+
+## 1.6  -----------------------------------------------------------------------
+def count_item_matches(db, module, scope, sqlite_query, query):
+    """Number of items the index matches ``sqlite_query`` (or, in the
+    ``fulltext`` scope, ``query``) on."""
+    if scope == 'fulltext':
+        return len(get_fulltext_ranking(db, module, sqlite_query, query))
+    sql = "SELECT count(*) FROM zotquery WHERE zotquery MATCH ?"
+    return execute_sql(db, sql, (sqlite_query,)).fetchone()[0]
+
+
 #------------------------------------------------------------------------------
 #  Functions to search *for* groups
 #------------------------------------------------------------------------------
@@ -351,8 +455,8 @@ def get_item_dict(key):
 def search_for_groups(scope, query):
     # Generate appropriate sqlite query
     sqlite_query = make_group_sqlite_query(scope, query)
-    config.log.info('Item sqlite query : {}'.format(sqlite_query))
-    # Run sqlite query and get back item keys
+    config.log.info('Group sqlite query : {}'.format(sqlite_query))
+    # Run sqlite query and get back group names and keys
     coll_data = run_group_sqlite_query(sqlite_query)
     coll_dicts = [{'flag': scope, 'name': coll[0], 'key': coll[1]}
                   for coll in coll_data]
@@ -368,41 +472,45 @@ def search_for_groups(scope, query):
 ## 2.1  -----------------------------------------------------------------------
 def make_group_sqlite_query(scope, query):
     fuzzy_query = make_group_fuzzy(query)
-    column = get_group_column(scope)
-    return get_group_sql().format(col=column,
-                                  table=scope,
-                                  query=fuzzy_query)
+    kind = get_group_kind(scope)
+    # Match anywhere in the name, but rank names starting with `query` first
+    return (get_group_sql(), (kind, '%' + fuzzy_query, fuzzy_query))
 
 
 ### 2.1.1  --------------------------------------------------------------------
 def make_group_fuzzy(query):
-    return ''.join([query, '%'])
+    # Match normalized names, taking `query` literally
+    pattern = re.sub(r'([\\%_])', r'\\\1', normalize(query))
+    return ''.join([pattern, '%'])
 
 
 ### 2.1.2  --------------------------------------------------------------------
-def get_group_column(scope):
+def get_group_kind(scope):
     if scope == 'collections':
-        return 'collectionName'
+        return 'c'
     elif scope == 'tags':
-        return 'name'
+        return 't'
     else:
         raise Exception('Invalid group : `{}`'.format(scope))
 
 
 ### 2.1.3  --------------------------------------------------------------------
 def get_group_sql():
-    sections = ("SELECT {col}, key",
-                "FROM {table}",
-                "WHERE {col} LIKE '{query}'")
+    sections = ("SELECT name, key",
+                "FROM group_index",
+                "WHERE kind = ? AND folded LIKE ? ESCAPE '\\'",
+                "ORDER BY folded LIKE ? ESCAPE '\\' DESC,",
+                "items DESC, folded")
     sql_str = ' '.join(sections)
     return sql_str.strip()
 
 
 ## 2.2  -----------------------------------------------------------------------
 def run_group_sqlite_query(query):
-    db = zq.backend.cloned_sqlite
+    db = zq.backend.fts_sqlite
     config.log.info('Connecting to : `{}`'.format(db.split('/')[-1]))
-    results = execute_sql(db, query).fetchall()
+    (sql, params) = query
+    results = execute_sql(db, sql, params).fetchall()
     config.log.info('Number of results : {}'.format(len(results)))
     return results
 
@@ -412,31 +520,41 @@ def run_group_sqlite_query(query):
 #------------------------------------------------------------------------------
 
 # 3.  -------------------------------------------------------------------------
-def search_within_group(scope, query):
+def search_within_group(scope, query, offset=0):
     group_type = scope.split('-')[-1]
     # Read saved group info
     path = config.WF.cachefile('{}_query_result.txt'.format(group_type))
     group_id = utils.read_path(path)
-    group_name = get_group_name(group_id)
-    sqlite_query = make_in_group_sqlite_query(scope, query, group_name)
-    config.log.info('Item sqlite query : {}'.format(sqlite_query))
-    # Run sqlite query and get back item keys
-    item_keys = run_item_sqlite_query(sqlite_query)
-    # Get JSON data of user's Zotero library
-    data = utils.read_json(zq.backend.json_data)
-    results_dict = []
-    for key in item_keys:
-        item = data.get(key, None)
-        if item:
-            # Prepare dictionary for Alfred
-            formatter = ResultsFormatter(item)
-            alfred_dict = formatter.prepare_item_feedback()
-            results_dict.append(alfred_dict)
-    return results_dict
+    group = get_group_filter(group_id)
+    db = zq.backend.fts_sqlite
+    module = zq.backend.index_module(db)
+    sqlite_query = make_item_sqlite_query('general', query, module)
+    config.log.info('Item sqlite query : {} in {}'.format(sqlite_query,
+                                                          group))
+    # Run sqlite query and get back Alfred dictionaries, ready-made
+    zq.backend.update_feedback(db)
+    limit = config.RESULTS_LIMIT
+    results = run_item_sqlite_query(db, module, 'general', sqlite_query,
+                                    group, offset, limit + 1)
+    return ([json.loads(alfred_dict) for (alfred_dict, text)
+             in results[:limit]], len(results) > limit)
 
 
 ## 3.1  -----------------------------------------------------------------------
+def get_group_filter(group_arg):
+    """Get kind and key of group, and how deep to search below it"""
+    # Split group type from group ID
+    kind, uid = group_arg.split('_')
+    if kind not in ('c', 't'):
+        raise Exception('Invalid group id : `{}`'.format(group_arg))
+    # Depth of the deepest possible subcollection
+    depth = MAX_DEPTH if kind == 'c' and config.SUBCOLLECTIONS else 0
+    return (kind, uid, depth)
+
+
+## 3.2  -----------------------------------------------------------------------
 def get_group_name(group_arg):
+    """Get name of group from its ID"""
     # Split group type from group ID
     kind, uid = group_arg.split('_')
     if kind == 'c':
@@ -447,78 +565,74 @@ def get_group_name(group_arg):
         raise Exception('Invalid group id : `{}`'.format(group_arg))
 
 
-### 3.1.1  --------------------------------------------------------------------
+### 3.2.1  --------------------------------------------------------------------
 def get_collection_name(uid):
-    """Get name of tag from `key`"""
-    db = zq.backend.cloned_sqlite
-    config.log.info('Connecting to : `{}`'.format(db.split('/')[-1]))
-    sql_query = """SELECT collectionName
-                   FROM collections
-                   WHERE key = "{}" """.format(uid)
-    col_name = execute_sql(db, sql_query).fetchone()
-    return col_name[0]
+    """Get name of collection from `key`"""
+    return zq.backend.get_group_name(zq.backend.fts_sqlite, 'c', uid)
 
 
-### 3.1.2  --------------------------------------------------------------------
+### 3.2.2  --------------------------------------------------------------------
 def get_tag_name(uid):
-    db = zq.backend.cloned_sqlite
-    config.log.info('Connecting to : `{}`'.format(db.split('/')[-1]))
-    sql_query = """SELECT name
-                   FROM tags
-                   WHERE key = "{}" """.format(uid)
-    tag_name = execute_sql(db, sql_query).fetchone()
-    return tag_name[0]
+    """Get name of tag from `key`"""
+    return zq.backend.get_group_name(zq.backend.fts_sqlite, 't', uid)
 
 
-#### 3.1.1.1; 2.2.1; 1.2.1  ---------------------------------------------------
-def execute_sql(db, sql, context=None):
+#### 2.2.1; 1.2.1  ------------------------------------------------------------
+def execute_sql(db, sql, params=()):
     """Execute sqlite query and return sqlite object.
 
+    The query runs on the pooled connection to ``db``, so its results
+    must be fetched before the next query on ``db``.
+
     :param sql: SQL or SQLITE query string
     :type sql: :class:`unicode`
+    :param params: values bound to the query's placeholders
+    :type params: :class:`tuple`
     :returns: SQLITE object of executed query
     :rtype: :class:`object`
+    :raises: :class:`InvalidQuery` if a ``MATCH`` query is malformed
 
     """
-    con = sqlite3.connect(db)
-    with con:
-        cur = con.cursor()
-        if context:
-            context(con)
-        try:
-            return cur.execute(sql)
-        except sqlite3.OperationalError as err:
-            # If the query is invalid,
-            # show an appropriate warning and exit
-            if b'malformed MATCH' in err.message:
-                config.WF.add_item('Invalid query')
-                config.WF.send_feedback()
-                return 1
-            # Otherwise raise error for Workflow to catch and log
-            else:
-                raise err
-
-
-## 3.2  -----------------------------------------------------------------------
-def make_in_group_sqlite_query(scope, query, group):
-    fuzzy_query = make_item_fuzzy(query)
-    column = get_in_group_column(scope)
-    query = make_conjunctive_item_query(fuzzy_query, column, group)
-    return get_item_sql().format(query)
+    cur = pool.connect(db).cursor()
+    try:
+        return cur.execute(sql, params)
+    except sqlite3.OperationalError as err:
+        # If the query is invalid, let `search` show a warning
+        if (b'malformed MATCH' in err.message or
+                b'fts5: syntax error' in err.message):
+            raise InvalidQuery(err.message)
+        # Otherwise raise error for Workflow to catch and log
+        else:
+            raise err
 
 
-### 3.2.1  --------------------------------------------------------------------
-def get_in_group_column(scope):
-    return scope.split('-')[-1] + 's'
+#### 1.; 3.  -----------------------------------------------------------------
+def get_page(query):
+    """Split the ``config.MORE_RESULTS`` markers off the end of
+    ``query``; each marker skips a page of results.
 
+    :returns: ``(query, page)``
+    :rtype: :class:`tuple`
 
-### 3.2.2  --------------------------------------------------------------------
-def make_conjunctive_item_query(query, column, group):
-    # Prepare in-column search (remove error causing `'`)
-    specifier = ':'.join([column, group.replace("'", "")])
-    # Make conjunctive query
-    query = ' AND '.join([query, specifier])
-    return query
+    """
+    marker = re.escape(config.MORE_RESULTS)
+    match = re.search(r'(?:\s*{})+\s*$'.format(marker), query)
+    if not match:
+        return (query, 0)
+    markers = match.group().count(config.MORE_RESULTS)
+    return (query[:match.start()], markers)
+
+
+#### 1.; 3.  -----------------------------------------------------------------
+def get_more_item(query, page):
+    """Alfred dictionary of the item that shows the next page."""
+    start = (page + 1) * config.RESULTS_LIMIT
+    return {'title': 'More results…',
+            'subtitle': 'Show results {} to {}'.format(
+                start + 1, start + config.RESULTS_LIMIT),
+            'autocomplete': '{} {}'.format(
+                query, config.MORE_RESULTS * (page + 1)),
+            'valid': False}
 
 
 #------------------------------------------------------------------------------
@@ -528,25 +642,36 @@ def search(scope, query, wf):
     # Ensure inputs are Unicode
     scope = config.decode(scope)
     query = config.decode(query)
-    # Search for individual items
-    if scope in config.SCOPE_TYPES['items']:
-        found_items = search_for_items(scope, query)
-    # Search for individual groups
-    elif scope in config.SCOPE_TYPES['groups']:
-        found_items = search_for_groups(scope, query)
-    # Search for individual items in an individual group
-    elif scope in config.SCOPE_TYPES['in-groups']:
-        found_items = search_within_group(scope, query)
-    # Search for certain debugging options
-    elif scope in config.SCOPE_TYPES['meta']:
-        if scope == 'debug':
-            #search_debug()
-            pass
-        elif scope == 'new':
-            #search_new()
-            pass
-    else:
-        raise Exception('Unknown search flag: `{}`'.format(scope))
+    (query, page) = get_page(query)
+    offset = page * config.RESULTS_LIMIT
+    more = False
+    try:
+        # Search for individual items
+        if scope in config.SCOPE_TYPES['items']:
+            found_items, more = search_for_items(scope, query, offset)
+        # Search for individual groups
+        elif scope in config.SCOPE_TYPES['groups']:
+            found_items = search_for_groups(scope, query)
+        # Search for individual items in an individual group
+        elif scope in config.SCOPE_TYPES['in-groups']:
+            found_items, more = search_within_group(scope, query, offset)
+        # Search for certain debugging options
+        elif scope in config.SCOPE_TYPES['meta']:
+            if scope == 'debug':
+                #search_debug()
+                pass
+            elif scope == 'new':
+                #search_new()
+                pass
+        else:
+            raise Exception('Unknown search flag: `{}`'.format(scope))
+    except InvalidQuery as err:
+        config.log.info('Invalid query : {}'.format(err))
+        (found_items, more) = ([{'title': 'Invalid query'}], False)
 
     [wf.add_item(**item) for item in found_items]
+    if more:
+        wf.add_item(**get_more_item(query, page))
     wf.send_feedback()
+    # Results are served from the current index; update it for next time
+    zq.backend.schedule_refresh()
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright © 2014 stephen.margheim@gmail.com
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+from __future__ import unicode_literals
+
+# Standard Library
+import os
+import sys
+import json
+import glob
+import SocketServer
+from time import time
+from StringIO import StringIO
+
+# Internal Dependencies
+import config
+from lib import utils
+from lib.docopt import docopt
+from connections import pool
+from . import search
+from . import open as zq_open
+
+log = config.log
+
+# Code-paths of each action the server answers (cf. `resident.SERVED`)
+ACTIONS = {
+    'search': search.search,
+    'open': zq_open.open
+}
+
+
+#------------------------------------------------------------------------------
+# :class:`ResidentServer` -----------------------------------------------------
+#------------------------------------------------------------------------------
+
+class ResidentServer(SocketServer.UnixStreamServer):
+    """Answers `zotquery.py` requests on a Unix socket.
+
+    The server keeps the imported workflow, its settings and :obj:`zq`
+    loaded between requests. It exits after ``config.SERVER_IDLE``
+    seconds without a request, when asked to `quit`, or once the
+    workflow's code has changed since it started.
+
+    """
+    timeout = config.SERVER_IDLE
+
+    def __init__(self, path):
+        """Initialize class instance.
+
+        :param path: path to Unix socket
+        :type path: :class:`unicode`
+
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+        # only the user may connect, from the moment the socket exists
+        umask = os.umask(0o177)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path,
+                                                   RequestHandler)
+        finally:
+            os.umask(umask)
+        self.started = time()
+        self.stopping = False
+
+    def handle_timeout(self):
+        log.info('Resident server idle, exiting')
+        self.stopping = True
+
+    def is_stale(self):
+        """Has the workflow's code changed since the server started?
+
+        :rtype: :class:`boolean`
+
+        """
+        return any(os.stat(path).st_mtime > self.started
+                   for path in source_files())
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """Run one request, sent as a line of JSON, and reply in JSON.
+
+    """
+    def handle(self):
+        args = json.loads(self.rfile.readline().decode('utf-8'))['argv']
+        if args == ['quit'] or self.server.is_stale():
+            self.server.stopping = True
+            return self.reply({'status': 'stopped'})
+        start = time()
+        try:
+            output = run(args)
+        except Exception as err:
+            log.error(utils.full_stack())
+            return self.reply({'status': 'error', 'error': repr(err)})
+        log.info('Served {} in {:0.3}s'.format(args, time() - start))
+        self.reply({'status': 'ok', 'output': output})
+
+    def reply(self, data):
+        self.wfile.write(json.dumps(data).encode('utf-8'))
+
+
+#------------------------------------------------------------------------------
+# Functions -------------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+def source_files():
+    """Get the paths of the workflow's Python files: the `zotquery`
+    package, the scripts beside it and the bundled `workflow` library.
+
+    :rtype: :class:`list`
+
+    """
+    package = os.path.dirname(os.path.abspath(__file__))
+    root = os.path.dirname(package)
+    return [path
+            for folder in (package, os.path.join(package, 'lib'), root,
+                           os.path.join(root, 'workflow'))
+            for path in glob.glob(os.path.join(folder, '*.py'))]
+
+
+def run(args):
+    """Run `zotquery.py` arguments ``args`` and capture their output.
+
+    :param args: command line arguments
+    :type args: :class:`list`
+    :returns: what the action wrote to stdout
+    :rtype: :class:`unicode`
+
+    """
+    argv = docopt(config.__usage__,
+                  argv=[config.decode(arg) for arg in args],
+                  version=config.__version__)
+    actions = [name for name in ACTIONS if argv.get(name)]
+    if not actions:
+        raise ValueError('Action not served: {}'.format(args))
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        # drop feedback items left over from the previous request
+        config.WF._items = []
+        res = ACTIONS[actions[0]](argv['<flag>'], argv['<argument>'],
+                                  config.WF)
+        if res:
+            print(res)
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    if isinstance(output, bytes):
+        output = output.decode('utf-8')
+    return output
+
+
+def serve(path):
+    """Answer requests on the Unix socket at ``path`` until told to stop.
+
+    :param path: path to Unix socket
+    :type path: :class:`unicode`
+    :returns: exit status
+    :rtype: :class:`int`
+
+    """
+    server = ResidentServer(path)
+    log.info('Resident server listening on {}'.format(path))
+    try:
+        while not server.stopping:
+            server.handle_request()
+    finally:
+        server.server_close()
+        pool.close()
+        if os.path.exists(path):
+            os.unlink(path)
+    return 0
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright © 2014 stephen.margheim@gmail.com
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+from __future__ import unicode_literals
+
+# Standard Library
+import os
+import copy
+import json
+from time import time
+
+# Alfred-Workflow
+from workflow import PasswordNotFound
+
+
+#------------------------------------------------------------------------------
+# :class:`Settings` -----------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class Settings(object):
+    """Snapshot of ZotQuery's settings, shared by the whole process.
+
+    Stored and cached settings are read from disk once, and only read
+    again if their file has changed since (so a long-running process,
+    like the resident server, sees changes made by other processes).
+    Secrets are kept for ``ttl`` seconds. Nothing is written back
+    unless it differs from the snapshot.
+
+    """
+    def __init__(self, wf, secrets, ttl):
+        """Initialize class instance.
+
+        :param wf: a :class:`Workflow` instance
+        :type wf: :class:`object`
+        :param secrets: where secrets are kept (see :data:`BACKENDS`)
+        :type secrets: :class:`object`
+        :param ttl: seconds a secret is trusted without looking it up
+        :type ttl: :class:`int`
+
+        """
+        self.wf = wf
+        self.secrets = secrets
+        self.ttl = ttl
+        # path -> (signature of file, data read from it)
+        self._files = {}
+        # account -> (time of look-up, secret)
+        self._secrets = {}
+
+    # Stored settings (workflow's data dir) -----------------------------------
+
+    def stored(self, name):
+        """Get the settings stored (as JSON) under ``name``.
+
+        :param name: name of datastore
+        :type name: :class:`unicode`
+        :returns: stored data, or ``None``
+        :rtype: :class:`dict`
+
+        """
+        path = self.wf.datafile('{}.json'.format(name))
+        return self._load(path, lambda: self.wf.stored_data(name))
+
+    def store(self, name, data):
+        """Store the settings ``data`` (as JSON) under ``name``.
+
+        :param name: name of datastore
+        :type name: :class:`unicode`
+        :param data: settings to store
+        :type data: :class:`dict`
+        :returns: whether ``data`` had to be written
+        :rtype: :class:`boolean`
+
+        """
+        path = self.wf.datafile('{}.json'.format(name))
+        return self._save(path, data, lambda: self.wf.store_data(
+            name, data, serializer='json'))
+
+    # Cached settings (workflow's cache dir) ----------------------------------
+
+    def cached(self, name):
+        """Get the settings cached under ``name``.
+
+        :param name: name of datastore
+        :type name: :class:`unicode`
+        :returns: cached data, or ``None``
+        :rtype: :class:`dict`
+
+        """
+        path = self._cachefile(name)
+        return self._load(path, lambda: self.wf.cached_data(name, max_age=0))
+
+    def cache(self, name, data):
+        """Cache the settings ``data`` under ``name``.
+
+        :param name: name of datastore
+        :type name: :class:`unicode`
+        :param data: settings to cache
+        :type data: :class:`dict`
+        :returns: whether ``data`` had to be written
+        :rtype: :class:`boolean`
+
+        """
+        path = self._cachefile(name)
+        return self._save(path, data, lambda: self.wf.cache_data(name, data))
+
+    # Secrets -----------------------------------------------------------------
+
+    def secret(self, account):
+        """Get the secret saved at ``account``.
+
+        :param account: name of the account
+        :type account: :class:`unicode`
+        :returns: secret, or ``None`` if there is none
+        :rtype: :class:`unicode`
+
+        """
+        try:
+            (looked_up, value) = self._secrets[account]
+            if time() - looked_up < self.ttl:
+                return value
+        except KeyError:
+            pass
+        value = self.secrets.get(account)
+        self._secrets[account] = (time(), value)
+        return value
+
+    def save_secret(self, account, value):
+        """Save the secret ``value`` at ``account``.
+
+        :param account: name of the account
+        :type account: :class:`unicode`
+        :param value: the secret
+        :type value: :class:`unicode`
+        :returns: whether ``value`` had to be written
+        :rtype: :class:`boolean`
+
+        """
+        if self.secret(account) == value:
+            return False
+        self.secrets.set(account, value)
+        self._secrets[account] = (time(), value)
+        return True
+
+    # Helper methods ----------------------------------------------------------
+
+    def _load(self, path, loader):
+        signature = file_signature(path)
+        try:
+            (known, data) = self._files[path]
+            if known == signature:
+                return copy.deepcopy(data)
+        except KeyError:
+            pass
+        data = loader() if signature else None
+        self._files[path] = (signature, data)
+        return copy.deepcopy(data)
+
+    def _save(self, path, data, saver):
+        if self._load(path, lambda: None) == data and data is not None:
+            return False
+        saver()
+        self._files[path] = (file_signature(path), copy.deepcopy(data))
+        return True
+
+    def _cachefile(self, name):
+        return self.wf.cachefile('{}.{}'.format(name,
+                                               self.wf.cache_serializer))
+
+
+#------------------------------------------------------------------------------
+# Secrets backends ------------------------------------------------------------
+#------------------------------------------------------------------------------
+
+class Keychain(object):
+    """Secrets in the user's Keychain (each look-up runs `security`).
+
+    """
+    def __init__(self, wf):
+        self.wf = wf
+
+    def get(self, account):
+        try:
+            return self.wf.get_password(account)
+        except PasswordNotFound:
+            return None
+
+    def set(self, account, value):
+        self.wf.save_password(account, value)
+
+
+class SecretsFile(object):
+    """Secrets in a JSON file in the workflow's data dir, readable only
+    by the user. Stands in for the Keychain where there is none (e.g.
+    when testing on Linux).
+
+    """
+    def __init__(self, wf):
+        self.path = wf.datafile('secrets.json')
+
+    def get(self, account):
+        return self._read().get(account)
+
+    def set(self, account, value):
+        secrets = self._read()
+        secrets[account] = value
+        temp_path = self.path + '.tmp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as file_obj:
+            file_obj.write(json.dumps(secrets).encode('utf-8'))
+        os.rename(temp_path, self.path)
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as file_obj:
+                return json.loads(file_obj.read().decode('utf-8'))
+        except (IOError, ValueError):
+            return {}
+
+
+# Names of secrets backends (cf. `config.SECRETS_BACKEND`)
+BACKENDS = {
+    'keychain': Keychain,
+    'file': SecretsFile
+}
+
+
+def file_signature(path):
+    """Return ``(mtime, size)`` of the file at ``path``, or ``None`` if
+    it doesn't exist.
+
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
@@ -10,6 +10,9 @@ from __future__ import unicode_literals
 # Standard Library
 import os
 import re
+import sys
+import glob
+import json
 import os.path
 import subprocess
 
@@ -17,14 +20,19 @@ import subprocess
 import config
 from lib import pashua, utils
 from config import PropertyBase, stored_property
+from settings import file_signature
 
 # Alfred-Workflow
-from workflow import Workflow, web
+from workflow import web
 
 # create global methods from `Workflow()`
-WF = Workflow()
+WF = config.WF
+log = WF.logger
 decode = WF.decode
 
+# A Zotero setting in `prefs.js`: its name and its JavaScript value
+PREF = re.compile(r'user_pref\("extensions\.zotero\.([^"]+)",\s*(.+?)\);')
+
 
 #------------------------------------------------------------------------------
 # :class:`LocalZotero` --------------------------------------------------------
@@ -38,9 +46,13 @@ class LocalZotero(PropertyBase):
     | `original_sqlite`  | Zotero's internal sqlite database           |
     | `internal_storage` | Zotero's internal storage directory         |
     | `external_storage` | Zotero's external directory for attachments |
+    | `prefs_js`         | Zotero's preferences file                   |
+    | `prefs_signature`  | mtime and size of `prefs_js` when last read |
 
     Expects information to be stored in :file:`local_zotero.json`.
-    If file does not exist, it creates and stores dictionary.
+    If file does not exist, it creates and stores dictionary. The
+    stored paths are found again once `prefs_js` has changed, or
+    Zotero's database is no longer where it was.
 
     """
     def __init__(self, wf):
@@ -51,9 +63,23 @@ class LocalZotero(PropertyBase):
 
         """
         self.wf = wf
+        self._prefs_js = None
+        self._prefs = None
         # initialize base class, for access to `properties` dict
         PropertyBase.__init__(self, self.wf, secured=False)
 
+    def unsecure(self):
+        """Like :meth:`PropertyBase.unsecure`, but forgets the stored
+        paths if they may no longer be right.
+
+        """
+        name = utils.convert(self.__class__.__name__)
+        stored = config.SETTINGS.stored(name)
+        if stored and not self._is_valid(stored):
+            log.info('Zotero has changed, locating it again')
+            config.SETTINGS.store(name, None)
+        return PropertyBase.unsecure(self)
+
     # Properties --------------------------------------------------------------
 
     @stored_property
@@ -64,12 +90,9 @@ class LocalZotero(PropertyBase):
         :rtype: ``unicode``
 
         """
-        # Use `mdfind` to locate Zotero sqlite database
-        sqlites = self.find_name('zotero.sqlite')
-        if sqlites:
-            for item in sqlites:
-                if item.startswith('/Users'):
-                    return item
+        data_dir = self.data_dir()
+        if data_dir:
+            return os.path.join(data_dir, 'zotero.sqlite')
 
     @stored_property
     def internal_storage(self):
@@ -95,15 +118,101 @@ class LocalZotero(PropertyBase):
     def external_storage(self):
         """Return path to Zotero's external storage directory for attachments.
 
-        :returns: full path to directory
+        :returns: full path to directory, or ``''`` if none is set
         :rtype: ``unicode``
 
         """
         # Read `prefs.js` file for info
-        return self.get_pref('baseAttachmentPath')
+        return self.get_pref('baseAttachmentPath') or ''
+
+    @stored_property
+    def prefs_js(self):
+        """Return path to Zotero's preferences file.
+
+        :returns: full path to file, or ``''`` if none was found
+        :rtype: ``unicode``
+
+        """
+        if self._prefs_js is None:
+            self._prefs_js = self.find_prefs() or ''
+        return self._prefs_js
+
+    @stored_property
+    def prefs_signature(self):
+        """Return mtime and size of ``prefs_js``, to tell when it changes.
+
+        :rtype: :class:`list`
+
+        """
+        return prefs_signature(self.prefs_js)
 
     # Utility methods ---------------------------------------------------------
 
+    def data_dir(self):
+        """Find Zotero's data directory (the one with `zotero.sqlite`).
+
+        Tries the directory set in Zotero's preferences, then the
+        profile's `zotero` directory, then ``config.ZOTERO_DATA_DIRS``.
+        On a Mac, Spotlight is searched as a last resort.
+
+        :returns: full path to directory
+        :rtype: ``unicode``
+
+        """
+        candidates = []
+        if self.get_pref('useDataDir') is not False:
+            candidates.append(self.get_pref('dataDir'))
+        if self.prefs_js:
+            candidates.append(os.path.join(os.path.dirname(self.prefs_js),
+                                           'zotero'))
+        candidates.extend(os.path.expanduser(path)
+                          for path in config.ZOTERO_DATA_DIRS)
+        for path in filter(None, candidates):
+            if os.path.exists(os.path.join(path, 'zotero.sqlite')):
+                return path
+        for path in self.find_name('zotero.sqlite'):
+            if path.startswith('/Users'):
+                return os.path.dirname(path)
+
+    def find_prefs(self):
+        """Find the most recently used `prefs.js` with Zotero preferences.
+
+        Globs ``config.ZOTERO_PREFS_PATHS``, then (on a Mac) searches
+        Spotlight.
+
+        :returns: full path to file
+        :rtype: ``unicode``
+
+        """
+        paths = [path for pattern in config.ZOTERO_PREFS_PATHS
+                 for path in glob.glob(os.path.expanduser(pattern))]
+        if not paths:
+            paths = self.find_name('prefs.js')
+        paths = sorted(paths, key=os.path.getmtime, reverse=True)
+        for path in paths:
+            if 'extensions.zotero.' in utils.read_path(path):
+                return path
+        if paths:
+            return paths[0]
+
+    def prefs(self):
+        """Get Zotero's preferences in ``prefs_js``, read once.
+
+        :returns: values keyed on name, without `extensions.zotero.`
+        :rtype: :class:`dict`
+
+        """
+        if self._prefs is None:
+            self._prefs = {}
+            path = self.prefs_js
+            if path and os.path.exists(path):
+                for (name, value) in PREF.findall(utils.read_path(path)):
+                    try:
+                        self._prefs[name] = json.loads(value)
+                    except ValueError:
+                        self._prefs[name] = value
+        return self._prefs
+
     def get_pref(self, pref):
         """Retrieve the value for ``pref`` in Zotero's preferences.
 
@@ -113,29 +222,22 @@ class LocalZotero(PropertyBase):
         :rtype: ``unicode``
 
         """
-        dirs = self.find_name('prefs.js')
-        for path in dirs:
-            if 'Zotero' or 'Firefox' in path:
-                # Read text from file at `path`
-                prefs = utils.read_path(path)
-                pref_re = r'{}",\s"(.*?)"'.format(pref)
-                data_dir = re.search(pref_re, prefs)
-                try:
-                    return data_dir.group(1)
-                except AttributeError:
-                    pass
-        return None
+        return self.prefs().get(pref)
 
     @staticmethod
     def find_name(name):
         """Use `mdfind` to locate file given its ``name``.
 
+        Only available on a Mac; elsewhere, nothing is found.
+
         :param name: full name of desired file
         :type name: ``unicode`` or ``str``
         :returns: list of paths to named file
         :rtype: :class:`list`
 
         """
+        if sys.platform != 'darwin':
+            return []
         cmd = ['mdfind',
                'kMDItemFSName={}'.format(name),
                '-onlyin',
@@ -145,6 +247,23 @@ class LocalZotero(PropertyBase):
         output = [s.strip() for s in decode(output).split('\n')]
         return filter(None, output)
 
+    @staticmethod
+    def _is_valid(stored):
+        """Can the paths in ``stored`` still be trusted?"""
+        if stored.get('prefs_signature') != prefs_signature(
+                stored.get('prefs_js')):
+            return False
+        return os.path.exists(stored.get('original_sqlite') or '')
+
+
+def prefs_signature(path):
+    """Return ``[mtime, size]`` of the `prefs.js` at ``path``, or an
+    empty list if there is none.
+
+    """
+    signature = file_signature(path) if path else None
+    return list(signature) if signature else []
+
 
 #------------------------------------------------------------------------------
 # :class:`WebZotero` ----------------------------------------------------------
@@ -208,11 +327,11 @@ class WebZotero(PropertyBase):
             # Add a cancel button with default label
             cb.type=cancelbutton
         """.format(api=api, uid=uid)
-        # Run `pashua` dialog and save results to Keychain
+        # Run `pashua` dialog and save (changed) results to Keychain
         res_dict = pashua.run(conf, encoding='utf8', pashua_path=config.PASHUA)
         if res_dict['cb'] != '1':
-            self.wf.save_password('api_key', res_dict['api'])
-            self.wf.save_password('user_id', res_dict['id'])
+            config.SETTINGS.save_secret('api_key', res_dict['api'])
+            config.SETTINGS.save_secret('user_id', res_dict['id'])
 
     # Basic methods -----------------------------------------------------------
 